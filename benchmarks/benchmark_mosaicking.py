@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List, Union
+
+import numpy as np
+from osgeo import gdal, osr
+
+gdal.UseExceptions()
+
+repo_dir = Path(__file__).resolve().parents[1]
+sys.path.append(str(repo_dir))
+
+# (name, number of layers mosaicked per scene)
+CASES = {
+    "get_projection_counts": 1,
+    "reproject_data+merge_bursts": 1,
+    "warp_mosaic_bursts": 1,
+    "assemble_scene": 5,
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark util.geo mosaicking and reprojection on synthetic OPERA-like bursts."
+    )
+    parser.add_argument(
+        "--n_bursts", type=int, default=27, help="Number of bursts per scene (3 swaths)"
+    )
+    parser.add_argument(
+        "--width", type=int, default=2700, help="Burst width in pixels"
+    )
+    parser.add_argument(
+        "--height", type=int, default=800, help="Burst height in pixels"
+    )
+    parser.add_argument(
+        "--cases",
+        nargs="+",
+        default=list(CASES),
+        choices=list(CASES),
+        help="Mosaicking paths to benchmark",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path.cwd() / "benchmark_results.jsonl",
+        help="JSONL file to which results are appended",
+    )
+    parser.add_argument(
+        "--work_dir",
+        type=Path,
+        default=None,
+        help="Directory for synthetic data, defaults to a temporary directory",
+    )
+    return parser.parse_args()
+
+
+def utm_to_utm(x: float, y: float, src_epsg: int, dst_epsg: int) -> List[float]:
+    src = osr.SpatialReference()
+    src.ImportFromEPSG(src_epsg)
+    dst = osr.SpatialReference()
+    dst.ImportFromEPSG(dst_epsg)
+    for srs in [src, dst]:
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    x, y, _ = osr.CoordinateTransformation(src, dst).TransformPoint(x, y)
+    return [x, y]
+
+
+def make_synthetic_bursts(
+    out_dir: os.PathLike, n_bursts: int, width: int, height: int, seed: int = 0
+) -> List[Path]:
+    """
+    Takes:
+        out_dir: directory in which to write the bursts
+        n_bursts: number of bursts, laid out in 3 overlapping swaths
+        width, height: burst size in pixels
+        seed: random seed
+
+    Writes Float32 COG bursts on 30 m UTM grids with NaN no-data borders. The 1st swath
+    lies west of the UTM 17N/18N zone boundary and is written in EPSG:32617, the others
+    in EPSG:32618, so the scene straddles a zone boundary like real Sentinel-1 frames.
+
+    Returns: List of paths to the bursts
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    res = 30
+
+    # upper left corner of the scene in UTM 18N, just east of the 17N/18N boundary
+    scene_ulx, scene_uly = 250020.0, 5000010.0
+    bursts_per_swath = int(np.ceil(n_bursts / 3))
+
+    paths = []
+    for i in range(n_bursts):
+        swath, burst = divmod(i, bursts_per_swath)
+        ulx = scene_ulx + swath * (width - 200) * res
+        uly = scene_uly - burst * (height - 100) * res
+        epsg = 32618
+        if swath == 0:
+            epsg = 32617
+            ulx, uly = utm_to_utm(ulx, uly, 32618, epsg)
+            ulx, uly = round(ulx / res) * res, round(uly / res) * res
+
+        data = rng.gamma(2.0, 0.05, (height, width)).astype(np.float32)
+        data[:, :40] = np.nan
+        data[:, -40:] = np.nan
+
+        mem = gdal.GetDriverByName("MEM").Create(
+            "", width, height, 1, gdal.GDT_Float32
+        )
+        mem.SetGeoTransform((ulx, res, 0.0, uly, 0.0, -res))
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(epsg)
+        mem.SetProjection(srs.ExportToWkt())
+        band = mem.GetRasterBand(1)
+        band.SetNoDataValue(np.nan)
+        band.WriteArray(data)
+
+        pth = out_dir / f"OPERA_L2_RTC-S1_T000-{i:06d}-IW{swath + 1}_VV.tif"
+        gdal.Translate(str(pth), mem, format="COG", creationOptions=["COMPRESS=DEFLATE"])
+        paths.append(pth)
+    return paths
+
+
+def _files_written(case_dir: Path, start_ns: int) -> int:
+    return sum(
+        1 for p in case_dir.rglob("*") if p.is_file() and p.stat().st_mtime_ns >= start_ns
+    )
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return peak / 1024
+
+
+def _run_case(case: str, case_dir: str) -> Dict:
+    # runs in a fresh process so that peak RSS is measured per case
+    import util.geo as util
+
+    case_dir = Path(case_dir)
+    layer_dirs = sorted(d for d in case_dir.iterdir() if d.is_dir())
+    bursts = sorted(layer_dirs[0].glob("*.tif"))
+    epsgs = util.get_projection_counts(bursts) if case != "get_projection_counts" else None
+    predominant_epsg = (
+        None if not epsgs or len(epsgs) == 1 else max(epsgs, key=epsgs.get)
+    )
+
+    start_ns = time.time_ns()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    if case == "get_projection_counts":
+        util.get_projection_counts(bursts)
+    elif case == "reproject_data+merge_bursts":
+        if predominant_epsg:
+            for pth in bursts:
+                util.reproject_data(pth, predominant_epsg)
+        util.merge_bursts("synthetic", bursts, case_dir / "mosaic.tif")
+    elif case == "warp_mosaic_bursts":
+        util.warp_mosaic_bursts(bursts, case_dir / "mosaic.tif", predominant_epsg)
+    elif case == "assemble_scene":
+        layer_bursts = {d.name: sorted(d.glob("*.tif")) for d in layer_dirs}
+        outputs = {layer: case_dir / f"{layer}_mosaic.tif" for layer in layer_bursts}
+        util.assemble_scene(layer_bursts, outputs, predominant_epsg)
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+
+    return {
+        "wall_time_s": wall_time,
+        "cpu_time_s": cpu_time,
+        "peak_rss_mb": _peak_rss_mb(),
+        "files_written": _files_written(case_dir, start_ns),
+    }
+
+
+def run_case(
+    case: str, bursts: List[Path], work_dir: Path
+) -> Dict[str, Union[str, int, float]]:
+    """
+    Takes:
+        case: name of the mosaicking path to benchmark (see CASES)
+        bursts: List of paths to synthetic bursts
+        work_dir: directory in which to stage the case
+
+    Copies the bursts into a fresh case directory, so in-place reprojection does not
+    affect other cases, and runs the case in a fresh process with a cold raster index
+
+    Returns: Dictionary of benchmark results for the case
+    """
+    case_dir = work_dir / case.replace("+", "_")
+    if case_dir.exists():
+        shutil.rmtree(case_dir)
+    for i in range(CASES[case]):
+        layer_dir = case_dir / f"layer_{i}"
+        layer_dir.mkdir(parents=True)
+        for pth in bursts:
+            shutil.copy2(pth, layer_dir / pth.name)
+
+    index_path = work_dir / f"{case_dir.name}_raster_metadata.sqlite"
+    for pth in work_dir.glob(f"{index_path.name}*"):
+        pth.unlink()
+    os.environ["CALVAL_RTC_RASTER_INDEX"] = str(index_path)
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        result = executor.submit(_run_case, case, str(case_dir)).result()
+
+    n_bursts = len(bursts) * CASES[case]
+    input_mb = sum(p.stat().st_size for p in bursts) * CASES[case] / 2**20
+    result.update(
+        {
+            "case": case,
+            "n_bursts": n_bursts,
+            "input_mb": input_mb,
+            "mb_per_s": input_mb / result["wall_time_s"],
+            "bursts_per_s": n_bursts / result["wall_time_s"],
+        }
+    )
+    return result
+
+
+def get_git_commit() -> Union[str, None]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=repo_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def main():
+    args = parse_args()
+    work_dir = args.work_dir or Path(tempfile.mkdtemp(prefix="calval_rtc_benchmark_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    print(f"Writing {args.n_bursts} synthetic bursts -> {work_dir / 'bursts'}")
+    bursts = make_synthetic_bursts(
+        work_dir / "bursts", args.n_bursts, args.width, args.height
+    )
+
+    run_info = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": get_git_commit(),
+        "gdal_version": gdal.__version__,
+        "cpu_count": os.cpu_count(),
+        "burst_shape": [args.height, args.width],
+    }
+    with open(args.output, "a") as f:
+        for case in args.cases:
+            print(f"Running {case}")
+            result = {**run_info, **run_case(case, bursts, work_dir)}
+            f.write(f"{json.dumps(result)}\n")
+            print(
+                f"  {result['wall_time_s']:.2f} s, {result['mb_per_s']:.1f} MB/s, "
+                f"{result['bursts_per_s']:.2f} bursts/s, "
+                f"peak RSS {result['peak_rss_mb']:.0f} MB, "
+                f"{result['files_written']} files written"
+            )
+    print(f"Results appended to {args.output}")
+
+    if args.work_dir is None:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
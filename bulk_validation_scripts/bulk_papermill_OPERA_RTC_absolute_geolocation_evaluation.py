@@ -1,15 +1,12 @@
 import argparse
 import os
-import subprocess
 import sys
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
-from typing import List
-from urllib.parse import urlparse
+from typing import Callable, Dict, List, Tuple, Union
 
 import earthaccess
-import pandas as pd
-import papermill as pm
-from opensarlab_lib import work_dir
 from osgeo import gdal
 from tqdm.auto import tqdm
 
@@ -18,6 +15,39 @@ gdal.UseExceptions()
 current = Path("..").resolve()
 sys.path.append(str(current))
 import util.geo as util
+from util.burst_store import BurstStore
+from util.instrument import configure, span
+from util.linking import LinkingTables, get_linking_tables
+from util.manifest import (
+    DOWNLOADED,
+    LISTED,
+    MERGED,
+    REPROJECTED,
+    RunManifest,
+    fingerprint,
+)
+from util.notebooks import init_results_csv, run_notebook_jobs
+from util.pipeline import (
+    destination_paths,
+    download_files,
+    earthaccess_download,
+    run_scene_pipeline,
+)
+from util.reports import REPORT_MODES
+from util.remote import configure_remote_reads, get_corner_reflectors, write_point_windows
+
+CALVAL_MODULE = "Absolute Geolocation Evaluation"
+# columns of the results CSV written by absolute_location_evaluation.ipynb
+ALE_RESULTS_FIELDS = [
+    "Granule",
+    "Year",
+    "Month",
+    "Day",
+    "Easting_Bias",
+    "sig_Easting_Bias",
+    "Northing_Bias",
+    "sig_Northing_Bias",
+]
 
 
 def parse_args() -> argparse.Namespace:
@@ -30,98 +60,228 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Skip downloading and mosaicking of bursts and validate previously prepared data.",
     )
+    parser.add_argument(
+        "--warp_mosaic",
+        default=False,
+        action="store_true",
+        help="Reproject and mosaic bursts in a single warp pass without rewriting the downloaded bursts.",
+    )
+    parser.add_argument(
+        "--remote_read",
+        default=False,
+        action="store_true",
+        help="Read only the windows around corner reflectors from the remote bursts instead of downloading them.",
+    )
+    parser.add_argument(
+        "--window_size",
+        type=int,
+        default=81,
+        help="Width, in pixels, of the windows read around each corner reflector with --remote_read.",
+    )
+    parser.add_argument(
+        "--download_workers",
+        type=int,
+        default=4,
+        help="Number of bursts to download concurrently.",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=1,
+        help="Number of scenes to download ahead of the scene being mosaicked.",
+    )
+    parser.add_argument(
+        "--min_free_gb",
+        type=float,
+        default=0,
+        help="Pause downloading while less disk space is free and scenes await mosaicking.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of scene notebooks to run concurrently, each in its own process.",
+    )
+    parser.add_argument(
+        "--job_memory_gb",
+        type=float,
+        default=0,
+        help="Memory used by one scene notebook; caps --jobs to the available memory.",
+    )
+    parser.add_argument(
+        "--reports",
+        choices=REPORT_MODES,
+        default="sync",
+        help="sync: render each report after its notebook; deferred: render reports in the background and finish the notebooks first; none: skip reports (rerun with --skip_download to render them later).",
+    )
+    parser.add_argument(
+        "--burst_store",
+        type=Path,
+        default=None,
+        help="Shared store of downloaded products, linked into this run's data directories.",
+    )
+    parser.add_argument(
+        "--burst_store_quota_gb",
+        type=float,
+        default=None,
+        help="Evict the least recently used products not used by an active run above this size.",
+    )
     return parser.parse_args()
 
 
-def get_scene_df() -> pd.DataFrame:
-    linked_data_csv = Path.cwd().parent / "linking-data/opera_rtc_table.csv"
-
-    # load burst urls for site/calval module
-    calval_module = "Absolute Geolocation Evaluation"
-    df = pd.read_csv(linked_data_csv)
-    return df.where(
-        (df.Site == "California")
-        & (df.Orbital_Path == 64)
-        & (df.CalVal_Module == calval_module)
-    ).dropna()
-
-
-def is_valid_url(url: str) -> bool:
-    try:
-        result = urlparse(url)
-        return all([result.scheme, result.netloc])
-    except AttributeError:
-        return False
-
-
 def download_bursts(
-    scene_id: str, df: pd.DataFrame, rtc_dir: os.PathLike
+    scene_id: str,
+    tables: LinkingTables,
+    parent_data_dir: os.PathLike,
+    manifest: RunManifest,
+    download_workers: int = 4,
+    download: Callable = earthaccess_download,
 ) -> List[os.PathLike]:
+    rtc_dir = parent_data_dir / f"OPERA_L2-RTC_{scene_id}_30_v1.0"
+    rtc_dir.mkdir(exist_ok=True, parents=True)
+
     # Create data directories
     vv_burst_dir = rtc_dir / "vv_bursts"
     vv_burst_dir.mkdir(exist_ok=True, parents=True)
 
     # Find VV URLs for scene_id
-    vv_urls = (
-        df.where(df.S1_Scene_IDs == scene_id).dropna().vv_url.tolist()[0].split(" ")
-    )
-
-    # sanitize URLs
-    vv_urls = [url for url in vv_urls if is_valid_url(url)]
+    vv_urls = tables.scene(scene_id, CALVAL_MODULE).vv_urls
 
     # download bursts
-    print(f"Downloading bursts for S1 scene: {scene_id}")
-    for burst_url in vv_urls:
-        earthaccess.download(burst_url, vv_burst_dir)
+    url_dirs = [(url, vv_burst_dir) for url in vv_urls]
+    download_fp = fingerprint(values=vv_urls)
+    if not manifest.is_done(
+        scene_id, DOWNLOADED, download_fp, outputs=destination_paths(url_dirs)
+    ):
+        print(f"Downloading bursts for S1 scene: {scene_id}")
+        with span("download", scene_id):
+            download_files(url_dirs, download=download, max_workers=download_workers)
+        manifest.mark(scene_id, DOWNLOADED, download_fp)
 
     # return paths to downloaded bursts
     return list(vv_burst_dir.glob("*VV.tif"))
 
 
-def absolute_geolocation_evaluation(parent_data_dir: os.PathLike, args: object):
-    data_dirs = [
-        p for p in parent_data_dir.glob("*") if not str(p.name).startswith(".")
-    ]
+def mosaic_scene(
+    scene_id: str,
+    vv_bursts: List[os.PathLike],
+    parent_data_dir: os.PathLike,
+    manifest: RunManifest,
+    warp_mosaic: bool = False,
+):
+    rtc_dir = parent_data_dir / f"OPERA_L2-RTC_{scene_id}_30_v1.0"
+    output = rtc_dir / f"OPERA_L2_RTC-S1_VV_{scene_id}_30_v1.0_mosaic.tif"
+
+    # skip scenes already mosaicked from the same bursts
+    burst_dir = rtc_dir / "vv_bursts"
+    merge_fp = fingerprint([burst_dir], warp_mosaic)
+    if manifest.is_done(scene_id, MERGED, merge_fp, outputs=[output]):
+        return
+
+    with span("merge", scene_id):
+        # reproject all bursts to predominant CRS
+        epsgs = util.get_projection_counts(vv_bursts)
+        predominant_epsg = None if len(epsgs) == 1 else max(epsgs, key=epsgs.get)
+        if warp_mosaic:
+            util.warp_mosaic_bursts(vv_bursts, output, predominant_epsg)
+            manifest.mark(scene_id, MERGED, merge_fp)
+            return
+        if predominant_epsg:
+            for pth in vv_bursts:
+                util.reproject_data(pth, predominant_epsg)
+        manifest.mark(scene_id, REPROJECTED)
+
+        # merge bursts into a single scene
+        util.merge_bursts(scene_id, vv_bursts, output)
+    # fingerprint after reprojection, which rewrites the bursts in place
+    manifest.mark(scene_id, MERGED, fingerprint([burst_dir], warp_mosaic))
+
+
+def read_cr_windows(
+    scene_id: str,
+    tables: LinkingTables,
+    parent_data_dir: os.PathLike,
+    site: str,
+    manifest: RunManifest,
+    window_size: int = 81,
+):
+    rtc_dir = parent_data_dir / f"OPERA_L2-RTC_{scene_id}_30_v1.0"
+    rtc_dir.mkdir(exist_ok=True, parents=True)
+    output = rtc_dir / f"OPERA_L2_RTC-S1_VV_{scene_id}_30_v1.0_mosaic.tif"
+
+    # skip scenes whose windows were already read from the same bursts
+    vv_urls = tables.scene(scene_id, CALVAL_MODULE).vv_urls
+    merge_fp = fingerprint(values=[vv_urls, "remote", window_size])
+    if manifest.is_done(scene_id, MERGED, merge_fp, outputs=[output]):
+        return
 
+    # read the windows around the corner reflectors into a sparse mosaic
+    crs = get_corner_reflectors(site, util.get_acquisition_time(scene_id))
+    print(f"Reading corner reflector windows for S1 scene: {scene_id}")
+    with span("read_windows", scene_id):
+        covering = write_point_windows(
+            vv_urls, list(zip(crs.lon, crs.lat)), output, half_size=window_size // 2
+        )
+    print(f"Read {len(crs)} corner reflector windows from {len(covering)} bursts")
+    manifest.mark(scene_id, MERGED, merge_fp)
+
+
+def absolute_geolocation_jobs(
+    parent_data_dir: os.PathLike,
+    site: str,
+    orbital_path: int,
+    data_dirs: Union[List[os.PathLike], None] = None,
+) -> Tuple[Dict[str, List[Dict]], Path]:
+    # one job per scene directory (default: every scene in parent_data_dir)
+    if data_dirs is None:
+        data_dirs = [
+            p for p in parent_data_dir.glob("*") if not str(p.name).startswith(".")
+        ]
+
+    results_dir = parent_data_dir.parent / f"output_OPERA_RTC_ALE_{site}_{orbital_path}"
     output_dirs = [
-        p.parents[1]
-        / f"output_OPERA_RTC_ALE_{args.site}_{args.orbital_path}/absolute_geolocation_evaluation_{p.name.split('RTC_')[1]}"
+        results_dir / f"absolute_geolocation_evaluation_{p.name.split('RTC_')[1]}"
         for p in data_dirs
     ]
 
-    parameters = {"data_dir": "", "savepath": ""}
-
-    with work_dir(Path.cwd().parent / "absolute_geolocation_evaluation"):
-        for i, d in enumerate(tqdm(data_dirs)):
-            print(f"Performing Absolute Geolocation Evaluation on {d}")
-            parameters["data_dir"] = str(d)
-            parameters["savepath"] = str(output_dirs[i])
-            output_dirs[i].mkdir(parents=True, exist_ok=True)
-            output = (
-                output_dirs[i]
-                / f"output_{Path(d).name}_absolute_location_evaluation.ipynb"
-            )
-            output_html = Path(output).with_suffix('.html')
-            output_pdf = Path(output).with_suffix('.pdf')
-            pm.execute_notebook(
-                Path.cwd() / "absolute_location_evaluation.ipynb",
-                output,
-                kernel_name="python3",
-                parameters=parameters,
-            )
+    jobs = {}
+    for i, d in enumerate(data_dirs):
+        output_dirs[i].mkdir(parents=True, exist_ok=True)
+        output = (
+            output_dirs[i]
+            / f"output_{Path(d).name}_absolute_location_evaluation.ipynb"
+        )
+        jobs[d.name.split("RTC_")[1]] = [
+            {
+                "notebook": "absolute_location_evaluation.ipynb",
+                "output": output,
+                "parameters": {"data_dir": str(d), "savepath": str(output_dirs[i])},
+                "inputs": sorted(Path(d).glob("*_mosaic.tif")),
+            }
+        ]
+    if jobs:
+        # the notebooks append their results to a CSV shared by the site/orbit run
+        init_results_csv(results_dir / f"{site}_ALE30-Results.csv", ALE_RESULTS_FIELDS)
+    return jobs, results_dir
 
-            subprocess.run(
-                [f"jupyter nbconvert {output} --to html"],
-                shell=True,
-            )
-            subprocess.run(
-                [
-                    f"pandoc {output_html} "
-                    f"-o {output_pdf} "
-                    "--pdf-engine=weasyprint"
-                ],
-                shell=True,
-            )
+
+def absolute_geolocation_evaluation(
+    parent_data_dir: os.PathLike, args: object, manifest: RunManifest
+):
+    jobs, results_dir = absolute_geolocation_jobs(
+        parent_data_dir, args.site, args.orbital_path
+    )
+    if not jobs:
+        return
+    run_notebook_jobs(
+        jobs,
+        Path.cwd().parent / "absolute_geolocation_evaluation",
+        manifest=manifest,
+        n_jobs=args.jobs,
+        log_dir=results_dir / "logs",
+        job_memory_gb=args.job_memory_gb,
+        reports=args.reports,
+    )
 
 
 def main():
@@ -130,32 +290,66 @@ def main():
         Path.cwd().parents[1]
         / f"OPERA_L2-RTC_CalVal/OPERA_RTC_ALE_{args.site}_{args.orbital_path}/input_OPERA_data"
     )
+    manifest = RunManifest(parent_data_dir.parent / "run_manifest.sqlite")
+    # per-stage timings; summarize with summarize_spans.py
+    configure(parent_data_dir.parent / "spans.jsonl")
     if not args.skip_download:
         # collect CalVal data access info
-        df = get_scene_df()
-        scenes = list(df.S1_Scene_IDs)
-
-        # download CalVal bursts and mosaic into full S1 scenes
-        earthaccess.login()
-        for scene_id in tqdm(scenes):
-            rtc_dir = parent_data_dir / f"OPERA_L2-RTC_{scene_id}_30_v1.0"
-            rtc_dir.mkdir(exist_ok=True, parents=True)
-            output = rtc_dir / f"OPERA_L2_RTC-S1_VV_{scene_id}_30_v1.0_mosaic.tif"
-            if output.exists():
-                continue
-            vv_bursts = download_bursts(scene_id, df, rtc_dir)
-
-            # reproject all bursts to predominant CRS
-            epsgs = util.get_projection_counts(vv_bursts)
-            predominant_epsg = None if len(epsgs) == 1 else max(epsgs, key=epsgs.get)
-            if predominant_epsg:
-                for pth in vv_bursts:
-                    util.reproject_data(pth, predominant_epsg)
-
-            # merge bursts into a single scene
-            util.merge_bursts(scene_id, vv_bursts, output)
-
-    absolute_geolocation_evaluation(parent_data_dir, args)
+        tables = get_linking_tables(
+            site=args.site, orbital_path=args.orbital_path, calval_module=CALVAL_MODULE
+        )
+        scenes = [
+            scene.scene_id
+            for scene in tables.scenes(args.site, args.orbital_path, CALVAL_MODULE)
+        ]
+        for scene_id in scenes:
+            manifest.mark(scene_id, LISTED)
+
+        if args.remote_read:
+            # GDAL reads the bursts with the Earthdata credentials in ~/.netrc
+            earthaccess.login(persist=True)
+            configure_remote_reads()
+            for scene_id in tqdm(scenes):
+                read_cr_windows(
+                    scene_id,
+                    tables,
+                    parent_data_dir,
+                    args.site,
+                    manifest,
+                    window_size=args.window_size,
+                )
+        else:
+            # download CalVal bursts for the next scene while mosaicking the current one
+            earthaccess.login()
+            store = (
+                BurstStore(args.burst_store, args.burst_store_quota_gb)
+                if args.burst_store
+                else None
+            )
+            download = store.download if store else earthaccess_download
+            with store.active_run(str(parent_data_dir)) if store else nullcontext():
+                run_scene_pipeline(
+                    tqdm(scenes),
+                    partial(
+                        download_bursts,
+                        tables=tables,
+                        parent_data_dir=parent_data_dir,
+                        manifest=manifest,
+                        download_workers=args.download_workers,
+                        download=download,
+                    ),
+                    partial(
+                        mosaic_scene,
+                        parent_data_dir=parent_data_dir,
+                        manifest=manifest,
+                        warp_mosaic=args.warp_mosaic,
+                    ),
+                    prefetch=args.prefetch,
+                    disk_path=parent_data_dir,
+                    min_free_gb=args.min_free_gb,
+                )
+
+    absolute_geolocation_evaluation(parent_data_dir, args, manifest)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,13 @@
 import argparse
 import os
-import re
-import subprocess
 import sys
 from datetime import datetime
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
-from urllib.parse import urlparse
-from zipfile import ZipFile
+from typing import Callable, Dict, List, Tuple, Union
 
 import earthaccess
-import pandas as pd
-import papermill as pm
-from opensarlab_lib import work_dir
 from osgeo import gdal
 from tqdm.auto import tqdm
 
@@ -20,6 +16,36 @@ gdal.UseExceptions()
 current = Path("..").resolve()
 sys.path.append(str(current))
 import util.geo as util
+from util.burst_store import BurstStore
+from util.instrument import configure, span
+from util.linking import LinkingTables, get_linking_tables
+from util.manifest import (
+    DOWNLOADED,
+    LISTED,
+    MERGED,
+    REPROJECTED,
+    RunManifest,
+    fingerprint,
+)
+from util.notebooks import init_results_csv, run_notebook_jobs
+from util.pipeline import (
+    destination_paths,
+    download_files,
+    earthaccess_download,
+    run_scene_pipeline,
+)
+from util.reports import REPORT_MODES
+
+CALVAL_MODULE = "Coregistration"
+# columns of the per-pair results CSV written by coregistration.ipynb
+PER_PAIR_RESULTS_FIELDS = [
+    "stack",
+    "polarization",
+    "per pair mean tile mean x",
+    "per pair mean tile mean y",
+    "per pair STD tile mean x",
+    "per pair STD tile mean y",
+]
 
 
 def parse_args() -> argparse.Namespace:
@@ -40,27 +66,63 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Delete intermediary data",
     )
+    parser.add_argument(
+        "--warp_mosaic",
+        default=False,
+        action="store_true",
+        help="Reproject and mosaic bursts in a single warp pass without rewriting the downloaded bursts.",
+    )
+    parser.add_argument(
+        "--download_workers",
+        type=int,
+        default=4,
+        help="Number of bursts to download concurrently.",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=1,
+        help="Number of scenes to download ahead of the scene being mosaicked.",
+    )
+    parser.add_argument(
+        "--min_free_gb",
+        type=float,
+        default=0,
+        help="Pause downloading while less disk space is free and scenes await mosaicking.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of polarization notebooks to run concurrently, each in its own process.",
+    )
+    parser.add_argument(
+        "--job_memory_gb",
+        type=float,
+        default=0,
+        help="Memory used by one polarization notebook; caps --jobs to the available memory.",
+    )
+    parser.add_argument(
+        "--reports",
+        choices=REPORT_MODES,
+        default="sync",
+        help="sync: render each report after its notebook; deferred: render reports in the background and finish the notebooks first; none: skip reports (rerun with --skip_download to render them later).",
+    )
+    parser.add_argument(
+        "--burst_store",
+        type=Path,
+        default=None,
+        help="Shared store of downloaded products, linked into this run's data directories.",
+    )
+    parser.add_argument(
+        "--burst_store_quota_gb",
+        type=float,
+        default=None,
+        help="Evict the least recently used products not used by an active run above this size.",
+    )
     return parser.parse_args()
 
 
-def get_scene_df(args: object) -> pd.DataFrame:
-    # unzip linked_data.csv
-    zip_path = Path.cwd().parent / "linking-data/opera_rtc_table.csv.zip"
-    linked_data_csv = Path.cwd().parent / "linking-data/opera_rtc_table.csv"
-    if not linked_data_csv.exists():
-        with ZipFile(zip_path, "r") as zObject:
-            zObject.extractall(path=zip_path.parent)
-
-    # load burst urls for site/calval module
-    calval_module = "Coregistration"
-    df = pd.read_csv(linked_data_csv)
-    return df.where(
-        (df.Site == args.site)
-        & (df.Orbital_Path == args.orbital_path)
-        & (df.CalVal_Module == calval_module)
-    ).dropna()
-
-
 def was_reported(acquisition_time: datetime, args: object) -> bool:
     # limit scenes to those reported in Oct 2023 coregistration validation
     if args.site == "Delta Junction":
@@ -77,15 +139,105 @@ def was_reported(acquisition_time: datetime, args: object) -> bool:
     return start_time <= acquisition_time <= end_time
 
 
-def is_valid_url(url: str) -> bool:
-    try:
-        result = urlparse(url)
-        return all([result.scheme, result.netloc])
-    except AttributeError:
-        return False
-
-
-def coregistration(parent_data_dir: os.PathLike, args: object):
+def download_bursts(
+    scene_id: str,
+    tables: LinkingTables,
+    parent_data_dir: os.PathLike,
+    args: object,
+    manifest: RunManifest,
+    download: Callable = earthaccess_download,
+) -> Union[Tuple[List[os.PathLike], List[os.PathLike]], None]:
+    acquisition_time = util.get_acquisition_time(scene_id)
+    if not was_reported(acquisition_time, args):
+        return None
+
+    # define/create paths to data dirs
+    rtc_dir = parent_data_dir / f"OPERA_L2-RTC_{scene_id}_30_v1.0"
+    vv_burst_dir = rtc_dir / "vv_bursts"
+    vh_burst_dir = rtc_dir / "vh_bursts"
+    for pth in [rtc_dir, vv_burst_dir, vh_burst_dir]:
+        pth.mkdir(exist_ok=True, parents=True)
+
+    # find burst URLs for scene_id
+    scene = tables.scene(scene_id, CALVAL_MODULE)
+    vh_urls = scene.vh_urls
+    vv_urls = scene.vv_urls
+
+    # download bursts
+    path_dict = {vv_burst_dir: vv_urls, vh_burst_dir: vh_urls}
+    url_dirs = [(url, pth) for pth, urls in path_dict.items() for url in urls]
+    download_fp = fingerprint(values=[vv_urls, vh_urls])
+    if not manifest.is_done(
+        scene_id, DOWNLOADED, download_fp, outputs=destination_paths(url_dirs)
+    ):
+        print(f"Downloading bursts for S1 scene: {scene_id}")
+        with span("download", scene_id):
+            download_files(
+                url_dirs, download=download, max_workers=args.download_workers
+            )
+        manifest.mark(scene_id, DOWNLOADED, download_fp)
+    return list(vv_burst_dir.glob("*VV.tif")), list(vh_burst_dir.glob("*VH.tif"))
+
+
+def mosaic_scene(
+    scene_id: str,
+    burst_paths: Tuple[List[os.PathLike], List[os.PathLike]],
+    parent_data_dir: os.PathLike,
+    manifest: RunManifest,
+    warp_mosaic: bool = False,
+):
+    vv_bursts, vh_bursts = burst_paths
+    rtc_dir = parent_data_dir / f"OPERA_L2-RTC_{scene_id}_30_v1.0"
+    vv_burst_dir = rtc_dir / "vv_bursts"
+    vh_burst_dir = rtc_dir / "vh_bursts"
+    vh_output = rtc_dir / f"OPERA_L2_RTC-S1_VH_{scene_id}_30_v1.0_mosaic.tif"
+    vv_output = rtc_dir / f"OPERA_L2_RTC-S1_VV_{scene_id}_30_v1.0_mosaic.tif"
+
+    # skip scenes already mosaicked from the same bursts
+    outputs = {vv_output: vv_bursts, vh_output: vh_bursts}
+    merge_fp = fingerprint([vv_burst_dir, vh_burst_dir], warp_mosaic)
+    if manifest.is_done(scene_id, MERGED, merge_fp, outputs=list(outputs)):
+        return
+
+    with span("merge", scene_id):
+        # reproject all bursts to predominant CRS
+        epsgs = util.get_projection_counts(vv_bursts)
+        predominant_epsg = None if len(epsgs) == 1 else max(epsgs, key=epsgs.get)
+        if warp_mosaic:
+            for output, bursts in outputs.items():
+                util.warp_mosaic_bursts(bursts, output, predominant_epsg)
+            manifest.mark(scene_id, MERGED, merge_fp)
+            return
+        if predominant_epsg:
+            for bursts in [vv_bursts, vh_bursts]:
+                for pth in bursts:
+                    util.reproject_data(pth, predominant_epsg)
+        manifest.mark(scene_id, REPROJECTED)
+
+        # merge VH and VV bursts into a single scenes
+        for output, bursts in outputs.items():
+            util.merge_bursts(scene_id, bursts, output)
+    # fingerprint after reprojection, which rewrites the bursts in place
+    merge_fp = fingerprint([vv_burst_dir, vh_burst_dir], warp_mosaic)
+    manifest.mark(scene_id, MERGED, merge_fp)
+
+
+def coregistration_jobs(
+    parent_data_dir: os.PathLike,
+    site: str,
+    orbital_path: int,
+    delete_intermediary: bool = False,
+    data_dirs: Union[List[os.PathLike], None] = None,
+) -> Tuple[Dict[str, List[Dict]], Path]:
+    # one job per polarization, each over the stack of the scene directories
+    # (default: every scene in parent_data_dir)
+    if data_dirs is None:
+        data_dirs = list(parent_data_dir.glob("*"))
+    data_dirs = sorted(
+        Path(d)
+        for d in data_dirs
+        if Path(d).is_dir() and Path(d).name.startswith("OPERA_L2-RTC")
+    )
 
     # True to delete mosaicked RTCs and static files, False to save
     delete_mosaics = False
@@ -94,10 +246,10 @@ def coregistration(parent_data_dir: os.PathLike, args: object):
 
     polarizations = ["VV", "VH"]
 
-    # for i, d in enumerate(stack_dirs):
+    jobs = {}
     for p in polarizations:
 
-        if args.delete_intermediary:
+        if delete_intermediary:
             cleanup_list = (
                 f"{p} amplitude data, "
                 f"flattened {p} amplitude data, "
@@ -110,6 +262,7 @@ def coregistration(parent_data_dir: os.PathLike, args: object):
         parameters = {
             "polarization": p,
             "stack_dir": str(parent_data_dir),
+            "scene_dirs": [str(d) for d in data_dirs],
             "delete_mosaics": delete_mosaics,
             "cleanup_list": cleanup_list,
         }
@@ -117,31 +270,44 @@ def coregistration(parent_data_dir: os.PathLike, args: object):
         output_dir.mkdir(exist_ok=True)
         output = (
             output_dir
-            / f"output_{args.site.replace(' ', '_')}_{args.orbital_path}_{p}_OPERA_RTC_Coregistration.ipynb"
+            / f"output_{site.replace(' ', '_')}_{orbital_path}_{p}_OPERA_RTC_Coregistration.ipynb"
+        )
+        mosaics = sorted(
+            m for d in data_dirs for m in d.glob(f"OPERA_L2_RTC-S1_{p}_*_mosaic.tif")
         )
-        output_html = Path(output).with_suffix('.html')
-        output_pdf = Path(output).with_suffix('.pdf')
-
-        with work_dir(Path.cwd().parent / "coregistration"):
-            pm.execute_notebook(
-                "coregistration.ipynb",
-                output,
-                kernel_name="python3",
-                parameters=parameters,
-            )
 
-            subprocess.run(
-                [f"jupyter nbconvert {output} --to html"],
-                shell=True,
-            )
-            subprocess.run(
-                [
-                    f"pandoc {output_html} "
-                    f"-o {output_pdf} "
-                    "--pdf-engine=weasyprint"
-                ],
-                shell=True,
-            )
+        jobs[f"stack_{p}"] = [
+            {
+                "notebook": "coregistration.ipynb",
+                "output": output,
+                "parameters": parameters,
+                "inputs": mosaics,
+            }
+        ]
+
+    # the notebooks append their results to a CSV shared by both polarizations
+    init_results_csv(
+        output_dir / f"{parent_data_dir.name}_per_pair_tile_offset_means.csv",
+        PER_PAIR_RESULTS_FIELDS,
+    )
+    return jobs, output_dir
+
+
+def coregistration(
+    parent_data_dir: os.PathLike, args: object, manifest: RunManifest
+):
+    jobs, output_dir = coregistration_jobs(
+        parent_data_dir, args.site, args.orbital_path, args.delete_intermediary
+    )
+    run_notebook_jobs(
+        jobs,
+        Path.cwd().parent / "coregistration",
+        manifest=manifest,
+        n_jobs=args.jobs,
+        log_dir=output_dir / "logs",
+        job_memory_gb=args.job_memory_gb,
+        reports=args.reports,
+    )
 
 
 def main():
@@ -150,72 +316,52 @@ def main():
         Path.cwd().parents[1]
         / f"OPERA_L2-RTC_CalVal/OPERA_RTC_Coregistration_{args.site.replace(' ', '_')}_{args.orbital_path}/input_OPERA_data"
     )
+    manifest = RunManifest(parent_data_dir.parent / "run_manifest.sqlite")
+    # per-stage timings; summarize with summarize_spans.py
+    configure(parent_data_dir.parent / "spans.jsonl")
     if not args.skip_download:
         # collect CalVal data access info
-        df = get_scene_df(args)
-        scenes = list(df.S1_Scene_IDs)
-
-        # download CalVal bursts and mosaic into full S1 scenes
+        tables = get_linking_tables(
+            site=args.site, orbital_path=args.orbital_path, calval_module=CALVAL_MODULE
+        )
+        scenes = [
+            scene.scene_id
+            for scene in tables.scenes(args.site, args.orbital_path, CALVAL_MODULE)
+        ]
+        for scene_id in scenes:
+            manifest.mark(scene_id, LISTED)
+
+        # download CalVal bursts for the next scene while mosaicking the current one
         earthaccess.login()
-        for scene_id in tqdm(scenes):
-            # define/create paths to data dirs
-            rtc_dir = parent_data_dir / f"OPERA_L2-RTC_{scene_id}_30_v1.0"
-            vv_burst_dir = rtc_dir / "vv_bursts"
-            vh_burst_dir = rtc_dir / "vh_bursts"
-
-            vh_output = rtc_dir / f"OPERA_L2_RTC-S1_VH_{scene_id}_30_v1.0_mosaic.tif"
-            vv_output = rtc_dir / f"OPERA_L2_RTC-S1_VV_{scene_id}_30_v1.0_mosaic.tif"
-
-            acquisition_time = util.get_acquisition_time(scene_id)
-            if not was_reported(acquisition_time, args) or (
-                vh_output.exists() and vv_output.exists()
-            ):
-                continue
-
-            # create data directories
-            for pth in [rtc_dir, vv_burst_dir, vh_burst_dir]:
-                pth.mkdir(exist_ok=True, parents=True)
-
-            # download bursts
-            vh_urls = (
-                df.where(df.S1_Scene_IDs == scene_id)
-                .dropna()
-                .vh_url.tolist()[0]
-                .split(" ")
-            )
-            vv_urls = (
-                df.where(df.S1_Scene_IDs == scene_id)
-                .dropna()
-                .vv_url.tolist()[0]
-                .split(" ")
+        store = (
+            BurstStore(args.burst_store, args.burst_store_quota_gb)
+            if args.burst_store
+            else None
+        )
+        download = store.download if store else earthaccess_download
+        with store.active_run(str(parent_data_dir)) if store else nullcontext():
+            run_scene_pipeline(
+                tqdm(scenes),
+                partial(
+                    download_bursts,
+                    tables=tables,
+                    parent_data_dir=parent_data_dir,
+                    args=args,
+                    manifest=manifest,
+                    download=download,
+                ),
+                partial(
+                    mosaic_scene,
+                    parent_data_dir=parent_data_dir,
+                    manifest=manifest,
+                    warp_mosaic=args.warp_mosaic,
+                ),
+                prefetch=args.prefetch,
+                disk_path=parent_data_dir,
+                min_free_gb=args.min_free_gb,
             )
 
-            # sanitize URLs
-            vh_urls = [url for url in vh_urls if is_valid_url(url)]
-            vv_urls = [url for url in vv_urls if is_valid_url(url)]
-
-            # download bursts
-            path_dict = {vv_burst_dir: vv_urls, vh_burst_dir: vh_urls}
-            print(f"Downloading bursts for S1 scene: {scene_id}")
-            for pth in path_dict:
-                for burst_url in path_dict[pth]:
-                    earthaccess.download(burst_url, pth)
-            vv_bursts = list(vv_burst_dir.glob("*VV.tif"))
-            vh_bursts = list(vh_burst_dir.glob("*VH.tif"))
-
-            # reproject all bursts to predominant CRS
-            epsgs = util.get_projection_counts(vv_bursts)
-            predominant_epsg = None if len(epsgs) == 1 else max(epsgs, key=epsgs.get)
-            if predominant_epsg:
-                for bursts in [vv_bursts, vh_bursts]:
-                    for pth in bursts:
-                        util.reproject_data(pth, predominant_epsg)
-
-            # merge VH and VV bursts into a single scenes
-            for output, bursts in {vv_output: vv_bursts, vh_output: vh_bursts}.items():
-                util.merge_bursts(scene_id, bursts, output)
-
-    coregistration(parent_data_dir, args)
+    coregistration(parent_data_dir, args, manifest)
 
 
 if __name__ == "__main__":
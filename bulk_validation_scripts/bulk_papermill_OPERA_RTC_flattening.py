@@ -1,17 +1,16 @@
 import argparse
+import multiprocessing
 import os
 import re
-import subprocess
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
-from typing import Union, Dict, List
-from urllib.parse import urlparse
+from typing import Callable, Union, Dict, List, Tuple
 
 import earthaccess
-import pandas as pd
-import papermill as pm
-from opensarlab_lib import work_dir
 from osgeo import gdal
 
 gdal.UseExceptions()
@@ -19,6 +18,29 @@ gdal.UseExceptions()
 current = Path("..").resolve()
 sys.path.append(str(current))
 import util.geo as util
+from util.burst_store import BurstStore
+from util.flattening import flatten_scene, landcover_clip
+from util.instrument import configure, span
+from util.landcover import LandcoverStore
+from util.linking import LinkingTables, get_linking_tables
+from util.manifest import (
+    COMPUTED,
+    DOWNLOADED,
+    LISTED,
+    MERGED,
+    RunManifest,
+    fingerprint,
+)
+from util.notebooks import run_notebook_jobs
+from util.pipeline import (
+    destination_paths,
+    download_files,
+    earthaccess_download,
+    run_scene_pipeline,
+)
+from util.reports import REPORT_MODES
+
+CALVAL_MODULE = "Flattening"
 
 
 def parse_args() -> argparse.Namespace:
@@ -35,28 +57,75 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Skip downloading and mosaicking of bursts and validate previously prepared data.",
     )
+    parser.add_argument(
+        "--warp_mosaic",
+        default=False,
+        action="store_true",
+        help="Reproject and mosaic bursts in a single warp pass without rewriting the downloaded bursts.",
+    )
+    parser.add_argument(
+        "--stack",
+        default=False,
+        action="store_true",
+        help="Also write all five mosaicked layers to a single multi-band GeoTiff.",
+    )
+    parser.add_argument(
+        "--download_workers",
+        type=int,
+        default=4,
+        help="Number of bursts and static files to download concurrently.",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=1,
+        help="Number of scenes to download ahead of the scene being mosaicked.",
+    )
+    parser.add_argument(
+        "--min_free_gb",
+        type=float,
+        default=0,
+        help="Pause downloading while less disk space is free and scenes await mosaicking.",
+    )
+    parser.add_argument(
+        "--compute_only",
+        default=False,
+        action="store_true",
+        help="Write the results CSVs with util.flattening, without running the notebooks or rendering reports.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of scenes whose notebooks run concurrently, each in its own process.",
+    )
+    parser.add_argument(
+        "--job_memory_gb",
+        type=float,
+        default=0,
+        help="Memory used by one scene's notebooks; caps --jobs to the available memory.",
+    )
+    parser.add_argument(
+        "--reports",
+        choices=REPORT_MODES,
+        default="sync",
+        help="sync: render each report after its notebook; deferred: render reports in the background and finish the notebooks first; none: skip reports (rerun with --skip_download to render them later).",
+    )
+    parser.add_argument(
+        "--burst_store",
+        type=Path,
+        default=None,
+        help="Shared store of downloaded products, linked into this run's data directories.",
+    )
+    parser.add_argument(
+        "--burst_store_quota_gb",
+        type=float,
+        default=None,
+        help="Evict the least recently used products not used by an active run above this size.",
+    )
     return parser.parse_args()
 
 
-def get_rtc_df(args: object) -> pd.DataFrame:
-    opera_rtc_csv = Path.cwd().parent / "linking-data/opera_rtc_table.csv"
-
-    # load dataframe with burst urls for site/calval module
-    calval_module = "Flattening"
-    df_rtc = pd.read_csv(opera_rtc_csv)
-    return df_rtc.where(
-        (df_rtc.Site == args.site)
-        & (df_rtc.Orbital_Path == args.orbital_path)
-        & (df_rtc.CalVal_Module == calval_module)
-    ).dropna()
-
-
-def get_static_df() -> pd.DataFrame:
-    # load dataframe with static file URLs by burst ID
-    opera_static_csv = Path.cwd().parent / "linking-data/opera_rtc_static_table.csv"
-    return pd.read_csv(opera_static_csv)
-
-
 def was_reported(acquisition_time: datetime, scene_id: str, args: object) -> bool:
     # limit scenes to those reported in Oct 2023 flattening validation
     if args.site == "Delta Junction":
@@ -79,52 +148,16 @@ def was_reported(acquisition_time: datetime, scene_id: str, args: object) -> boo
         return True
 
 
-def build_url_dict(df_rtc: pd.DataFrame, df_static: pd.DataFrame, dirs, scene_id: str) -> Union[Dict, None]:
+def build_url_dict(tables: LinkingTables, dirs, scene_id: str) -> Union[Dict, None]:
+    scene = tables.scene(scene_id, CALVAL_MODULE)
+    static_urls = tables.static_urls(scene)
     scene_burst_dict = {
-        dirs["vh_burst_dir"]: df_rtc.where(df_rtc.S1_Scene_IDs == scene_id)
-        .dropna()
-        .vh_url.tolist()[0]
-        .split(" "),
-        dirs["vv_burst_dir"]: df_rtc.where(df_rtc.S1_Scene_IDs == scene_id)
-        .dropna()
-        .vv_url.tolist()[0]
-        .split(" "),
-        dirs["mask_burst_dir"]: [],
-        dirs["inc_angle_burst_dir"]: [],
-        dirs["local_inc_angle_burst_dir"]: [],
+        dirs["vh_burst_dir"]: scene.vh_urls,
+        dirs["vv_burst_dir"]: scene.vv_urls,
+        dirs["mask_burst_dir"]: static_urls["mask"],
+        dirs["inc_angle_burst_dir"]: static_urls["incidence_angle"],
+        dirs["local_inc_angle_burst_dir"]: static_urls["local_incidence_angle"],
     }
-
-    # sanitize RTC URLs
-    scene_burst_dict[dirs["vh_burst_dir"]] = [
-        url for url in scene_burst_dict[dirs["vh_burst_dir"]] if is_valid_url(url)
-    ]
-    scene_burst_dict[dirs["vh_burst_dir"]] = [
-        url for url in scene_burst_dict[dirs["vh_burst_dir"]] if is_valid_url(url)
-    ]
-
-    # Get burst IDs
-    opera_ids = list(
-        df_rtc.where(df_rtc.S1_Scene_IDs == scene_id).dropna().opera_rtc_ids
-    )[0]
-    burst_id_regex = r"(?<=OPERA_L2_RTC-S1_)T\d{3}-\d{6}-IW[123]"
-    burst_ids = re.findall(burst_id_regex, opera_ids)
-
-    for burst in burst_ids:
-        df_burst_static = df_static.where(df_static.burst_id == burst).dropna()
-        try: 
-            static_url_list = df_burst_static.product_urls.iloc[0].split(" ")
-        except IndexError:
-            continue
-
-        # sanitize static URLs
-        static_url_list = [url for url in static_url_list if is_valid_url(url)]
-        for url in static_url_list:
-            if "v1.0_mask.tif" in url:
-                scene_burst_dict[dirs["mask_burst_dir"]].append(url)
-            elif "v1.0_incidence_angle.tif" in url:
-                scene_burst_dict[dirs["inc_angle_burst_dir"]].append(url)
-            elif "v1.0_local_incidence_angle.tif" in url:
-                scene_burst_dict[dirs["local_inc_angle_burst_dir"]].append(url)
     burst_count = len(scene_burst_dict[dirs["vh_burst_dir"]])
     for ds in scene_burst_dict:
         if len(scene_burst_dict[ds]) != burst_count:
@@ -133,20 +166,97 @@ def build_url_dict(df_rtc: pd.DataFrame, df_static: pd.DataFrame, dirs, scene_id
     return scene_burst_dict
 
 
-def is_valid_url(url: str) -> bool:
-    try:
-        result = urlparse(url)
-        return all([result.scheme, result.netloc])
-    except AttributeError:
-        return False
+def download_bursts_and_static(
+    scene_burst_dict: dict,
+    download_workers: int = 4,
+    download: Callable = earthaccess_download,
+):
+    download_files(
+        [(url, pth) for pth, urls in scene_burst_dict.items() for url in urls],
+        download=download,
+        max_workers=download_workers,
+    )
+
+
+def download_scene(
+    scene_id: str,
+    tables: LinkingTables,
+    input_data_dir: os.PathLike,
+    args: object,
+    manifest: RunManifest,
+    download: Callable = earthaccess_download,
+) -> Union[Dict[str, List[os.PathLike]], None]:
+    acquisition_time = util.get_acquisition_time(scene_id)
+    if not was_reported(acquisition_time, scene_id, args):
+        print(f"skipping scene: {scene_id}")
+        return None
+
+    # define/create paths to data dirs
+    rtc_dir = input_data_dir / f"OPERA_L2-RTC_{scene_id}_30_v1.0"
+    dirs = {
+        "rtc_dir": rtc_dir,
+        "vv_burst_dir": rtc_dir / "vv_bursts",
+        "vh_burst_dir": rtc_dir / "vh_bursts",
+        "inc_angle_burst_dir": rtc_dir / "ellipsoidal_inc_angle_bursts",
+        "local_inc_angle_burst_dir": rtc_dir / "local_inc_angle_bursts",
+        "mask_burst_dir": rtc_dir / "layover_shadow_bursts",
+    }
+    for pth in dirs.values():
+        pth.mkdir(exist_ok=True, parents=True)
+
+    # build a dict containing urls to bursts for a given scene by data type
+    scene_burst_dict = build_url_dict(tables, dirs, scene_id)
+    if not scene_burst_dict:
+        print(f"skipping scene: {scene_id}")
+        return None
+
+    # download data
+    download_fp = fingerprint(
+        values={str(pth): urls for pth, urls in scene_burst_dict.items()}
+    )
+    burst_paths = destination_paths(
+        (url, pth) for pth, urls in scene_burst_dict.items() for url in urls
+    )
+    if not manifest.is_done(scene_id, DOWNLOADED, download_fp, outputs=burst_paths):
+        print(f"Downloading RTC bursts and static data for S1 scene: {scene_id}")
+        with span("download", scene_id):
+            download_bursts_and_static(scene_burst_dict, args.download_workers, download)
+        manifest.mark(scene_id, DOWNLOADED, download_fp)
+
+    # collect paths to downloaded data
+    return {
+        "vv_bursts": list(dirs["vv_burst_dir"].glob("*VV.tif")),
+        "vh_bursts": list(dirs["vh_burst_dir"].glob("*VH.tif")),
+        "mask_bursts": list(dirs["mask_burst_dir"].glob("*mask.tif")),
+        "local_inc_angle_bursts": list(
+            dirs["local_inc_angle_burst_dir"].glob("*local_incidence_angle.tif")
+        ),
+        "inc_angle_bursts": list(
+            dirs["inc_angle_burst_dir"].glob("*incidence_angle.tif")
+        ),
+    }
 
 
-def download_bursts_and_static(scene_burst_dict: dict):
-    for pth, urls in scene_burst_dict.items():
-        for url in urls:
-            local_pth = pth / url.split("/")[-1]
-            if not local_pth.exists():
-                earthaccess.download(url, pth)
+def mosaic_scene(
+    scene_id: str,
+    burst_pth_dict: Dict[str, List[os.PathLike]],
+    input_data_dir: os.PathLike,
+    manifest: RunManifest,
+    warp_mosaic: bool = False,
+    stack: bool = False,
+):
+    # reproject bursts to predominant CRS (if necessary) and merge into full S1 scenes
+    epsgs = util.get_projection_counts(burst_pth_dict["vv_bursts"])
+    predominant_epsg = None if len(epsgs) == 1 else max(epsgs, key=epsgs.get)
+    merge_bursts(
+        burst_pth_dict,
+        predominant_epsg,
+        input_data_dir / f"OPERA_L2-RTC_{scene_id}_30_v1.0",
+        scene_id,
+        manifest,
+        warp_mosaic=warp_mosaic,
+        stack=stack,
+    )
 
 
 def merge_bursts(
@@ -154,73 +264,61 @@ def merge_bursts(
     predominant_epsg: str,
     rtc_dir: os.PathLike,
     scene_id: str,
+    manifest: RunManifest,
+    warp_mosaic: bool = False,
+    stack: bool = False,
 ):
-    vv_merge_str = ""
-    vh_merge_str = ""
-    mask_merge_str = ""
-    local_inc_angle_merge_str = ""
-    inc_angle_merge_str = ""
-
-    for data_type, pths in burst_pth_dict.items():
-        for pth in pths:
-            # build merge strings
-            if data_type == "vv_bursts":
-                vv_merge_str = f"{vv_merge_str} {str(pth)}"
-            elif data_type == "vh_bursts":
-                vh_merge_str = f"{vh_merge_str} {str(pth)}"
-            elif data_type == "mask_bursts":
-                mask_merge_str = f"{mask_merge_str} {str(pth)}"
-            elif data_type == "local_inc_angle_bursts":
-                local_inc_angle_merge_str = f"{local_inc_angle_merge_str} {str(pth)}"
-            elif data_type == "inc_angle_bursts":
-                inc_angle_merge_str = f"{inc_angle_merge_str} {str(pth)}"
-
-            # project to predominant UTM (when necessary)
-            if predominant_epsg:
-                util.reproject_data(pth, predominant_epsg)
-
-    no_data_val = util.get_no_data_val(burst_pth_dict["vv_bursts"][0])
-    # merge vv bursts
-    vv_output = rtc_dir / f"OPERA_L2_RTC-S1_VV_{scene_id}_30_v1.0_mosaic.tif"
-    vv_merge_command = f"gdal_merge.py -n {no_data_val} -a_nodata {no_data_val} -o {vv_output} {vv_merge_str}"
-    print(f"Merging bursts -> {vv_output}")
-    subprocess.run([vv_merge_command], shell=True)
-
-    # merge vh bursts
-    vh_output = rtc_dir / f"OPERA_L2_RTC-S1_VH_{scene_id}_30_v1.0_mosaic.tif"
-    vh_merge_command = f"gdal_merge.py -n {no_data_val} -a_nodata {no_data_val} -o {vh_output} {vh_merge_str}"
-    print(f"Merging bursts -> {vh_output}")
-    subprocess.run([vh_merge_command], shell=True)
-
-    # merge layover/shadow mask bursts
-    mask_output = rtc_dir / f"OPERA_L2_RTC-S1_mask_{scene_id}_30_v1.0_mosaic.tif"
-    mask_merge_command = f"gdal_merge.py -n {no_data_val} -a_nodata {no_data_val} -o {mask_output} {mask_merge_str}"
-    print(f"Merging bursts -> {mask_output}")
-    subprocess.run([mask_merge_command], shell=True)
-
-    # merge local incidence angle bursts
-    local_inc_angle_output = (
-        rtc_dir / f"OPERA_L2_RTC-S1_local_incidence_angle_{scene_id}_30_v1.0_mosaic.tif"
-    )
-    local_inc_angle_merge_command = f"gdal_merge.py -n {no_data_val} -a_nodata {no_data_val} -o {local_inc_angle_output} {local_inc_angle_merge_str}"
-    print(f"Merging bursts -> {local_inc_angle_output}")
-    subprocess.run([local_inc_angle_merge_command], shell=True)
-
-    # merge incidence angle bursts
-    inc_angle_output = (
-        rtc_dir / f"OPERA_L2_RTC-S1_incidence_angle_{scene_id}_30_v1.0_mosaic.tif"
+    outputs = {
+        "vv_bursts": rtc_dir / f"OPERA_L2_RTC-S1_VV_{scene_id}_30_v1.0_mosaic.tif",
+        "vh_bursts": rtc_dir / f"OPERA_L2_RTC-S1_VH_{scene_id}_30_v1.0_mosaic.tif",
+        "mask_bursts": rtc_dir / f"OPERA_L2_RTC-S1_mask_{scene_id}_30_v1.0_mosaic.tif",
+        "local_inc_angle_bursts": (
+            rtc_dir / f"OPERA_L2_RTC-S1_local_incidence_angle_{scene_id}_30_v1.0_mosaic.tif"
+        ),
+        "inc_angle_bursts": (
+            rtc_dir / f"OPERA_L2_RTC-S1_incidence_angle_{scene_id}_30_v1.0_mosaic.tif"
+        ),
+    }
+    stack_output = (
+        rtc_dir / f"OPERA_L2_RTC-S1_stack_{scene_id}_30_v1.0_mosaic.tif" if stack else None
     )
-    inc_angle_merge_command = f"gdal_merge.py -n {no_data_val} -a_nodata {no_data_val} -o {inc_angle_output} {inc_angle_merge_str}"
-    print(f"Merging bursts -> {inc_angle_output}")
-    subprocess.run([inc_angle_merge_command], shell=True)
-
 
-def flatten(input_data_dir: os.PathLike):
+    # skip scenes already mosaicked from the same bursts
+    bursts = [pth for paths in burst_pth_dict.values() for pth in paths]
+    merge_options = {"warp_mosaic": warp_mosaic, "stack": stack}
+    done_outputs = list(outputs.values()) + ([stack_output] if stack_output else [])
+    if manifest.is_done(
+        scene_id, MERGED, fingerprint(bursts, merge_options), outputs=done_outputs
+    ):
+        print(f"Skipping mosaicking of S1 scene: {scene_id}")
+        return
+
+    # reproject (when necessary) and mosaic all layers concurrently on a common grid
+    with span("merge", scene_id):
+        util.assemble_scene(
+            burst_pth_dict,
+            outputs,
+            predominant_epsg,
+            warp_mosaic=warp_mosaic,
+            stack_output=stack_output,
+        )
+    # fingerprint after reprojection, which rewrites the bursts in place
+    manifest.mark(scene_id, MERGED, fingerprint(bursts, merge_options))
+
+
+def flattening_jobs(
+    input_data_dir: os.PathLike,
+    data_dirs: Union[List[os.PathLike], None] = None,
+) -> Tuple[Dict[str, List[Dict]], Path]:
+    # one job per scene directory (default: every scene in input_data_dir)
     parent_data_dir = input_data_dir.parent
 
-    data_dirs = list(input_data_dir.glob("*"))
+    if data_dirs is None:
+        data_dirs = list(input_data_dir.glob("*"))
     data_dirs = [
-        str(d) for d in data_dirs if d.is_dir() and d.name.startswith("OPERA_L2-RTC")
+        str(d)
+        for d in map(Path, data_dirs)
+        if d.is_dir() and d.name.startswith("OPERA_L2-RTC")
     ]
 
     print(data_dirs)
@@ -252,96 +350,137 @@ def flatten(input_data_dir: os.PathLike):
         for p in input_dirs_prep_2
     ]
 
-    with work_dir(Path.cwd().parent / "flattening"):
-        for i, d in enumerate(data_dirs):
-            opera_id = d.split("/")[-1]
-            output_dir = (
-                output_parent_dir / f"Output_Tree_Cover_Slope_Comparisons_{opera_id}"
-            )
-            output_dir.mkdir(exist_ok=True)
-
+    jobs = {}
+    for i, d in enumerate(data_dirs):
+        opera_id = d.split("/")[-1]
+        output_dir = (
+            output_parent_dir / f"Output_Tree_Cover_Slope_Comparisons_{opera_id}"
+        )
+        output_dir.mkdir(exist_ok=True)
+        output_1 = output_dir / f"output_{Path(d).name}_prep_flattening_part_1.ipynb"
+        output_2 = output_dir / f"output_{Path(d).name}_prep_flattening_part_2.ipynb"
+        output_gamma0_compare = (
+            output_dir / f"output_{Path(d).name}_flattening_analysis.ipynb"
+        )
+        scene_id = opera_id.split("RTC_")[1]
+        jobs[scene_id] = [
             # data prep notebook 1
-            parameters_prep_1["data_dir"] = d
-            output_1 = (
-                output_dir / f"output_{Path(d).name}_prep_flattening_part_1.ipynb"
-            )
-            output_1_html = Path(output_1).with_suffix('.html')
-            output_1_pdf = Path(output_1).with_suffix('.pdf')
-            pm.execute_notebook(
-                "data_prep/prep_flattening_part_1.ipynb",
-                output_1,
-                kernel_name="python3",
-                parameters=parameters_prep_1,
-            )
-            subprocess.run(
-                [f"jupyter nbconvert {output_1} --to html"],
-                shell=True,
-            )
-            subprocess.run(
-                [
-                    f"pandoc {output_1_html} "
-                    f"-o {output_1_pdf} "
-                    "--pdf-engine=weasyprint"
-                ],
-                shell=True,
-            )
-
+            {
+                "notebook": "data_prep/prep_flattening_part_1.ipynb",
+                "output": output_1,
+                "parameters": {**parameters_prep_1, "data_dir": d},
+                "inputs": sorted(Path(d).glob("*_mosaic.tif")),
+            },
             # data prep notebook 2
-            parameters_prep_2["data_dir"] = str(input_dirs_prep_2[i])
-            output_2 = (
-                output_dir / f"output_{Path(d).name}_prep_flattening_part_2.ipynb"
-            )
-            output_2_html = Path(output_2).with_suffix('.html')
-            output_2_pdf = Path(output_2).with_suffix('.pdf')
-            pm.execute_notebook(
-                "data_prep/prep_flattening_part_2.ipynb",
-                output_2,
-                kernel_name="python3",
-                parameters=parameters_prep_2,
-            )
-            subprocess.run(
-                [f"jupyter nbconvert {output_2} --to html"],
-                shell=True,
-            )
-            subprocess.run(
-                [
-                    f"pandoc {output_2_html} "
-                    f"-o {output_2_pdf} "
-                    "--pdf-engine=weasyprint"
-                ],
-                shell=True,
-            )
-
+            {
+                "notebook": "data_prep/prep_flattening_part_2.ipynb",
+                "output": output_2,
+                "parameters": {
+                    **parameters_prep_2,
+                    "data_dir": str(input_dirs_prep_2[i]),
+                },
+                "inputs": [output_1],
+            },
             # Gamma0 Comparisons
-            parameters_slope_compare["data_dir"] = str(input_dirs_gamma0_compare[i])
-            parameters_slope_compare["output_dir"] = str(output_dir)
-            output_gamma0_compare = (
-                output_dir / f"output_{Path(d).name}_flattening_analysis.ipynb"
-            )
-            output_gamma0_compare_html = Path(
-                output_gamma0_compare
-            ).with_suffix('.html')
-            output_gamma0_compare_pdf = Path(
-                output_gamma0_compare
-            ).with_suffix('.pdf')
-            pm.execute_notebook(
-                "flattening_analysis/flattening_analysis.ipynb",
-                output_gamma0_compare,
-                kernel_name="python3",
-                parameters=parameters_slope_compare,
-            )
-            subprocess.run(
-                [f"jupyter nbconvert {output_gamma0_compare} --to html"],
-                shell=True,
-            )
-            subprocess.run(
-                [
-                    f"pandoc {output_gamma0_compare_html} "
-                    f"-o {output_gamma0_compare_pdf} "
-                    "--pdf-engine=weasyprint"
-                ],
-                shell=True,
-            )
+            {
+                "notebook": "flattening_analysis/flattening_analysis.ipynb",
+                "output": output_gamma0_compare,
+                "parameters": {
+                    **parameters_slope_compare,
+                    "data_dir": str(input_dirs_gamma0_compare[i]),
+                    "output_dir": str(output_dir),
+                },
+                "inputs": [output_2],
+            },
+        ]
+    return jobs, output_parent_dir
+
+
+def flatten(
+    input_data_dir: os.PathLike,
+    manifest: RunManifest,
+    n_jobs: int = 1,
+    job_memory_gb: float = 0,
+    reports: str = "sync",
+):
+    jobs, output_parent_dir = flattening_jobs(input_data_dir)
+    run_notebook_jobs(
+        jobs,
+        Path.cwd().parent / "flattening",
+        manifest=manifest,
+        n_jobs=n_jobs,
+        log_dir=output_parent_dir / "logs",
+        job_memory_gb=job_memory_gb,
+        reports=reports,
+    )
+
+
+def compute_scene(scene_id: str, *args) -> Path:
+    # runs in a pool worker, which computes several scenes
+    with span(f"{COMPUTED}:flattening", scene_id):
+        return flatten_scene(*args)
+
+
+def compute_flattening(
+    input_data_dir: os.PathLike,
+    manifest: RunManifest,
+    n_jobs: int = 1,
+    log: bool = True,
+) -> Dict[str, Path]:
+    parent_data_dir = input_data_dir.parent
+    output_parent_dir = parent_data_dir / "output_flattening_analyses"
+    intermediary_parent_dir = parent_data_dir / "intermediary_flattening_data"
+    data_dirs = sorted(
+        d
+        for d in input_data_dir.glob("*")
+        if d.is_dir() and d.name.startswith("OPERA_L2-RTC")
+    )
+
+    # same results CSVs as the notebooks, skipping scenes computed from the same mosaics
+    stage = f"{COMPUTED}:flattening"
+    jobs = {}
+    for d in data_dirs:
+        scene_id = d.name.split("RTC_")[1]
+        output_dir = output_parent_dir / f"Output_Tree_Cover_Slope_Comparisons_{d.name}"
+        output_csv = output_dir / f"Results_Backscatter_Distributions_by_Slope_{d.name}.csv"
+        fp = fingerprint(sorted(d.glob("*_mosaic.tif")), {"log": log})
+        if manifest.is_done(scene_id, stage, fp, outputs=[output_csv]):
+            print(f"Skipping flattening computations for S1 scene: {scene_id}")
+            continue
+        jobs[scene_id] = ((d, intermediary_parent_dir, output_dir, log), fp)
+
+    # the scenes of a stack share a footprint, hence a landcover clip: warp each clip
+    # once here rather than in several workers at once (the store's atomic writes keep
+    # concurrent warps of a clip safe, but each worker would still warp it)
+    lc_store = LandcoverStore()
+    for scene_id, (args, _) in jobs.items():
+        try:
+            landcover_clip(args[0], lc_store=lc_store)
+        except Exception:
+            # reported when the scene is computed
+            continue
+
+    results = {}
+    # spawned workers: forking would copy the state of this process's threads (GDAL,
+    # earthaccess) into the children
+    with ProcessPoolExecutor(
+        max_workers=max(n_jobs, 1), mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = {
+            scene_id: executor.submit(compute_scene, scene_id, *args)
+            for scene_id, (args, _) in jobs.items()
+        }
+        for scene_id, future in futures.items():
+            try:
+                results[scene_id] = future.result()
+            except Exception as e:
+                print(f"{scene_id}: failed ({e})")
+                manifest.mark(scene_id, stage, jobs[scene_id][1], "failed", str(e))
+                continue
+            print(f"{scene_id}: done, results: {results[scene_id]}")
+            manifest.mark(scene_id, stage, jobs[scene_id][1])
+    print(f"{len(results)} of {len(jobs)} scenes computed")
+    return results
 
 
 def main():
@@ -352,69 +491,55 @@ def main():
     )
     input_data_dir = parent_data_dir / "input_OPERA_data"
     input_data_dir.mkdir(parents=True, exist_ok=True)
+    manifest = RunManifest(parent_data_dir / "run_manifest.sqlite")
+    # per-stage timings; summarize with summarize_spans.py
+    configure(parent_data_dir / "spans.jsonl")
     if not args.skip_download:
         # collect CalVal data access info
-        df_rtc = get_rtc_df(args)
-        df_static = get_static_df()
-        scenes = list(df_rtc.S1_Scene_IDs)
-
-        earthaccess.login()
+        tables = get_linking_tables(
+            site=args.site, orbital_path=args.orbital_path, calval_module=CALVAL_MODULE
+        )
+        scenes = [
+            scene.scene_id
+            for scene in tables.scenes(args.site, args.orbital_path, CALVAL_MODULE)
+        ]
         for scene_id in scenes:
-            acquisition_time = util.get_acquisition_time(scene_id)
-            if not was_reported(acquisition_time, scene_id, args):
-                print(f"skipping scene: {scene_id}")
-                continue
-
-            # define/create paths to data dirs
-            rtc_dir = input_data_dir / f"OPERA_L2-RTC_{scene_id}_30_v1.0"
-            dirs = {
-                "rtc_dir": rtc_dir,
-                "vv_burst_dir": rtc_dir / "vv_bursts",
-                "vh_burst_dir": rtc_dir / "vh_bursts",
-                "inc_angle_burst_dir": rtc_dir / "ellipsoidal_inc_angle_bursts",
-                "local_inc_angle_burst_dir": rtc_dir / "local_inc_angle_bursts",
-                "mask_burst_dir": rtc_dir / "layover_shadow_bursts",
-            }
-            for pth in dirs.values():
-                pth.mkdir(exist_ok=True, parents=True)
-
-            # build a dict containing urls to bursts for a given scene by data type
-            scene_burst_dict = build_url_dict(df_rtc, df_static, dirs, scene_id)
-            if not scene_burst_dict:
-                print(f"skipping scene: {scene_id}")
-                continue
-
-            # download data
-            print(f"Downloading RTC bursts and static data for S1 scene: {scene_id}")
-            download_bursts_and_static(scene_burst_dict)
+            manifest.mark(scene_id, LISTED)
 
-            # collect paths to downloaded data
-            vv_bursts = list(dirs["vv_burst_dir"].glob("*VV.tif"))
-            vh_bursts = list(dirs["vh_burst_dir"].glob("*VH.tif"))
-            mask_bursts = list(dirs["mask_burst_dir"].glob("*mask.tif"))
-            local_inc_angle_bursts = list(
-                dirs["local_inc_angle_burst_dir"].glob("*local_incidence_angle.tif")
-            )
-            inc_angle_bursts = list(
-                dirs["inc_angle_burst_dir"].glob("*incidence_angle.tif")
-            )
-
-            # reproject bursts to predominant CRS (if necessary) and merge into full S1 scenes
-            epsgs = util.get_projection_counts(vv_bursts)
-            predominant_epsg = None if len(epsgs) == 1 else max(epsgs, key=epsgs.get)
-            merge_bursts(
-                {
-                    "vv_bursts": vv_bursts,
-                    "vh_bursts": vh_bursts,
-                    "mask_bursts": mask_bursts,
-                    "local_inc_angle_bursts": local_inc_angle_bursts,
-                    "inc_angle_bursts": inc_angle_bursts,
-                },
-                predominant_epsg,
-                rtc_dir,
-                scene_id,
+        # download the next scene while mosaicking the current one
+        earthaccess.login()
+        store = (
+            BurstStore(args.burst_store, args.burst_store_quota_gb)
+            if args.burst_store
+            else None
+        )
+        download = store.download if store else earthaccess_download
+        with store.active_run(str(parent_data_dir)) if store else nullcontext():
+            run_scene_pipeline(
+                scenes,
+                partial(
+                    download_scene,
+                    tables=tables,
+                    input_data_dir=input_data_dir,
+                    args=args,
+                    manifest=manifest,
+                    download=download,
+                ),
+                partial(
+                    mosaic_scene,
+                    input_data_dir=input_data_dir,
+                    manifest=manifest,
+                    warp_mosaic=args.warp_mosaic,
+                    stack=args.stack,
+                ),
+                prefetch=args.prefetch,
+                disk_path=input_data_dir,
+                min_free_gb=args.min_free_gb,
             )
-    flatten(input_data_dir)
+    if args.compute_only:
+        compute_flattening(input_data_dir, manifest, args.jobs)
+    else:
+        flatten(input_data_dir, manifest, args.jobs, args.job_memory_gb, args.reports)
 
 
 if __name__ == "__main__":
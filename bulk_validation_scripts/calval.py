@@ -0,0 +1,592 @@
+import argparse
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple, Union
+
+import earthaccess
+from osgeo import gdal
+
+gdal.UseExceptions()
+
+current = Path("..").resolve()
+sys.path.append(str(current))
+import util.geo as util
+import bulk_papermill_OPERA_RTC_absolute_geolocation_evaluation as ale
+import bulk_papermill_OPERA_RTC_coregistration as coregistration
+import bulk_papermill_OPERA_RTC_flattening as flattening
+from util.burst_store import BurstStore
+from util.instrument import configure, span
+from util.linking import LinkingTables, get_linking_tables
+from util.manifest import DOWNLOADED, LISTED, MERGED, RunManifest, fingerprint
+from util.notebooks import available_memory_gb, start_job
+from util.pipeline import destination_paths, download_files, earthaccess_download
+from util.reports import REPORT_MODES, render_reports
+from util.scheduler import DONE, StageScheduler
+
+# burst directory and mosaic name of each layer, as in the bulk scripts
+LAYERS = {
+    "vv": ("vv_bursts", "VV"),
+    "vh": ("vh_bursts", "VH"),
+    "mask": ("layover_shadow_bursts", "mask"),
+    "local_incidence_angle": ("local_inc_angle_bursts", "local_incidence_angle"),
+    "incidence_angle": ("ellipsoidal_inc_angle_bursts", "incidence_angle"),
+}
+
+
+@dataclass(frozen=True)
+class CalValModule:
+    """
+    A CalVal module run by calval.py: the scenes and layers it reads, where its bulk
+    script keeps its data, and how its notebook jobs are built
+    """
+
+    calval_module: str
+    layers: List[str]
+    # run directory under --calval_dir, formatted with the site, the site with
+    # underscores (site_dir), and the orbital path
+    run_dir: str
+    notebook_dir: str
+    # True for one job per scene, False for jobs over the stack of all scenes
+    per_scene: bool
+    # function of the linking tables, a scene ID, and the CLI args
+    keep_scene: Callable[[LinkingTables, str, argparse.Namespace], bool]
+    # function of the module's input directory, the CLI args, and the scene
+    # directories, returning the module's jobs and the directory of their logs
+    jobs: Callable[
+        [Path, argparse.Namespace, Union[List[Path], None]],
+        Tuple[Dict[str, List[Dict]], Path],
+    ]
+
+
+def keep_all_scenes(tables: LinkingTables, scene_id: str, args: object) -> bool:
+    return True
+
+
+def keep_coregistration_scene(
+    tables: LinkingTables, scene_id: str, args: object
+) -> bool:
+    return coregistration.was_reported(util.get_acquisition_time(scene_id), args)
+
+
+def keep_flattening_scene(tables: LinkingTables, scene_id: str, args: object) -> bool:
+    if not flattening.was_reported(util.get_acquisition_time(scene_id), scene_id, args):
+        return False
+    # every layer needs a burst for each VV burst
+    layer_urls = module_layer_urls(tables, scene_id, MODULES["flattening"])
+    counts = {layer: len(urls) for layer, urls in layer_urls.items()}
+    if len(set(counts.values())) > 1:
+        print(f"skipping scene: {scene_id}, bursts by layer: {counts}")
+        return False
+    return True
+
+
+def ale_jobs(
+    input_dir: Path, args: object, data_dirs: Union[List[Path], None] = None
+) -> Tuple[Dict[str, List[Dict]], Path]:
+    jobs, results_dir = ale.absolute_geolocation_jobs(
+        input_dir, args.site, args.orbital_path, data_dirs
+    )
+    return jobs, results_dir / "logs"
+
+
+def coregistration_jobs(
+    input_dir: Path, args: object, data_dirs: Union[List[Path], None] = None
+) -> Tuple[Dict[str, List[Dict]], Path]:
+    jobs, output_dir = coregistration.coregistration_jobs(
+        input_dir, args.site, args.orbital_path, args.delete_intermediary, data_dirs
+    )
+    return jobs, output_dir / "logs"
+
+
+def flattening_jobs(
+    input_dir: Path, args: object, data_dirs: Union[List[Path], None] = None
+) -> Tuple[Dict[str, List[Dict]], Path]:
+    jobs, output_parent_dir = flattening.flattening_jobs(input_dir, data_dirs)
+    return jobs, output_parent_dir / "logs"
+
+
+MODULES = {
+    "ale": CalValModule(
+        calval_module=ale.CALVAL_MODULE,
+        layers=["vv"],
+        run_dir="OPERA_RTC_ALE_{site}_{orbital_path}",
+        notebook_dir="absolute_geolocation_evaluation",
+        per_scene=True,
+        keep_scene=keep_all_scenes,
+        jobs=ale_jobs,
+    ),
+    "coregistration": CalValModule(
+        calval_module=coregistration.CALVAL_MODULE,
+        layers=["vv", "vh"],
+        run_dir="OPERA_RTC_Coregistration_{site_dir}_{orbital_path}",
+        notebook_dir="coregistration",
+        per_scene=False,
+        keep_scene=keep_coregistration_scene,
+        jobs=coregistration_jobs,
+    ),
+    "flattening": CalValModule(
+        calval_module=flattening.CALVAL_MODULE,
+        layers=list(LAYERS),
+        run_dir="OPERA_RTC_Flattening_{site_dir}_{orbital_path}",
+        notebook_dir="flattening",
+        per_scene=True,
+        keep_scene=keep_flattening_scene,
+        jobs=flattening_jobs,
+    ),
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run the CalVal modules of a site/orbit as one DAG of stages: link -> download -> mosaic -> module notebooks -> reports. Each scene is downloaded and mosaicked once for all modules."
+    )
+    parser.add_argument(
+        "--site", type=str, required=True, help="California, Vermont, Delta Junction, Brazil"
+    )
+    parser.add_argument(
+        "--orbital_path", type=int, required=True, help="64, 135, 113, 94, 160, 170, 39"
+    )
+    parser.add_argument(
+        "--modules",
+        nargs="+",
+        choices=list(MODULES),
+        default=list(MODULES),
+        help="CalVal modules to run; modules without scenes for the site/orbit are skipped.",
+    )
+    parser.add_argument(
+        "--calval_dir",
+        type=Path,
+        default=Path.cwd().parents[1] / "OPERA_L2-RTC_CalVal",
+        help="Directory holding the data and outputs of every module run.",
+    )
+    parser.add_argument(
+        "--skip_download",
+        default=False,
+        action="store_true",
+        help="Skip downloading and mosaicking of bursts and validate previously prepared data.",
+    )
+    parser.add_argument(
+        "--warp_mosaic",
+        default=False,
+        action="store_true",
+        help="Reproject and mosaic bursts in a single warp pass without rewriting the downloaded bursts.",
+    )
+    parser.add_argument(
+        "--delete_intermediary",
+        default=False,
+        action="store_true",
+        help="Delete intermediary coregistration data",
+    )
+    parser.add_argument(
+        "--network_slots",
+        type=int,
+        default=2,
+        help="Number of scenes downloading concurrently.",
+    )
+    parser.add_argument(
+        "--download_workers",
+        type=int,
+        default=4,
+        help="Number of files of a scene to download concurrently.",
+    )
+    parser.add_argument(
+        "--cpu_workers",
+        type=int,
+        default=2,
+        help="Number of mosaics, notebook jobs, and report batches running concurrently.",
+    )
+    parser.add_argument(
+        "--memory_gb",
+        type=float,
+        default=None,
+        help="Memory shared by the running mosaics and notebook jobs (default: the available memory).",
+    )
+    parser.add_argument(
+        "--mosaic_memory_gb",
+        type=float,
+        default=0,
+        help="Memory used by mosaicking one scene.",
+    )
+    parser.add_argument(
+        "--job_memory_gb",
+        type=float,
+        default=0,
+        help="Memory used by one notebook job (a scene, or a coregistration polarization).",
+    )
+    parser.add_argument(
+        "--reports",
+        choices=REPORT_MODES,
+        default="sync",
+        help="sync: render each report after its notebook; deferred: render the reports of each job as a stage of their own; none: skip reports (rerun with --skip_download to render them later).",
+    )
+    parser.add_argument(
+        "--burst_store",
+        type=Path,
+        default=None,
+        help="Shared store of downloaded products, linked into this run's data directories.",
+    )
+    parser.add_argument(
+        "--burst_store_quota_gb",
+        type=float,
+        default=None,
+        help="Evict the least recently used products not used by an active run above this size.",
+    )
+    return parser.parse_args()
+
+
+def module_input_dir(module: CalValModule, args: object) -> Path:
+    run_dir = module.run_dir.format(
+        site=args.site,
+        site_dir=args.site.replace(" ", "_"),
+        orbital_path=args.orbital_path,
+    )
+    return args.calval_dir / run_dir / "input_OPERA_data"
+
+
+def scene_dir_name(scene_id: str) -> str:
+    return f"OPERA_L2-RTC_{scene_id}_30_v1.0"
+
+
+def mosaic_path(scene_dir: Path, scene_id: str, layer: str) -> Path:
+    name = LAYERS[layer][1]
+    return scene_dir / f"OPERA_L2_RTC-S1_{name}_{scene_id}_30_v1.0_mosaic.tif"
+
+
+def module_layer_urls(
+    tables: LinkingTables, scene_id: str, module: CalValModule
+) -> Dict[str, List[str]]:
+    scene = tables.scene(scene_id, module.calval_module)
+    layer_urls = {"vv": scene.vv_urls, "vh": scene.vh_urls, **tables.static_urls(scene)}
+    return {layer: layer_urls[layer] for layer in module.layers}
+
+
+def scene_layer_urls(
+    tables: LinkingTables, scene_id: str, modules: List[CalValModule]
+) -> Dict[str, List[str]]:
+    # union of the layers the modules read, each downloaded and mosaicked once
+    layer_urls = {}
+    for module in modules:
+        for layer, urls in module_layer_urls(tables, scene_id, module).items():
+            kept = layer_urls.setdefault(layer, [])
+            kept.extend(url for url in urls if url not in kept)
+    return {layer: layer_urls[layer] for layer in LAYERS if layer in layer_urls}
+
+
+def layer_bursts(
+    scene_dir: Path, layer_urls: Dict[str, List[str]]
+) -> Dict[str, List[Path]]:
+    return {
+        layer: [scene_dir / LAYERS[layer][0] / url.split("/")[-1] for url in urls]
+        for layer, urls in layer_urls.items()
+    }
+
+
+def download_scene(
+    scene_id: str,
+    scene_dir: Path,
+    layer_urls: Dict[str, List[str]],
+    manifest: RunManifest,
+    download: Callable,
+    download_workers: int = 4,
+):
+    url_dirs = [
+        (url, scene_dir / LAYERS[layer][0])
+        for layer, urls in layer_urls.items()
+        for url in urls
+    ]
+    download_fp = fingerprint(values=layer_urls)
+    if manifest.is_done(
+        scene_id, DOWNLOADED, download_fp, outputs=destination_paths(url_dirs)
+    ):
+        return
+    for layer in layer_urls:
+        (scene_dir / LAYERS[layer][0]).mkdir(parents=True, exist_ok=True)
+    print(f"Downloading {', '.join(layer_urls)} bursts for S1 scene: {scene_id}")
+    with span("download", scene_id):
+        download_files(url_dirs, download=download, max_workers=download_workers)
+    manifest.mark(scene_id, DOWNLOADED, download_fp)
+
+
+def mosaic_scene(
+    scene_id: str,
+    scene_dir: Path,
+    layer_urls: Dict[str, List[str]],
+    manifest: RunManifest,
+    warp_mosaic: bool = False,
+    max_workers: Union[int, None] = None,
+):
+    bursts = layer_bursts(scene_dir, layer_urls)
+    outputs = {layer: mosaic_path(scene_dir, scene_id, layer) for layer in bursts}
+
+    # skip scenes already mosaicked from the same bursts
+    all_bursts = [pth for paths in bursts.values() for pth in paths]
+    merge_options = {"layers": list(bursts), "warp_mosaic": warp_mosaic}
+    if manifest.is_done(
+        scene_id,
+        MERGED,
+        fingerprint(all_bursts, merge_options),
+        outputs=list(outputs.values()),
+    ):
+        print(f"Skipping mosaicking of S1 scene: {scene_id}")
+        return
+
+    # reproject (when necessary) and mosaic all layers concurrently on a common grid
+    epsgs = util.get_projection_counts(next(iter(bursts.values())))
+    predominant_epsg = None if len(epsgs) == 1 else max(epsgs, key=epsgs.get)
+    with span("merge", scene_id):
+        util.assemble_scene(
+            bursts,
+            outputs,
+            predominant_epsg,
+            warp_mosaic=warp_mosaic,
+            max_workers=max_workers,
+        )
+    # fingerprint after reprojection, which rewrites the bursts in place
+    manifest.mark(scene_id, MERGED, fingerprint(all_bursts, merge_options))
+
+
+def link_mosaics(scene_id: str, scene_dir: Path, layers: List[str], data_dir: Path):
+    # hardlink (or symlink) the shared mosaics into a module's scene directory
+    data_dir.mkdir(parents=True, exist_ok=True)
+    for layer in layers:
+        src = mosaic_path(scene_dir, scene_id, layer)
+        dst = data_dir / src.name
+        if dst.exists() and os.path.samefile(src, dst):
+            continue
+        if dst.exists() or dst.is_symlink():
+            dst.unlink()
+        try:
+            os.link(src, dst)
+        except OSError:
+            os.symlink(src, dst)
+
+
+def run_job(
+    steps: List[Dict],
+    cwd: Path,
+    manifest: RunManifest,
+    key: str,
+    log_path: Path,
+    report: bool = True,
+):
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    process = start_job(steps, cwd, manifest, key, log_path, report)
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"exit code {process.exitcode}, log: {log_path}")
+    print(f"{key}: done, log: {log_path}")
+
+
+def run_reports(
+    steps: List[Dict],
+    manifest: RunManifest,
+    key: str,
+    executor: ProcessPoolExecutor,
+):
+    failed = render_reports(steps, manifest, key, executor)
+    if failed:
+        raise RuntimeError(f"{len(failed)} reports failed: {failed}")
+
+
+def add_job_stages(
+    scheduler: StageScheduler,
+    name: str,
+    args: object,
+    executor: Union[ProcessPoolExecutor, None],
+    data_dirs: Union[List[Path], None] = None,
+):
+    # notebook job (and report) stages of a module, once its inputs are in place
+    module = MODULES[name]
+    input_dir = module_input_dir(module, args)
+    manifest = RunManifest(input_dir.parent / "run_manifest.sqlite")
+    jobs, log_dir = module.jobs(input_dir, args, data_dirs)
+    for key, steps in jobs.items():
+        stage = scheduler.add(
+            f"notebooks:{name}:{key}",
+            partial(
+                run_job,
+                steps,
+                Path.cwd().parent / module.notebook_dir,
+                manifest,
+                key,
+                log_dir / f"{key}.log",
+                args.reports == "sync",
+            ),
+            resources={"cpu": 1, "memory_gb": args.job_memory_gb},
+        )
+        if args.reports == "deferred":
+            scheduler.add(
+                f"reports:{name}:{key}",
+                partial(run_reports, steps, manifest, key, executor),
+                [stage],
+                {"cpu": 1},
+            )
+
+
+def prepare_module(
+    scheduler: StageScheduler,
+    name: str,
+    scene_ids: List[str],
+    args: object,
+    shared_dir: Path,
+    executor: Union[ProcessPoolExecutor, None],
+):
+    module = MODULES[name]
+    input_dir = module_input_dir(module, args)
+    data_dirs = []
+    for scene_id in scene_ids:
+        data_dir = input_dir / scene_dir_name(scene_id)
+        scene_dir = shared_dir / scene_dir_name(scene_id)
+        link_mosaics(scene_id, scene_dir, module.layers, data_dir)
+        data_dirs.append(data_dir)
+    add_job_stages(scheduler, name, args, executor, data_dirs)
+
+
+def link(
+    scheduler: StageScheduler,
+    args: object,
+    shared_dir: Path,
+    manifest: RunManifest,
+    download: Callable,
+    executor: Union[ProcessPoolExecutor, None],
+):
+    # collect CalVal data access info, then add the stages of every scene and module
+    tables = get_linking_tables(site=args.site, orbital_path=args.orbital_path)
+    scene_modules = {}
+    for name in args.modules:
+        module = MODULES[name]
+        scenes = [
+            scene.scene_id
+            for scene in tables.scenes(
+                args.site, args.orbital_path, module.calval_module
+            )
+        ]
+        kept = [s for s in scenes if module.keep_scene(tables, s, args)]
+        print(f"{name}: {len(kept)} of {len(scenes)} scenes")
+        for scene_id in kept:
+            scene_modules.setdefault(scene_id, []).append(name)
+
+    # download and mosaic each scene once, with the layers of every module reading it
+    mosaic_workers = max((os.cpu_count() or 1) // args.cpu_workers, 1)
+    for scene_id, names in scene_modules.items():
+        manifest.mark(scene_id, LISTED)
+        scene_dir = shared_dir / scene_dir_name(scene_id)
+        layer_urls = scene_layer_urls(tables, scene_id, [MODULES[n] for n in names])
+        download_stage = scheduler.add(
+            f"download:{scene_id}",
+            partial(
+                download_scene,
+                scene_id,
+                scene_dir,
+                layer_urls,
+                manifest,
+                download,
+                args.download_workers,
+            ),
+            resources={"network": 1},
+        )
+        scheduler.add(
+            f"mosaic:{scene_id}",
+            partial(
+                mosaic_scene,
+                scene_id,
+                scene_dir,
+                layer_urls,
+                manifest,
+                args.warp_mosaic,
+                mosaic_workers,
+            ),
+            [download_stage],
+            {"cpu": 1, "memory_gb": args.mosaic_memory_gb},
+        )
+
+    for name in args.modules:
+        scene_ids = [s for s, names in scene_modules.items() if name in names]
+        if not scene_ids:
+            print(f"No {name} scenes for {args.site}, orbital path {args.orbital_path}")
+            continue
+        if MODULES[name].per_scene:
+            groups = {scene_id: [scene_id] for scene_id in scene_ids}
+        else:
+            groups = {"stack": scene_ids}
+        for group_name, group in groups.items():
+            scheduler.add(
+                f"inputs:{name}:{group_name}",
+                partial(
+                    prepare_module, scheduler, name, group, args, shared_dir, executor
+                ),
+                [f"mosaic:{scene_id}" for scene_id in group],
+            )
+
+
+def main():
+    args = parse_args()
+    site_dir = args.site.replace(" ", "_")
+    shared_dir = (
+        args.calval_dir / f"OPERA_RTC_{site_dir}_{args.orbital_path}/input_OPERA_data"
+    )
+    shared_dir.mkdir(parents=True, exist_ok=True)
+    manifest = RunManifest(shared_dir.parent / "run_manifest.sqlite")
+    # per-stage timings; summarize with summarize_spans.py
+    configure(shared_dir.parent / "spans.jsonl")
+
+    scheduler = StageScheduler(
+        {
+            "network": args.network_slots,
+            "cpu": args.cpu_workers,
+            "memory_gb": args.memory_gb or available_memory_gb(),
+        }
+    )
+    # report batches render in their own processes (see reports.render_reports)
+    executor = (
+        ProcessPoolExecutor(
+            max_workers=args.cpu_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        if args.reports == "deferred"
+        else None
+    )
+    store = None
+    if args.skip_download:
+        # validate the data previously prepared in each module's input directory
+        for name in args.modules:
+            if module_input_dir(MODULES[name], args).exists():
+                scheduler.add(
+                    f"inputs:{name}",
+                    partial(add_job_stages, scheduler, name, args, executor),
+                )
+    else:
+        earthaccess.login()
+        store = (
+            BurstStore(args.burst_store, args.burst_store_quota_gb)
+            if args.burst_store
+            else None
+        )
+        scheduler.add(
+            "link",
+            partial(
+                link,
+                scheduler,
+                args,
+                shared_dir,
+                manifest,
+                store.download if store else earthaccess_download,
+                executor,
+            ),
+        )
+
+    with store.active_run(str(shared_dir)) if store else nullcontext():
+        with executor or nullcontext():
+            statuses = scheduler.run()
+    if any(status != DONE for status in statuses.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import argparse
+import sys
+from pathlib import Path
+
+current = Path("..").resolve()
+sys.path.append(str(current))
+from util.instrument import print_summary
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Per-stage breakdown and slowest scenes of the spans recorded by the bulk scripts."
+    )
+    parser.add_argument(
+        "spans",
+        type=Path,
+        nargs="+",
+        help="spans.jsonl files, next to the run_manifest.sqlite of each run.",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="Number of slowest scenes to list.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print_summary(args.spans, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Converts the CSV linking tables to the Parquet burst table read by util.linking.
+
+    python convert_linking_tables.py
+"""
+import argparse
+import sys
+from pathlib import Path
+
+current = Path(__file__).resolve().parents[1]
+sys.path.append(str(current))
+from util.linking import BURST_TABLE, RTC_TABLE, STATIC_TABLE, burst_table_from_csv, write_burst_table
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rtc_table', type=Path, default=RTC_TABLE,
+                        help='RTC linking table CSV (or its .csv.zip)')
+    parser.add_argument('--static_table', type=Path, default=STATIC_TABLE,
+                        help='static layer linking table CSV')
+    parser.add_argument('--burst_table', type=Path, default=BURST_TABLE,
+                        help='Parquet burst table to write')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    df = burst_table_from_csv(args.rtc_table, args.static_table)
+    pth = write_burst_table(df, args.burst_table)
+    print(f'Wrote {len(df)} bursts of {df.scene_id.nunique()} scenes -> {pth}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,10 @@
 import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
 from functools import lru_cache
 from pathlib import Path
 
@@ -6,9 +12,12 @@ import backoff
 import requests
 import urllib3
 from http.client import RemoteDisconnected
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import dotenv_values
 from elasticsearch import Elasticsearch, RequestsHttpConnection
-from elasticsearch_dsl import Q, Search
+from elasticsearch.exceptions import ConnectionError as ESConnectionError
+from elasticsearch_dsl import MultiSearch, Q, Search
 from tqdm import tqdm
 
 urllib3.disable_warnings()
@@ -17,23 +26,234 @@ RTC_SAS_VERSION = '1.0.1'
 STATIC_INDEX = 'grq_v1.0_l2_rtc_s1_static_layers-2023.09'
 RTC_INDEX = 'grq_v1.0_l2_rtc_s1-2023.09'
 
+DOWNLOAD_CHUNK_SIZE = 2**20
+# files at least this large are fetched as parallel ranged segments when requested
+SEGMENT_MIN_SIZE = 64 * 2**20
+# (connect, read) timeouts of download requests in seconds, so a stalled connection
+# fails and is retried instead of blocking its worker
+DOWNLOAD_TIMEOUT = (30, 120)
 
-def download_file(url: str, out_path: str):
-    # Source: https://stackoverflow.com/a/16696317
-    with requests.get(url, stream=True) as r:
+
+@lru_cache
+def get_download_session(pool_size: int = 32) -> requests.Session:
+    # one pooled, retrying session shared by all download threads so connections
+    # to the same host are reused instead of re-negotiated for every file
+    session = requests.Session()
+    retry = Retry(total=5,
+                  backoff_factor=1,
+                  status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=['HEAD', 'GET'])
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size,
+                          max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _get_remote_size(url: str,
+                     session: requests.Session,
+                     timeout: tuple) -> tuple[int, bool]:
+    with session.head(url, allow_redirects=True, timeout=timeout) as r:
+        if not r.ok:
+            # some servers do not answer HEAD; download without size or range support
+            return -1, False
+        size = int(r.headers.get('Content-Length', -1))
+        accepts_ranges = r.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    return size, accepts_ranges
+
+
+def _segments_path(part_path: Path) -> Path:
+    # record of the completed segments of a segmented download's part file
+    return part_path.with_name(f'{part_path.name}.segments')
+
+
+def _discard(part_path: Path):
+    part_path.unlink(missing_ok=True)
+    _segments_path(part_path).unlink(missing_ok=True)
+
+
+def _download_segment(url: str,
+                      part_path: Path,
+                      start: int,
+                      end: int,
+                      session: requests.Session,
+                      chunk_size: int,
+                      timeout: tuple):
+    headers = {'Range': f'bytes={start}-{end}'}
+    with session.get(url, stream=True, headers=headers, timeout=timeout) as r:
         r.raise_for_status()
-        with open(out_path, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=2**6):
+        if r.status_code != 206:
+            raise ValueError(f'{url} ignored the Range header')
+        with open(part_path, 'r+b') as f:
+            f.seek(start)
+            written = 0
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                written += f.write(chunk)
+    if written != end - start + 1:
+        raise ValueError(f'{url}: segment {start}-{end} truncated at {written} bytes')
+
+
+def _download_segments(url: str,
+                       part_path: Path,
+                       size: int,
+                       n_segments: int,
+                       session: requests.Session,
+                       chunk_size: int,
+                       timeout: tuple):
+    # the part file is preallocated with zeros, so its size says nothing of what was
+    # written: completed segments are recorded in a sidecar, and only the missing
+    # ones are fetched when a killed download is resumed
+    segments_path = _segments_path(part_path)
+    bounds = [size * i // n_segments for i in range(n_segments + 1)]
+    done = set()
+    if part_path.exists() and segments_path.exists():
+        record = json.loads(segments_path.read_text())
+        if record['bounds'] == bounds:
+            done = set(record['done'])
+    if not done:
+        segments_path.write_text(json.dumps({'bounds': bounds, 'done': []}))
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+    lock = threading.Lock()
+
+    def _segment(i: int):
+        _download_segment(url, part_path, bounds[i], bounds[i + 1] - 1,
+                          session, chunk_size, timeout)
+        with lock:
+            done.add(i)
+            segments_path.write_text(json.dumps({'bounds': bounds, 'done': sorted(done)}))
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_segments) as executor:
+            futures = [executor.submit(_segment, i)
+                       for i in range(n_segments) if i not in done]
+            for future in futures:
+                future.result()
+    except BaseException:
+        # never leave a zero-filled part file that a streamed download would resume
+        _discard(part_path)
+        raise
+    segments_path.unlink()
+
+
+def _download_stream(url: str,
+                     part_path: Path,
+                     size: int,
+                     accepts_ranges: bool,
+                     session: requests.Session,
+                     chunk_size: int,
+                     timeout: tuple):
+    if _segments_path(part_path).exists():
+        # a segmented download's part file, not a prefix of the file
+        _discard(part_path)
+    # resume a partial file left by an interrupted download when the server allows it
+    offset = part_path.stat().st_size if part_path.exists() and accepts_ranges else 0
+    if size >= 0 and offset > size:
+        _discard(part_path)
+        offset = 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    with session.get(url, stream=True, headers=headers, timeout=timeout) as r:
+        if r.status_code == 416:
+            # nothing past offset: the partial file is complete only if the remote
+            # file is offset bytes long, otherwise download it again from the start
+            total = r.headers.get('Content-Range', '').split('/')[-1]
+            total = size if size >= 0 else int(total) if total.isdigit() else -1
+            if total == offset:
+                return
+            _discard(part_path)
+            return _download_stream(url, part_path, size, False, session, chunk_size,
+                                    timeout)
+        r.raise_for_status()
+        mode = 'ab' if offset and r.status_code == 206 else 'wb'
+        with open(part_path, mode) as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
                 f.write(chunk)
+
+
+def file_checksum(path: str, algorithm: str = 'md5') -> str:
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def download_file(url: str,
+                  out_path: str,
+                  chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                  n_segments: int = 1,
+                  expected_size: int = None,
+                  checksum: str = None,
+                  checksum_algorithm: str = 'md5',
+                  session: requests.Session = None,
+                  timeout: tuple = DOWNLOAD_TIMEOUT):
+    """
+    Downloads url to out_path through a pooled session, writing chunk_size-byte
+    chunks to out_path + '.part' and renaming it once complete and verified.
+
+    - An existing out_path of the expected size is not downloaded again.
+    - A '.part' file left by an interrupted download is resumed with a Range request.
+    - With n_segments > 1, files of at least SEGMENT_MIN_SIZE are fetched as
+      n_segments parallel ranged requests (e.g. large HDF5 products). Completed
+      segments are recorded in a '.part.segments' file; the '.part' file is deleted
+      when a segment fails.
+    - Requests time out after timeout (connect, read) seconds.
+    - The size is checked against expected_size (or Content-Length) and, when given,
+      the checksum against the file's checksum_algorithm hex digest.
+    """
+    session = session or get_download_session()
+    out_path = Path(out_path)
+    part_path = out_path.with_name(f'{out_path.name}.part')
+
+    remote_size, accepts_ranges = _get_remote_size(url, session, timeout)
+    size = expected_size if expected_size is not None else remote_size
+    if out_path.exists() and size >= 0 and out_path.stat().st_size == size:
+        if checksum is None or file_checksum(out_path, checksum_algorithm) == checksum:
+            return out_path
+
+    if n_segments > 1 and accepts_ranges and remote_size >= SEGMENT_MIN_SIZE:
+        _download_segments(url, part_path, remote_size, n_segments, session, chunk_size,
+                           timeout)
+    else:
+        _download_stream(url, part_path, size, accepts_ranges, session, chunk_size,
+                         timeout)
+
+    actual_size = part_path.stat().st_size
+    if size >= 0 and actual_size != size:
+        _discard(part_path)
+        raise ValueError(f'{url}: downloaded {actual_size} bytes, expected {size}')
+    if checksum is not None and file_checksum(part_path, checksum_algorithm) != checksum:
+        _discard(part_path)
+        raise ValueError(f'{url}: {checksum_algorithm} checksum mismatch')
+    os.replace(part_path, out_path)
     return out_path
 
 
+GRQ_URL = 'https://100.104.62.10/grq_es/'
+# number of queries grouped into one _msearch request
+MSEARCH_BATCH_SIZE = 500
+# hits returned per query in an _msearch; queries with more hits are scrolled
+MSEARCH_PAGE_SIZE = 1000
+
+# on-disk cache of query results, keyed by index and query
+ES_CACHE_PATH = Path(os.environ.get('CALVAL_RTC_ES_CACHE',
+                                    Path.home() / '.cache/calval-RTC/es_cache.sqlite'))
+# seconds before a cached result is re-queried (default 30 days)
+ES_CACHE_TTL = float(os.environ.get('CALVAL_RTC_ES_CACHE_TTL', 30 * 24 * 3600))
+# seconds before a query that found nothing is re-queried (default 1 day), so that
+# products published after the first lookup are picked up
+ES_CACHE_EMPTY_TTL = float(os.environ.get('CALVAL_RTC_ES_CACHE_EMPTY_TTL', 24 * 3600))
+# serve results from the cache only, without contacting GRQ (e.g. off VPN)
+ES_OFFLINE = os.environ.get('CALVAL_RTC_ES_OFFLINE', '') not in ('', '0')
+
+
 @lru_cache
-def get_search_client(index: str = None):
+def get_grq_client() -> Elasticsearch:
+    # one pooled client shared by every index and thread
     config = dotenv_values()
     ES_USERNAME = config['ES_USERNAME']
     ES_PASSWORD = config['ES_PASSWORD']
-    GRQ_URL = 'https://100.104.62.10/grq_es/'
     # See: https://github.com/nasa/opera-sds-pcm/
     # blob/81ccb1bd40981588754a438b4dd0eb1506301276/tools/ops/cnm_check.py#L40-L47
     grq_client = Elasticsearch(GRQ_URL,
@@ -42,70 +262,219 @@ def get_search_client(index: str = None):
                                use_ssl=True,
                                connection_class=RequestsHttpConnection,
                                read_timeout=50000,
-                               terminate_after=2500,
                                ssl_show_warn=False
                                )
+    if not grq_client.ping():
+        raise ValueError('Either JPL username/password is wrong or not connected to VPN')
+    return grq_client
+
+
+def _get_index(index: str = None) -> str:
     if index is None:
-        index = RTC_INDEX
+        return RTC_INDEX
     elif index == 'static':
-        index = STATIC_INDEX
-    search = Search(using=grq_client,
-                    index=index)
+        return STATIC_INDEX
+    return index
 
-    if not grq_client.ping():
-        raise ValueError('Either JPL username/password is wrong or not connected to VPN')
 
-    return search
+@lru_cache
+def get_search_client(index: str = None):
+    return Search(using=get_grq_client(),
+                  index=_get_index(index))
 
 
-def get_rtc_docs(input_id: str,
-                 target_rtc_version=RTC_SAS_VERSION) -> list[dict]:
-    "Version is determined by latest here: https://github.com/opera-adt/RTC/releases"
-    search = get_search_client()
-    q_qs = Q('bool',
+def _rtc_query(input_id: str, target_rtc_version: str) -> Q:
+    return Q('bool',
              must=[Q('query_string',
                      query=f'\"{input_id}\"',
                      default_field="metadata.input_granule_id"),
                    Q('query_string',
                       query=f'\"{target_rtc_version}\"',
                       default_field="metadata.sas_version")])
-    query = search.query(q_qs)
-    total = query.count()
-    # using this: https://github.com/elastic/elasticsearch-dsl-py/issues/737
-    query = query[0:total]
-    resp = query.execute()
 
-    hits = list(resp.hits)
-    data = [hit.to_dict() for hit in hits]
-    return data
+
+def _static_query(burst_id: str) -> Q:
+    return Q('query_string',
+             query=f'\"OPERA_L2_RTC-S1-STATIC_{burst_id}\"',
+             default_field="metadata.id")
 
 
 @backoff.on_exception(backoff.expo,
-                      RemoteDisconnected,
+                      (RemoteDisconnected, ESConnectionError),
                       max_tries=20,
                       jitter=backoff.full_jitter)
-def get_static_rtc_docs(burst_id: str) -> list[dict]:
-    search = get_search_client(index='static')
-    query_qs = Q('query_string',
-                 query=f'\"OPERA_L2_RTC-S1-STATIC_{burst_id}\"',
-                 default_field="metadata.id")
-    query = search.query(query_qs)
-    total = query.count()
-    if total == 0:
+def _msearch(index: str, queries: dict) -> dict[str, list[dict]]:
+    """
+    Runs all queries (key: query) against index in a single _msearch request and
+    returns key: list of hit documents. Queries matching more than
+    MSEARCH_PAGE_SIZE documents are completed with a scroll instead of count + slice.
+    """
+    search = get_search_client(index)
+    ms = MultiSearch(using=get_grq_client(), index=_get_index(index))
+    for q in queries.values():
+        ms = ms.add(search.query(q).extra(size=MSEARCH_PAGE_SIZE, track_total_hits=True))
+    responses = ms.execute()
+
+    docs = {}
+    for (key, q), resp in zip(queries.items(), responses):
+        if resp.hits.total.value > len(resp.hits):
+            scroll = search.query(q).params(size=MSEARCH_PAGE_SIZE).scan()
+            docs[key] = [hit.to_dict() for hit in scroll]
+        else:
+            docs[key] = [hit.to_dict() for hit in resp.hits]
+    return docs
+
+
+def _batched_msearch(index: str,
+                     queries: dict,
+                     batch_size: int = MSEARCH_BATCH_SIZE) -> dict[str, list[dict]]:
+    keys = list(queries)
+    docs = {}
+    for i in range(0, len(keys), batch_size):
+        batch = {key: queries[key] for key in keys[i:i + batch_size]}
+        docs.update(_msearch(index, batch))
+    return docs
+
+
+def _cache_connection() -> sqlite3.Connection:
+    ES_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(ES_CACHE_PATH, timeout=60)
+    con.execute('CREATE TABLE IF NOT EXISTS es_cache ('
+                'index_name TEXT NOT NULL, '
+                'query TEXT NOT NULL, '
+                'docs TEXT NOT NULL, '
+                'created REAL NOT NULL, '
+                'PRIMARY KEY (index_name, query))')
+    return con
+
+
+def _query_key(q: Q) -> str:
+    return json.dumps(q.to_dict(), sort_keys=True)
+
+
+def _cache_get(index_name: str,
+               query_keys: list[str],
+               ttl: float,
+               empty_ttl: float) -> dict[str, list[dict]]:
+    now = time.time()
+    cached = {}
+    with _cache_connection() as con:
+        for query_key in query_keys:
+            row = con.execute('SELECT docs, created FROM es_cache '
+                              'WHERE index_name = ? AND query = ?',
+                              (index_name, query_key)).fetchone()
+            if row is None:
+                continue
+            docs = json.loads(row[0])
+            if row[1] >= now - (ttl if docs else min(ttl, empty_ttl)):
+                cached[query_key] = docs
+    return cached
+
+
+def _cache_put(index_name: str, docs: dict[str, list[dict]]):
+    now = time.time()
+    with _cache_connection() as con:
+        con.executemany('INSERT OR REPLACE INTO es_cache VALUES (?, ?, ?, ?)',
+                        [(index_name, query_key, json.dumps(query_docs), now)
+                         for query_key, query_docs in docs.items()])
+
+
+def clear_es_cache(index: str = None, queries: list[Q] = None):
+    """
+    Drops cached results of the given queries in index, of all queries in index
+    when queries is None, or the whole cache when index is None as well.
+    """
+    with _cache_connection() as con:
+        if index is None and queries is None:
+            con.execute('DELETE FROM es_cache')
+        elif queries is None:
+            con.execute('DELETE FROM es_cache WHERE index_name = ?', (_get_index(index),))
+        else:
+            con.executemany('DELETE FROM es_cache WHERE index_name = ? AND query = ?',
+                            [(_get_index(index), _query_key(q)) for q in queries])
+
+
+def _cached_msearch(index: str,
+                    queries: dict,
+                    batch_size: int = MSEARCH_BATCH_SIZE,
+                    ttl: float = None,
+                    offline: bool = None) -> dict[str, list[dict]]:
+    """
+    _batched_msearch that serves queries from the on-disk cache when their result is
+    younger than ttl seconds (or ES_CACHE_EMPTY_TTL, if shorter, for queries that
+    found nothing), and only sends the remaining queries to GRQ. In offline mode,
+    nothing is sent and uncached queries raise a ValueError.
+    """
+    ttl = ES_CACHE_TTL if ttl is None else ttl
+    offline = ES_OFFLINE if offline is None else offline
+    index_name = _get_index(index)
+    query_keys = {key: _query_key(q) for key, q in queries.items()}
+    cached = _cache_get(index_name, list(query_keys.values()), ttl, ES_CACHE_EMPTY_TTL)
+
+    misses = {key: q for key, q in queries.items() if query_keys[key] not in cached}
+    if misses and offline:
+        raise ValueError(f'{len(misses)} queries are not cached and ES_OFFLINE is set, '
+                         f'e.g. {next(iter(misses))}')
+    if misses:
+        fetched = _batched_msearch(index, misses, batch_size)
+        _cache_put(index_name, {query_keys[key]: docs for key, docs in fetched.items()})
+        cached.update({query_keys[key]: docs for key, docs in fetched.items()})
+    return {key: cached[query_keys[key]] for key in queries}
+
+
+def get_rtc_docs_batch(input_ids: list[str],
+                       target_rtc_version=RTC_SAS_VERSION,
+                       batch_size: int = MSEARCH_BATCH_SIZE,
+                       ttl: float = None,
+                       offline: bool = None) -> dict[str, list[dict]]:
+    """
+    Looks up the RTC products of many input SLC granules with one _msearch request
+    per batch_size uncached granules. Returns input_id: list of RTC docs.
+    ttl and offline default to ES_CACHE_TTL and ES_OFFLINE (see _cached_msearch).
+    """
+    queries = {input_id: _rtc_query(input_id, target_rtc_version)
+               for input_id in dict.fromkeys(input_ids)}
+    return _cached_msearch(None, queries, batch_size, ttl, offline)
+
+
+def get_rtc_docs(input_id: str,
+                 target_rtc_version=RTC_SAS_VERSION) -> list[dict]:
+    "Version is determined by latest here: https://github.com/opera-adt/RTC/releases"
+    return get_rtc_docs_batch([input_id], target_rtc_version)[input_id]
+
+
+def _format_static_docs(burst_id: str, docs: list[dict]) -> list[dict]:
+    if not docs:
         print(f'{burst_id} does not have a entry in ES')
         return [{'burst_id': burst_id,
                  'sas_version': '',
                  'product_urls': ''}]
-    query = query[0:total]
-    resp = query.execute()
-    hits = list(resp.hits)
     out = [{'burst_id': burst_id,
-            'sas_version': hit['metadata']['sas_version'],
-            'product_urls': ' '.join(hit['metadata']['product_urls'])} for hit in hits]
+            'sas_version': doc['metadata']['sas_version'],
+            'product_urls': ' '.join(doc['metadata']['product_urls'])} for doc in docs]
     out = sorted(out, key=lambda data_dict: data_dict['sas_version'], reverse=True)
     return out
 
 
+def get_static_rtc_docs_batch(burst_ids: list[str],
+                              batch_size: int = MSEARCH_BATCH_SIZE,
+                              ttl: float = None,
+                              offline: bool = None) -> dict[str, list[dict]]:
+    """
+    Looks up the static layers of many bursts with one _msearch request per
+    batch_size uncached bursts. Returns burst_id: list of static layer records,
+    newest sas_version first.
+    ttl and offline default to ES_CACHE_TTL and ES_OFFLINE (see _cached_msearch).
+    """
+    queries = {burst_id: _static_query(burst_id) for burst_id in dict.fromkeys(burst_ids)}
+    docs = _cached_msearch('static', queries, batch_size, ttl, offline)
+    return {burst_id: _format_static_docs(burst_id, docs[burst_id]) for burst_id in docs}
+
+
+def get_static_rtc_docs(burst_id: str) -> list[dict]:
+    return get_static_rtc_docs_batch([burst_id])[burst_id]
+
+
 def get_rtc_urls(rtc_docs_lst: list[dict]) -> dict:
     urls = [{rtc_doc['id']: rtc_doc['metadata']['product_urls']
              for rtc_doc in rtc_docs} for rtc_docs in rtc_docs_lst]
@@ -126,18 +495,24 @@ def _get_urls_from_dict(product_url_dicts: dict) -> list[str]:
     return urls
 
 
-def download_rtc_products(url_dict: dict, directory: Path = None) -> Path:
+def download_rtc_products(url_dict: dict,
+                          directory: Path = None,
+                          max_workers: int = 10,
+                          **download_kwargs) -> Path:
+    """download_kwargs are passed to download_file, e.g. chunk_size or n_segments"""
     out_paths = _get_dst_paths_for_rtc(url_dict, directory=directory)
     [path.parent.mkdir(exist_ok=True, parents=True) for path in out_paths]
     urls = _get_urls_from_dict(url_dict)
+    pool_size = max(32, max_workers * download_kwargs.get('n_segments', 1))
+    session = get_download_session(pool_size)
 
     def download_one(data):
         url, out_path = data
-        download_file(url, out_path)
+        download_file(url, out_path, session=session, **download_kwargs)
         return out_path
 
     data_inputs = list(zip(urls, out_paths))
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
         _ = list(tqdm(executor.map(download_one, data_inputs),
                       total=len(data_inputs)))
     return out_paths
@@ -0,0 +1,132 @@
+"""
+Incrementally builds the OPERA RTC linking tables from OPERA-RTC_CalVal_S1_Scene_IDs.csv.
+
+Only SLCs missing from the existing opera_rtc_table (or linked with a different RTC
+SAS version, or to no RTC bursts) and bursts missing from the existing
+opera_rtc_static_table (or without static layers) are looked up in GRQ; all other
+rows are reused as is.
+
+    python link_datasets.py [--rtc_sas_version 1.0.1]
+"""
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+from es_db import RTC_SAS_VERSION, get_rtc_docs_batch, get_static_rtc_docs_batch
+
+SCENE_ID_CSV = Path(__file__).resolve().parents[1] / 'OPERA-RTC_CalVal_S1_Scene_IDs.csv'
+RTC_TABLE = Path(__file__).resolve().parent / 'opera_rtc_table.csv.zip'
+STATIC_TABLE = Path(__file__).resolve().parent / 'opera_rtc_static_table.csv'
+
+SCENE_COLUMNS = ['Site', 'Orbit_Direction', 'Orbital_Path', 'CalVal_Module', 'S1_Scene_IDs']
+# order of the RTC product URLs in each GRQ doc
+URL_COLUMNS = ['h5_url', 'browse_url', 'vh_url', 'vv_url', 'mask_url']
+RTC_COLUMNS = ['opera_rtc_ids', *URL_COLUMNS, 'n_bursts', 'rtc_sas_version']
+STATIC_COLUMNS = ['burst_id', 'sas_version', 'product_urls']
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scene_ids', type=Path, default=SCENE_ID_CSV,
+                        help='CSV of S1 scene IDs by site, orbit, and CalVal module')
+    parser.add_argument('--rtc_table', type=Path, default=RTC_TABLE,
+                        help='RTC linking table to update')
+    parser.add_argument('--static_table', type=Path, default=STATIC_TABLE,
+                        help='static layer linking table to update')
+    parser.add_argument('--rtc_sas_version', type=str, default=RTC_SAS_VERSION,
+                        help='RTC SAS version to link; rows linked with another version are re-resolved')
+    return parser.parse_args()
+
+
+def read_scene_ids(scene_id_csv: Path) -> pd.DataFrame:
+    df_data = pd.read_csv(scene_id_csv)
+    df_data['S1_Scene_IDs'] = df_data.S1_Scene_IDs.map(lambda s: s.split())
+    df_data = df_data.explode('S1_Scene_IDs').reset_index(drop=True)
+    return df_data
+
+
+def read_table(path: Path, columns: list[str]) -> pd.DataFrame:
+    if not path.exists():
+        return pd.DataFrame(columns=columns)
+    return pd.read_csv(path, index_col=0, keep_default_na=False)
+
+
+def resolve_rtc_rows(slc_ids: list[str], rtc_sas_version: str) -> pd.DataFrame:
+    rtc_docs = get_rtc_docs_batch(slc_ids, rtc_sas_version)
+    rows = []
+    for slc_id in slc_ids:
+        urls = {doc['id']: doc['metadata']['product_urls'] for doc in rtc_docs[slc_id]}
+        row = {'S1_Scene_IDs': slc_id,
+               'opera_rtc_ids': ' '.join(urls),
+               'n_bursts': len(urls),
+               'rtc_sas_version': rtc_sas_version}
+        for k, column in enumerate(URL_COLUMNS):
+            row[column] = ' '.join(product_urls[k] for product_urls in urls.values())
+        rows.append(row)
+    return pd.DataFrame(rows, columns=['S1_Scene_IDs', *RTC_COLUMNS])
+
+
+def update_rtc_table(df_scenes: pd.DataFrame,
+                     df_rtc: pd.DataFrame,
+                     rtc_sas_version: str) -> pd.DataFrame:
+    """
+    Returns the RTC table for df_scenes, reusing the rows of df_rtc linked to RTC
+    bursts of rtc_sas_version and resolving only the remaining SLCs, including those
+    that had no RTC bursts yet when they were last resolved
+    """
+    if 'rtc_sas_version' not in df_rtc:
+        # tables built before versions were recorded were linked with the default version
+        df_rtc['rtc_sas_version'] = RTC_SAS_VERSION
+    df_rtc = df_rtc.astype({'rtc_sas_version': str})
+    has_bursts = pd.to_numeric(df_rtc.n_bursts, errors='coerce').fillna(0) > 0
+    linked = df_rtc[(df_rtc.rtc_sas_version == rtc_sas_version) & has_bursts]
+    linked = linked.drop_duplicates('S1_Scene_IDs').set_index('S1_Scene_IDs')[RTC_COLUMNS]
+
+    slc_ids = list(dict.fromkeys(df_scenes.S1_Scene_IDs))
+    new_ids = [slc_id for slc_id in slc_ids if slc_id not in linked.index]
+    print(f'Linking {len(new_ids)} of {len(slc_ids)} SLCs, reusing {len(slc_ids) - len(new_ids)}')
+    if new_ids:
+        resolved = resolve_rtc_rows(new_ids, rtc_sas_version).set_index('S1_Scene_IDs')
+        linked = pd.concat([linked, resolved])
+
+    df_out = df_scenes[SCENE_COLUMNS].join(linked, on='S1_Scene_IDs')
+    return df_out.astype({'n_bursts': int}).reset_index(drop=True)
+
+
+def update_static_table(df_rtc: pd.DataFrame, df_static: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the static layer table for the bursts of df_rtc, reusing the rows of
+    df_static with static layers and resolving only the remaining bursts
+    """
+    rtc_ids = [id_ for ids in df_rtc.opera_rtc_ids for id_ in ids.split()]
+    burst_ids = list(dict.fromkeys(id_.split('_')[3] for id_ in rtc_ids))
+
+    df_static = df_static.astype({'sas_version': str, 'product_urls': str})
+    linked = df_static[df_static.product_urls != ''].drop_duplicates('burst_id')
+    linked = linked.set_index('burst_id')
+    new_ids = [burst_id for burst_id in burst_ids if burst_id not in linked.index]
+    print(f'Linking static layers of {len(new_ids)} of {len(burst_ids)} bursts')
+    if new_ids:
+        static_docs = get_static_rtc_docs_batch(new_ids)
+        resolved = pd.DataFrame([static_docs[burst_id][0] for burst_id in new_ids],
+                                columns=STATIC_COLUMNS).set_index('burst_id')
+        linked = pd.concat([linked, resolved])
+    return linked.loc[burst_ids, STATIC_COLUMNS[1:]].reset_index()
+
+
+def main():
+    args = parse_args()
+    df_scenes = read_scene_ids(args.scene_ids)
+
+    df_rtc = update_rtc_table(df_scenes,
+                              read_table(args.rtc_table, ['S1_Scene_IDs', *RTC_COLUMNS]),
+                              args.rtc_sas_version)
+    df_rtc.to_csv(args.rtc_table)
+
+    df_static = update_static_table(df_rtc, read_table(args.static_table, STATIC_COLUMNS))
+    df_static.to_csv(args.static_table)
+
+
+if __name__ == '__main__':
+    main()
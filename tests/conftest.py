@@ -0,0 +1,30 @@
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+# util/ is imported from the repo root and es_db from linking-data/, as the scripts do
+sys.path[:0] = [str(REPO_DIR), str(REPO_DIR / "linking-data")]
+
+
+@pytest.fixture
+def serve():
+    """
+    Returns: a function starting a local HTTP server with a request handler class and
+             returning its base URL; the servers are shut down after the test
+    """
+    servers = []
+
+    def _serve(handler) -> str:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield _serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,90 @@
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from util.burst_discovery import (
+    BEAM_MODES,
+    MAX_BURSTS,
+    POLARIZATIONS,
+    discover_bursts,
+    probe_burst,
+)
+
+SCENE = "S1A_IW_SLC__1SDV_20230101T000000_20230101T000027_046568_059497_ABCD"
+# bursts of each swath in the scene; the other MAX_BURSTS - 2 are missing
+N_BURSTS = 2
+
+
+@pytest.fixture
+def extractor(serve):
+    """
+    Local stand-in for the burst extractor: answers 202 to the first request for
+    each burst of the scene and 200 to the following ones, and 404 for the bursts
+    missing from the scene. Records the requested paths.
+    """
+    requested = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path)
+            _, scene, beam_mode, polarization, name = self.path.split("/")
+            burst = int(name.split(".")[0])
+            if scene != SCENE or burst >= N_BURSTS:
+                self.send_response(404)
+            elif requested.count(self.path) == 1:
+                self.send_response(202)
+                self.send_header("Retry-After", "0")
+            else:
+                self.send_response(200)
+                self.send_header(
+                    "Content-Disposition",
+                    f"attachment; filename=S1_{135524 + burst}_{beam_mode}"
+                    f"_20230101T000000_{polarization}_ABCD-BURST.xml",
+                )
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    return serve(Handler), requested
+
+
+def test_only_pending_bursts_are_polled_again(extractor):
+    url, requested = extractor
+
+    bursts = discover_bursts(SCENE, "T064", base_url=url, max_workers=8, backoff=0)
+
+    assert bursts == [
+        f"OPERA_L2_RTC-S1_T064-{135524 + burst}-{beam_mode}"
+        for beam_mode in BEAM_MODES
+        for burst in range(N_BURSTS)
+    ]
+    counts = Counter(requested)
+    assert len(counts) == len(BEAM_MODES) * len(POLARIZATIONS) * MAX_BURSTS
+    for path, count in counts.items():
+        burst = int(path.split("/")[-1].split(".")[0])
+        # 202 then 200 for bursts of the scene, a single 404 for the others
+        assert count == (2 if burst < N_BURSTS else 1), path
+
+
+def test_probe_gives_up_after_max_retries(serve):
+    requested = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path)
+            self.send_response(202)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    url = serve(Handler)
+
+    with pytest.raises(RuntimeError, match="not ready after 3 retries"):
+        probe_burst(f"{url}/{SCENE}/IW1/VV/0.xml", requests.Session(), max_retries=3, backoff=0)
+    assert len(requested) == 4
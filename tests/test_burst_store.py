@@ -0,0 +1,106 @@
+import os
+from functools import partial
+from http.server import SimpleHTTPRequestHandler
+
+import pytest
+
+from util.burst_store import BurstStore
+from util.manifest import DOWNLOADED, RunManifest, fingerprint
+from util.pipeline import destination_paths, download_files, http_download
+
+BURSTS = [
+    f"OPERA_L2_RTC-S1_T160-34221{i}-IW1_20230101T000000Z_S1A_30_v1.0_VV.tif"
+    for i in range(3)
+]
+
+
+@pytest.fixture
+def daac(tmp_path, serve):
+    """
+    Local stand-in for the DAAC, serving 1 kB bursts and recording the requests
+    """
+    root = tmp_path / "daac"
+    root.mkdir()
+    for i, name in enumerate(BURSTS):
+        (root / name).write_bytes(bytes([i]) * 1000)
+    requests = []
+
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path.lstrip("/"))
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    url = serve(partial(Handler, directory=str(root)))
+    return [f"{url}/{name}" for name in BURSTS], requests
+
+
+def download_scene(urls, burst_dir, manifest, store):
+    """
+    The download stage of the bulk scripts
+    """
+    url_dirs = [(url, burst_dir) for url in urls]
+    download_fp = fingerprint(values=urls)
+    if not manifest.is_done(
+        "scene", DOWNLOADED, download_fp, outputs=destination_paths(url_dirs)
+    ):
+        download_files(url_dirs, download=store.download)
+        manifest.mark("scene", DOWNLOADED, download_fp)
+    return sorted(burst_dir.glob("*VV.tif"))
+
+
+def test_rerun_refetches_evicted_symlinked_products(tmp_path, daac, monkeypatch):
+    urls, requests = daac
+    # a store on another file system, linked into the run by symlinks
+    monkeypatch.setattr(os, "link", lambda *args: (_ for _ in ()).throw(OSError()))
+    store = BurstStore(tmp_path / "store", download=http_download)
+    manifest = RunManifest(tmp_path / "run" / "run_manifest.sqlite")
+    burst_dir = tmp_path / "run" / "vv_bursts"
+    burst_dir.mkdir()
+
+    with store.active_run("run"):
+        bursts = download_scene(urls, burst_dir, manifest, store)
+    assert all(pth.is_symlink() for pth in bursts)
+    assert sorted(requests) == BURSTS
+
+    # another run fills the store past its quota once this run has ended
+    evicted = store.evict(1500)
+    assert len(evicted) == 2
+    assert sum(pth.exists() for pth in bursts) == 1
+
+    requests.clear()
+    with store.active_run("run"):
+        bursts = download_scene(urls, burst_dir, manifest, store)
+    assert sorted(requests) == sorted(evicted)
+    assert [pth.read_bytes()[:1] for pth in bursts] == [bytes([i]) for i in range(3)]
+
+    # nothing is downloaded while the links resolve
+    requests.clear()
+    download_scene(urls, burst_dir, manifest, store)
+    assert requests == []
+
+
+def test_quota_keeps_products_of_active_runs(tmp_path, daac):
+    urls, requests = daac
+    store = BurstStore(tmp_path / "store", quota_gb=1500 / 1024**3, download=http_download)
+    burst_dirs = [tmp_path / run for run in ["run_1", "run_2"]]
+    for burst_dir in burst_dirs:
+        burst_dir.mkdir()
+
+    with store.active_run("run_1"):
+        download_files([(url, burst_dirs[0]) for url in urls], download=store.download)
+        # over quota, but every product is referenced by the active run
+        assert store.size() == 3000
+        # a concurrent run, in another process, sharing the store
+        other = BurstStore(tmp_path / "store", download=http_download)
+        with other.active_run("run_2"):
+            download_files([(url, burst_dirs[1]) for url in urls], download=other.download)
+
+    # the second run reused the store's products
+    assert sorted(requests) == BURSTS
+    assert all(len(list(d.glob("*VV.tif"))) == 3 for d in burst_dirs)
+    # once no run references them, the least recently used products are evicted
+    assert len(store.evict(store.quota_bytes)) == 2
+    assert store.size() == 1000
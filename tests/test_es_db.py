@@ -0,0 +1,417 @@
+import hashlib
+import json
+import os
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+es_db = pytest.importorskip("es_db")
+from elasticsearch import Elasticsearch  # noqa: E402
+
+SHARDS = {"total": 1, "successful": 1, "skipped": 0, "failed": 0}
+
+
+def rtc_doc(slc: str, burst: str, sas_version: str = es_db.RTC_SAS_VERSION) -> dict:
+    opera_id = f"OPERA_L2_RTC-S1_{burst}_20230101T000000Z_20230102T000000Z_S1A_30_v1.0"
+    return {
+        "id": opera_id,
+        "metadata": {
+            "id": opera_id,
+            "input_granule_id": slc,
+            "sas_version": sas_version,
+            "product_urls": [f"https://example.com/{opera_id}_VV.tif"],
+        },
+    }
+
+
+def static_doc(burst: str, sas_version: str) -> dict:
+    static_id = f"OPERA_L2_RTC-S1-STATIC_{burst}_20140403_S1A_{sas_version}"
+    return {
+        "id": static_id,
+        "metadata": {
+            "id": static_id,
+            "sas_version": sas_version,
+            "product_urls": [f"https://example.com/{static_id}_mask.tif"],
+        },
+    }
+
+
+def field(doc: dict, name: str) -> str:
+    for key in name.split("."):
+        doc = doc[key]
+    return doc
+
+
+def matches(doc: dict, query: dict) -> bool:
+    """
+    Evaluates the query_string (quoted phrase) and bool/must queries es_db sends
+    """
+    if "bool" in query:
+        return all(matches(doc, q) for q in query["bool"]["must"])
+    q = query["query_string"]
+    return q["query"].strip('"') in field(doc, q["default_field"])
+
+
+class StandInES:
+    """
+    Local stand-in for the GRQ Elasticsearch endpoints es_db uses: _msearch and
+    scrolled _search
+    """
+
+    def __init__(self, docs: dict):
+        # index name: documents
+        self.docs = docs
+        self.requests = []
+        self._scrolls = {}
+
+    def handler(self):
+        es = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, body: dict):
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.end_headers()
+
+            def do_GET(self):
+                self._reply(
+                    {
+                        "version": {"number": "7.17.0", "build_flavor": "default"},
+                        "tagline": "You Know, for Search",
+                    }
+                )
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                body = self._body()
+                es.requests.append(url.path)
+                if url.path.endswith("/_msearch"):
+                    self._reply(es.msearch(url.path.split("/")[1], body))
+                elif url.path == "/_search/scroll":
+                    self._reply(es.scroll(json.loads(body)["scroll_id"]))
+                elif url.path.endswith("/_search"):
+                    query = json.loads(body)
+                    size = int(params["size"][0]) if "size" in params else query["size"]
+                    self._reply(es.search(url.path.split("/")[1], query, size))
+                else:
+                    self.send_error(404)
+
+            def do_DELETE(self):
+                self._body()
+                es.requests.append(f"DELETE {urlparse(self.path).path}")
+                self._reply({"succeeded": True, "num_freed": 1})
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _hits(self, index: str, query: dict) -> list:
+        return [
+            {"_index": index, "_id": doc["id"], "_score": 1.0, "_source": doc}
+            for doc in self.docs.get(index, [])
+            if matches(doc, query)
+        ]
+
+    def msearch(self, index: str, body: bytes) -> dict:
+        lines = [json.loads(line) for line in body.decode().splitlines() if line]
+        responses = []
+        for query in lines[1::2]:
+            hits = self._hits(index, query["query"])
+            responses.append(
+                {
+                    "_shards": SHARDS,
+                    "hits": {
+                        "total": {"value": len(hits), "relation": "eq"},
+                        "hits": hits[: query.get("size", 10)],
+                    },
+                }
+            )
+        return {"responses": responses}
+
+    def search(self, index: str, body: dict, size: int) -> dict:
+        scroll_id = f"scroll-{len(self._scrolls)}"
+        self._scrolls[scroll_id] = (self._hits(index, body["query"]), size)
+        return self.scroll(scroll_id)
+
+    def scroll(self, scroll_id: str) -> dict:
+        hits, size = self._scrolls[scroll_id]
+        self._scrolls[scroll_id] = (hits[size:], size)
+        return {
+            "_scroll_id": scroll_id,
+            "_shards": SHARDS,
+            "hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": hits[:size]},
+        }
+
+
+@pytest.fixture
+def grq(serve, tmp_path, monkeypatch):
+    """
+    Points es_db at a stand-in GRQ server, with an empty on-disk cache
+    """
+    es = StandInES({es_db.RTC_INDEX: [], es_db.STATIC_INDEX: []})
+    url = serve(es.handler())
+    monkeypatch.setattr(es_db, "get_grq_client", lambda: Elasticsearch(url))
+    monkeypatch.setattr(es_db, "ES_CACHE_PATH", tmp_path / "es_cache.sqlite")
+    es_db.get_search_client.cache_clear()
+    yield es
+    es_db.get_search_client.cache_clear()
+
+
+def test_rtc_lookups_are_batched(grq):
+    slcs = [f"S1A_IW_SLC__1SDV_2023010{i}T000000_SLC" for i in range(5)]
+    grq.docs[es_db.RTC_INDEX] = [
+        rtc_doc(slc, f"T160-34221{i}-IW1") for i, slc in enumerate(slcs[:4])
+    ] + [rtc_doc(slcs[0], "T160-342219-IW2", sas_version="0.4")]
+
+    docs = es_db.get_rtc_docs_batch(slcs + slcs[:2], batch_size=2)
+
+    # 5 distinct granules in batches of 2, one _msearch each, and no count or scroll
+    assert grq.requests == [f"/{es_db.RTC_INDEX}/_msearch"] * 3
+    assert list(docs) == slcs
+    assert [len(docs[slc]) for slc in slcs] == [1, 1, 1, 1, 0]
+    assert docs[slcs[0]][0]["metadata"]["sas_version"] == es_db.RTC_SAS_VERSION
+
+
+def test_large_results_are_scrolled(grq, monkeypatch):
+    monkeypatch.setattr(es_db, "MSEARCH_PAGE_SIZE", 2)
+    burst = "T160-342211-IW1"
+    versions = ["0.2", "0.4", "1.0", "0.3", "0.1"]
+    grq.docs[es_db.STATIC_INDEX] = [static_doc(burst, v) for v in versions] + [
+        static_doc("T160-342212-IW2", "1.0")
+    ]
+
+    docs = es_db.get_static_rtc_docs_batch([burst, "T160-342212-IW2"])
+
+    assert [d["sas_version"] for d in docs[burst]] == sorted(versions, reverse=True)
+    assert len(docs["T160-342212-IW2"]) == 1
+    # one _msearch, then only the burst with more hits than a page is scrolled:
+    # 3 pages of 2 and a last empty page, then the scroll is cleared
+    assert grq.requests == [
+        f"/{es_db.STATIC_INDEX}/_msearch",
+        f"/{es_db.STATIC_INDEX}/_search",
+        "/_search/scroll",
+        "/_search/scroll",
+        "/_search/scroll",
+        "DELETE /_search/scroll",
+    ]
+
+
+def test_empty_results_expire_sooner(grq, monkeypatch):
+    monkeypatch.setattr(es_db, "ES_CACHE_EMPTY_TTL", 0)
+    found = "S1A_IW_SLC__1SDV_20230101T000000_SLC"
+    unpublished = "S1A_IW_SLC__1SDV_20230102T000000_SLC"
+    grq.docs[es_db.RTC_INDEX] = [rtc_doc(found, "T160-342211-IW1")]
+
+    docs = es_db.get_rtc_docs_batch([found, unpublished])
+    assert [len(docs[found]), len(docs[unpublished])] == [1, 0]
+
+    # the RTC of the second granule is published after the first lookup
+    grq.docs[es_db.RTC_INDEX].append(rtc_doc(unpublished, "T160-342212-IW1"))
+    grq.requests.clear()
+    docs = es_db.get_rtc_docs_batch([found, unpublished])
+
+    # only the granule that had no RTC is looked up again
+    assert [len(docs[found]), len(docs[unpublished])] == [1, 1]
+    assert grq.requests == [f"/{es_db.RTC_INDEX}/_msearch"]
+    grq.requests.clear()
+    assert es_db.get_rtc_docs_batch([found, unpublished]) == docs
+    assert grq.requests == []
+
+
+def test_offline_serves_cached_results(grq):
+    slc = "S1A_IW_SLC__1SDV_20230101T000000_SLC"
+    grq.docs[es_db.RTC_INDEX] = [rtc_doc(slc, "T160-342211-IW1")]
+    docs = es_db.get_rtc_docs_batch([slc])
+    grq.requests.clear()
+
+    assert es_db.get_rtc_docs_batch([slc], offline=True) == docs
+    assert grq.requests == []
+    with pytest.raises(ValueError):
+        es_db.get_rtc_docs_batch(["S1A_IW_SLC__1SDV_20230102T000000_SLC"], offline=True)
+
+
+class StandInFiles(BaseHTTPRequestHandler):
+    """
+    Local stand-in for a product server, serving `data` with HEAD and (unless
+    `ranges` is False) Range requests, failing the ranges starting at `fail_starts`,
+    and recording the Range header of each GET
+    """
+
+    data = b""
+    ranges = True
+    fail_starts = set()
+    requested = []
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.data)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        range_ = self.headers.get("Range")
+        self.requested.append(range_)
+        if not (range_ and self.ranges):
+            return self._send(200, self.data)
+        start, end = range_.split("=")[1].split("-")
+        start, end = int(start), int(end) if end else len(self.data) - 1
+        if start in self.fail_starts:
+            return self._send(403, b"")
+        if start >= len(self.data):
+            return self._send(416, b"", {"Content-Range": f"bytes */{len(self.data)}"})
+        body = self.data[start : end + 1]
+        content_range = f"bytes {start}-{start + len(body) - 1}/{len(self.data)}"
+        self._send(206, body, {"Content-Range": content_range})
+
+    def _send(self, status: int, body: bytes, headers: dict = None):
+        self.send_response(status)
+        for key, value in {**(headers or {}), "Content-Length": len(body)}.items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def files(serve, tmp_path):
+    """
+    Returns: a function serving bytes with StandInFiles options, returning the URL,
+             the path to download it to, and the Range headers requested
+    """
+
+    def _files(data: bytes, **options):
+        handler = type("Handler", (StandInFiles,), {"data": data, "requested": [], **options})
+        url = f"{serve(handler)}/product.h5"
+        return url, tmp_path / "product.h5", handler.requested
+
+    return _files
+
+
+def download(url, out_path, **kwargs):
+    # no retries, so failures surface at once
+    return es_db.download_file(url, out_path, session=requests.Session(), **kwargs)
+
+
+DATA = os.urandom(10_000)
+
+
+def test_partial_file_is_resumed(files):
+    url, out_path, requested = files(DATA)
+    part_path = out_path.with_name("product.h5.part")
+    part_path.write_bytes(DATA[:3000])
+
+    download(url, out_path)
+
+    assert out_path.read_bytes() == DATA
+    assert requested == ["bytes=3000-"]
+    assert not part_path.exists()
+
+
+def test_server_ignoring_range_is_downloaded_again(files):
+    url, out_path, requested = files(DATA, ranges=False)
+    out_path.with_name("product.h5.part").write_bytes(DATA[:3000])
+
+    download(url, out_path)
+
+    assert out_path.read_bytes() == DATA
+    assert requested == ["bytes=3000-"]
+
+
+def test_large_files_are_fetched_in_segments(files, monkeypatch):
+    monkeypatch.setattr(es_db, "SEGMENT_MIN_SIZE", 1000)
+    url, out_path, requested = files(DATA)
+
+    download(url, out_path, n_segments=4, chunk_size=512)
+
+    assert out_path.read_bytes() == DATA
+    assert sorted(requested) == sorted(
+        ["bytes=0-2499", "bytes=2500-4999", "bytes=5000-7499", "bytes=7500-9999"]
+    )
+    assert sorted(p.name for p in out_path.parent.iterdir()) == ["product.h5"]
+
+
+def test_size_and_checksum_are_verified(files):
+    url, out_path, _ = files(DATA)
+
+    with pytest.raises(ValueError, match="expected 9999"):
+        download(url, out_path, expected_size=9999)
+    with pytest.raises(ValueError, match="checksum mismatch"):
+        download(url, out_path, checksum="0" * 32)
+    assert list(out_path.parent.iterdir()) == []
+
+    download(url, out_path, checksum=hashlib.md5(DATA).hexdigest())
+    assert out_path.read_bytes() == DATA
+
+
+def test_failed_segments_are_not_resumed_as_a_stream(files, monkeypatch):
+    monkeypatch.setattr(es_db, "SEGMENT_MIN_SIZE", 1000)
+    url, out_path, requested = files(DATA, fail_starts={5000})
+    part_path = out_path.with_name("product.h5.part")
+
+    with pytest.raises(requests.HTTPError):
+        download(url, out_path, n_segments=4)
+    # no zero-filled part file of full size is left to resume from
+    assert list(out_path.parent.iterdir()) == []
+
+    # a killed segmented download leaves its part file and the segments record
+    part_path.write_bytes(DATA[:5000] + bytes(5000))
+    out_path.with_name("product.h5.part.segments").write_text(
+        json.dumps({"bounds": [0, 2500, 5000, 7500, 10000], "done": [0, 1]})
+    )
+    requested.clear()
+    download(url, out_path)
+
+    assert out_path.read_bytes() == DATA
+    assert requested == [None]
+    assert sorted(p.name for p in out_path.parent.iterdir()) == ["product.h5"]
+
+
+def test_killed_segmented_download_resumes_missing_segments(files, monkeypatch):
+    monkeypatch.setattr(es_db, "SEGMENT_MIN_SIZE", 1000)
+    url, out_path, requested = files(DATA)
+    out_path.with_name("product.h5.part").write_bytes(DATA[:5000] + bytes(5000))
+    out_path.with_name("product.h5.part.segments").write_text(
+        json.dumps({"bounds": [0, 2500, 5000, 7500, 10000], "done": [0, 1]})
+    )
+
+    download(url, out_path, n_segments=4)
+
+    assert out_path.read_bytes() == DATA
+    assert sorted(requested) == ["bytes=5000-7499", "bytes=7500-9999"]
+    assert sorted(p.name for p in out_path.parent.iterdir()) == ["product.h5"]
+
+
+def test_part_file_is_checked_against_remote_size(files):
+    url, out_path, requested = files(DATA)
+    part_path = out_path.with_name("product.h5.part")
+    # complete: the server answers 416 to its resume request
+    part_path.write_bytes(DATA)
+    download(url, out_path)
+    assert out_path.read_bytes() == DATA
+    assert requested == ["bytes=10000-"]
+
+    # longer than the remote file
+    out_path.unlink()
+    part_path.write_bytes(DATA + bytes(100))
+    requested.clear()
+    download(url, out_path)
+    assert out_path.read_bytes() == DATA
+    assert requested == [None]
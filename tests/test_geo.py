@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("osgeo.gdal")
+from osgeo import osr  # noqa: E402
+
+from util import geo  # noqa: E402
+from util.raster_index import RasterIndex  # noqa: E402
+
+EPSG = 32611
+RES = 30
+ORIGIN = (399990.0, 3849990.0)
+
+
+def write_layer(pth, data: np.ndarray, nodata, origin=ORIGIN):
+    """
+    Writes a single-band GeoTiff of data on the 30 m UTM 11N grid
+    """
+    f = gdal.GetDriverByName("GTiff").Create(
+        str(pth),
+        data.shape[1],
+        data.shape[0],
+        1,
+        gdal.GetDataTypeByName({"float32": "Float32", "uint8": "Byte"}[data.dtype.name]),
+    )
+    f.SetGeoTransform((origin[0], RES, 0, origin[1], 0, -RES))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+    f.SetProjection(srs.ExportToWkt())
+    f.GetRasterBand(1).SetNoDataValue(nodata)
+    f.GetRasterBand(1).WriteArray(data)
+    f = None
+    return pth
+
+
+@pytest.fixture(autouse=True)
+def raster_index(tmp_path, monkeypatch):
+    index = RasterIndex(tmp_path / "raster_metadata.sqlite")
+    monkeypatch.setattr(geo, "get_raster_index", lambda: index)
+    return index
+
+
+@pytest.mark.parametrize("profile", [None, geo.COG_PROFILE])
+def test_stack_layers_converts_nodata_to_nan(tmp_path, profile):
+    rng = np.random.default_rng(0)
+    backscatter = rng.random((1024, 1024), dtype=np.float32)
+    backscatter[:100] = np.nan
+    # layover/shadow mask classes, with 255 outside the footprint
+    mask = rng.integers(0, 3, (1024, 1024), dtype=np.uint8)
+    mask[:, :100] = 255
+    layers = [
+        write_layer(tmp_path / "vv.tif", backscatter, np.nan),
+        write_layer(tmp_path / "mask.tif", mask, 255),
+    ]
+
+    output = geo.stack_layers(layers, tmp_path / "stack.tif", ["VV", "ls_mask"], profile)
+
+    f = gdal.Open(str(output))
+    assert f.GetRasterBand(2).GetDescription() == "ls_mask"
+    stacked = f.ReadAsArray()
+    np.testing.assert_array_equal(stacked[0], backscatter)
+    expected_mask = np.where(mask == 255, np.nan, mask).astype(np.float32)
+    np.testing.assert_array_equal(stacked[1], expected_mask)
+    if profile:
+        # mask classes are not averaged in the overviews
+        overview = f.GetRasterBand(2).GetOverview(0).ReadAsArray()
+        assert set(np.unique(overview[~np.isnan(overview)])) <= {0, 1, 2}
+    f = None
+
+
+def test_failed_mosaic_leaves_no_temporary_file(tmp_path, monkeypatch):
+    data = np.ones((300, 200), dtype=np.float32)
+    # side by side
+    origins = [ORIGIN, (ORIGIN[0] + 200 * RES, ORIGIN[1])]
+    bursts = [
+        write_layer(tmp_path / f"burst_{i}.tif", data * i, np.nan, origin)
+        for i, origin in enumerate(origins)
+    ]
+    output = tmp_path / "mosaic.tif"
+
+    def failing_translate(*args, **kwargs):
+        raise RuntimeError("disk full")
+
+    with monkeypatch.context() as m:
+        m.setattr(geo.gdal, "Translate", failing_translate)
+        with pytest.raises(RuntimeError, match="disk full"):
+            geo.mosaic_bursts(bursts, output, block_size=128)
+    assert not (tmp_path / "tmp_mosaic.tif").exists()
+
+    geo.mosaic_bursts(bursts, output, block_size=128)
+    assert not (tmp_path / "tmp_mosaic.tif").exists()
+    mosaic = gdal.Open(str(output)).ReadAsArray()
+    assert mosaic.shape == (300, 400)
+    np.testing.assert_array_equal(mosaic[:, :200], 0)
+    np.testing.assert_array_equal(mosaic[:, 200:], 1)
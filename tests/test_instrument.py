@@ -0,0 +1,43 @@
+import json
+import threading
+
+from util.instrument import configure, in_current_span, print_summary, span
+
+
+def test_concurrent_spans_are_process_wide(tmp_path, monkeypatch, capsys):
+    # restored after the test, as configure sets it for the process
+    monkeypatch.setenv("CALVAL_RTC_SPANS", "")
+    spans_path = configure(tmp_path / "spans.jsonl")
+    both_open = threading.Barrier(2)
+
+    def stage(name):
+        with span(name):
+            both_open.wait(timeout=10)
+
+    with span("scene", "S1A_scene"):
+        with span("nested"):
+            pass
+        threads = [
+            threading.Thread(target=in_current_span(stage), args=(name,))
+            for name in ["vv", "vh"]
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    with span("alone"):
+        pass
+
+    with open(spans_path) as f:
+        records = {r["stage"]: r for r in map(json.loads, f)}
+    # the parent includes the work of its threads, so it is not process-wide
+    assert {stage: r["process_wide"] for stage, r in records.items()} == {
+        "nested": False,
+        "vv": True,
+        "vh": True,
+        "scene": False,
+        "alone": False,
+    }
+    assert records["vv"]["scene"] == "S1A_scene"
+    print_summary([spans_path])
+    assert "2 of 5 spans ran alongside other spans" in capsys.readouterr().out
@@ -0,0 +1,100 @@
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("osgeo.gdal")
+from osgeo import osr  # noqa: E402
+
+from util.landcover import LANDCOVER_PRODUCT, LandcoverStore  # noqa: E402
+
+# Delta Junction, Alaska, in UTM zone 6N, within the stand-in W160N80 tile
+EPSG = "32606"
+BOUNDS = (555010.0, 7097020.0, 564990.0, 7106980.0)
+TILE_VALUE = 111
+
+
+def write_tile(tile_root, tile, value, res=0.05):
+    """
+    Writes a stand-in 20 x 20 degree LC100 tile named like the PROBA-V tiles, whose
+    name is the tile's upper left corner, filled with `value`
+    """
+    left = -int(tile[1:4]) if tile[0] == "W" else int(tile[1:4])
+    top = -int(tile[5:7]) if tile[4] == "S" else int(tile[5:7])
+    pth = tile_root / tile / f"{tile}_{LANDCOVER_PRODUCT}_EPSG-4326.tif"
+    pth.parent.mkdir(parents=True)
+    size = int(20 / res)
+    f = gdal.GetDriverByName("GTiff").Create(str(pth), size, size, 1, gdal.GDT_Byte)
+    f.SetGeoTransform((left, res, 0, top, 0, -res))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    f.SetProjection(srs.ExportToWkt())
+    f.GetRasterBand(1).WriteArray(np.full((size, size), value, dtype=np.uint8))
+    f = None
+
+
+@pytest.fixture
+def tile_server(tmp_path, serve):
+    tile_root = tmp_path / "server"
+    write_tile(tile_root, "W160N80", TILE_VALUE)
+    requests = []
+
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    return serve(partial(Handler, directory=str(tile_root))), requests
+
+
+def test_get_clip_downloads_and_warps_once(tmp_path, tile_server, monkeypatch):
+    base_url, requests = tile_server
+    store = LandcoverStore(tmp_path / "store", base_url)
+    warps = []
+    warp = gdal.Warp
+    monkeypatch.setattr(gdal, "Warp", lambda *a, **k: warps.append(a) or warp(*a, **k))
+
+    clip = store.get_clip(EPSG, BOUNDS, res=30)
+    f = gdal.Open(str(clip))
+    assert (f.GetRasterBand(1).ReadAsArray() == TILE_VALUE).all()
+    # bounds are expanded outward to the 30 m grid
+    ulx, res, _, uly, _, _ = f.GetGeoTransform()
+    assert (ulx, uly, res) == (555000.0, 7107000.0, 30.0)
+    f = None
+
+    # a second store over the same directory, as in another scene's process
+    assert LandcoverStore(tmp_path / "store", base_url).get_clip(EPSG, BOUNDS, 30) == clip
+    assert len(requests) == 1
+    assert len(warps) == 1
+    assert store.vrt_path.exists()
+    assert not list((tmp_path / "store").rglob("*.part"))
+
+
+def test_concurrent_get_clip(tmp_path, tile_server):
+    base_url, requests = tile_server
+    stores = [LandcoverStore(tmp_path / "store", base_url) for _ in range(4)]
+    clips, errors = [], []
+
+    def get_clip(store):
+        try:
+            clips.append(store.get_clip(EPSG, BOUNDS, res=30))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=get_clip, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(set(clips)) == 1
+    f = gdal.Open(str(clips[0]))
+    assert (f.GetRasterBand(1).ReadAsArray() == TILE_VALUE).all()
+    f = None
+    assert not list((tmp_path / "store").rglob("*.part"))
@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+link_datasets = pytest.importorskip("link_datasets")
+
+SLCS = [f"S1A_IW_SLC__1SDV_2023010{i}T000000_SLC" for i in range(3)]
+
+
+def rtc_docs(slc: str) -> list:
+    burst = f"T160-34221{SLCS.index(slc)}-IW1"
+    opera_id = f"OPERA_L2_RTC-S1_{burst}_20230101T000000Z_S1A_30_v1.0"
+    urls = [f"https://example.com/{opera_id}{suffix}" for suffix in
+            [".h5", "_BROWSE.png", "_VH.tif", "_VV.tif", "_mask.tif"]]
+    return [{"id": opera_id, "metadata": {"product_urls": urls}}]
+
+
+@pytest.fixture
+def grq(monkeypatch):
+    """
+    Stand-in for the GRQ lookup, returning RTC docs for the SLCs in `published`
+    """
+    lookups = []
+    published = set()
+
+    def get_rtc_docs_batch(slc_ids, rtc_sas_version):
+        lookups.append(list(slc_ids))
+        return {slc: rtc_docs(slc) if slc in published else [] for slc in slc_ids}
+
+    monkeypatch.setattr(link_datasets, "get_rtc_docs_batch", get_rtc_docs_batch)
+    return lookups, published
+
+
+def scenes() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "Site": "Delta Junction",
+            "Orbit_Direction": "Descending",
+            "Orbital_Path": 160,
+            "CalVal_Module": "Coregistration",
+            "S1_Scene_IDs": SLCS,
+        }
+    )
+
+
+def test_update_rtc_table_reresolves_slcs_without_bursts(grq, tmp_path):
+    lookups, published = grq
+    published.update(SLCS[:2])
+    empty = pd.DataFrame(columns=["S1_Scene_IDs", *link_datasets.RTC_COLUMNS])
+    df_rtc = link_datasets.update_rtc_table(scenes(), empty, "1.0.1")
+    assert df_rtc.n_bursts.tolist() == [1, 1, 0]
+
+    # round trip through the CSV, as between two runs of link_datasets.py
+    df_rtc.to_csv(tmp_path / "opera_rtc_table.csv")
+    df_rtc = link_datasets.read_table(tmp_path / "opera_rtc_table.csv", [])
+
+    # the RTC of the last SLC is published after the first run
+    published.add(SLCS[2])
+    df_rtc = link_datasets.update_rtc_table(scenes(), df_rtc, "1.0.1")
+
+    assert lookups == [SLCS, SLCS[2:]]
+    assert df_rtc.n_bursts.tolist() == [1, 1, 1]
+    assert df_rtc.vv_url.str.endswith("_VV.tif").all()
+
+    # a new SAS version re-resolves every SLC
+    link_datasets.update_rtc_table(scenes(), df_rtc, "1.0.2")
+    assert lookups[-1] == SLCS
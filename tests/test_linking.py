@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import util.linking
+from util.linking import (
+    LinkingTables,
+    burst_table_from_csv,
+    get_linking_tables,
+    write_burst_table,
+)
+
+SLCS = [f"S1A_IW_SLC__1SDV_2023010{i}T000000_2023010{i}T000030_SLC" for i in range(1, 4)]
+BURSTS = ["T160-342211-IW1", "T160-342212-IW2"]
+STATIC_LAYERS = ["mask", "incidence_angle", "local_incidence_angle"]
+
+
+def rtc_row(site: str, orbital_path: int, module: str, slc: str, linked: bool = True):
+    opera_ids = [f"OPERA_L2_RTC-S1_{b}_{slc[17:32]}Z_S1A_30_v1.0" for b in BURSTS]
+
+    def urls(suffix):
+        if not linked:
+            return ""
+        return " ".join(f"https://example.com/{i}{suffix}" for i in opera_ids)
+
+    return {
+        "Site": site,
+        "Orbit_Direction": "Descending",
+        "Orbital_Path": orbital_path,
+        "CalVal_Module": module,
+        "S1_Scene_IDs": slc,
+        "opera_rtc_ids": " ".join(opera_ids) if linked else "",
+        "h5_url": urls(".h5"),
+        "browse_url": urls("_BROWSE.png"),
+        "vh_url": urls("_VH.tif"),
+        "vv_url": urls("_VV.tif"),
+        "mask_url": urls("_mask.tif"),
+        "n_bursts": len(BURSTS) if linked else 0,
+        "rtc_sas_version": "1.0.1",
+    }
+
+
+@pytest.fixture
+def csv_tables(tmp_path):
+    """
+    Linking table CSVs as link_datasets.py writes them, where the last SLC of the
+    Delta Junction coregistration stack has no RTC bursts yet (empty URL cells)
+    """
+    rows = [rtc_row("Delta Junction", 160, "Coregistration", slc) for slc in SLCS[:2]]
+    rows.append(rtc_row("Delta Junction", 160, "Coregistration", SLCS[2], linked=False))
+    rows.append(rtc_row("Delta Junction", 160, "Flattening", SLCS[0]))
+    rows.append(rtc_row("Vermont", 135, "Flattening", SLCS[1]))
+    rtc_table = tmp_path / "opera_rtc_table.csv"
+    pd.DataFrame(rows).to_csv(rtc_table)
+
+    static_table = tmp_path / "opera_rtc_static_table.csv"
+    pd.DataFrame(
+        [
+            {
+                "burst_id": burst,
+                "sas_version": "1.0",
+                "product_urls": " ".join(
+                    f"https://example.com/OPERA_L2_RTC-S1-STATIC_{burst}_v1.0_{layer}.tif"
+                    for layer in STATIC_LAYERS
+                ),
+            }
+            for burst in BURSTS
+        ]
+    ).to_csv(static_table)
+    return rtc_table, static_table
+
+
+def test_scenes_skip_unlinked_scenes(csv_tables):
+    tables = LinkingTables.from_csv(*csv_tables)
+
+    scenes = tables.scenes("Delta Junction", 160, "Coregistration")
+    assert [scene.scene_id for scene in scenes] == SLCS[:2]
+    assert all(len(scene.vv_urls) == len(scene.vh_urls) == 2 for scene in scenes)
+    scenes = tables.scenes(site="Delta Junction")
+    assert [scene.scene_id for scene in scenes] == [*SLCS[:2], SLCS[0]]
+
+    unlinked = tables.scenes("Delta Junction", 160, "Coregistration", require_urls=False)
+    assert [scene.scene_id for scene in unlinked] == SLCS
+    assert unlinked[2].vv_urls == unlinked[2].burst_ids == []
+
+
+def test_static_urls(csv_tables):
+    tables = LinkingTables.from_csv(*csv_tables)
+    scene = tables.scene(SLCS[0], "Coregistration")
+
+    assert scene.burst_ids == BURSTS
+    urls = tables.static_urls(scene)
+    assert list(urls) == STATIC_LAYERS
+    assert [url.split("/")[-1] for url in urls["incidence_angle"]] == [
+        f"OPERA_L2_RTC-S1-STATIC_{burst}_v1.0_incidence_angle.tif" for burst in BURSTS
+    ]
+
+
+def test_get_linking_tables_pushes_filters_to_parquet(csv_tables, tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    burst_table = write_burst_table(
+        burst_table_from_csv(*csv_tables), tmp_path / "opera_rtc_bursts.parquet"
+    )
+    read_filters = []
+    read_parquet = pd.read_parquet
+
+    def spy(*args, filters=None, **kwargs):
+        read_filters.append(filters)
+        return read_parquet(*args, filters=filters, **kwargs)
+
+    monkeypatch.setattr(util.linking.pd, "read_parquet", spy)
+    tables = get_linking_tables(
+        *csv_tables, burst_table, site="Delta Junction", orbital_path=160
+    )
+
+    assert read_filters == [[("site", "==", "Delta Junction"), ("orbital_path", "==", 160)]]
+    assert [(s.calval_module, s.scene_id) for s in tables.scenes()] == [
+        ("Coregistration", SLCS[0]),
+        ("Coregistration", SLCS[1]),
+        ("Flattening", SLCS[0]),
+    ]
+    scene = tables.scene(SLCS[1], "Coregistration")
+    assert [url.split("_")[-1] for url in scene.vv_urls] == ["VV.tif"] * 2
+    assert len(tables.static_urls(scene)["mask"]) == 2
+
+
+@pytest.mark.parametrize("missing", [None, np.nan])
+def test_from_parquet_reads_missing_static_versions_as_empty(
+    csv_tables, tmp_path, monkeypatch, missing
+):
+    pytest.importorskip("pyarrow")
+    rtc_table, static_table = csv_tables
+    # the static layers of the second burst have no recorded SAS version
+    df_static = pd.read_csv(static_table, index_col=0)
+    df_static.loc[1, "sas_version"] = None
+    df_static.to_csv(static_table)
+    burst_table = write_burst_table(
+        burst_table_from_csv(rtc_table, static_table), tmp_path / "opera_rtc_bursts.parquet"
+    )
+    read_parquet = pd.read_parquet
+
+    def read(*args, **kwargs):
+        # readers return None or NaN for missing strings
+        df = read_parquet(*args, **kwargs)
+        df["static_sas_version"] = df.static_sas_version.where(
+            df.static_sas_version.notna(), missing
+        )
+        return df
+
+    monkeypatch.setattr(util.linking.pd, "read_parquet", read)
+    tables = LinkingTables.from_parquet(burst_table)
+
+    assert tables.static(BURSTS[0]).sas_version == "1.0"
+    assert tables.static(BURSTS[1]).sas_version == ""
+    assert len(tables.static(BURSTS[1]).product_urls) == len(STATIC_LAYERS)
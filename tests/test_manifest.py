@@ -0,0 +1,59 @@
+import os
+
+from util.manifest import DOWNLOADED, MERGED, RunManifest, fingerprint
+
+
+def test_fingerprint_changes_with_inputs(tmp_path):
+    burst_dir = tmp_path / "vv_bursts"
+    burst_dir.mkdir()
+    burst = burst_dir / "burst_VV.tif"
+    burst.write_bytes(b"a" * 10)
+    fp = fingerprint([burst_dir], {"warp_mosaic": False})
+
+    assert fingerprint([burst_dir], {"warp_mosaic": False}) == fp
+    assert fingerprint([burst_dir], {"warp_mosaic": True}) != fp
+    # same size, newer mtime
+    burst.write_bytes(b"b" * 10)
+    os.utime(burst, ns=(burst.stat().st_atime_ns, burst.stat().st_mtime_ns + 10**9))
+    fp_rewritten = fingerprint([burst_dir], {"warp_mosaic": False})
+    assert fp_rewritten != fp
+    (burst_dir / "burst_2_VV.tif").write_bytes(b"c")
+    assert fingerprint([burst_dir], {"warp_mosaic": False}) != fp_rewritten
+    # a missing input differs from an existing one
+    assert fingerprint([tmp_path / "missing.tif"]) != fingerprint([burst])
+
+
+def test_is_done_requires_fingerprint_and_outputs(tmp_path):
+    manifest = RunManifest(tmp_path / "run_manifest.sqlite")
+    output = tmp_path / "mosaic.tif"
+    output.write_bytes(b"")
+
+    assert not manifest.is_done("scene", MERGED, "fp", outputs=[output])
+    manifest.mark("scene", MERGED, "fp")
+    assert manifest.is_done("scene", MERGED, "fp", outputs=[output])
+    assert not manifest.is_done("scene", MERGED, "other fp", outputs=[output])
+    output.unlink()
+    assert not manifest.is_done("scene", MERGED, "fp", outputs=[output])
+
+    manifest.mark("scene", DOWNLOADED, "fp", "failed", "HTTP 503")
+    assert not manifest.is_done("scene", DOWNLOADED, "fp")
+    # a new RunManifest reads what was recorded
+    record = RunManifest(manifest.manifest_path).status("scene")["scene"][DOWNLOADED]
+    assert (record["status"], record["detail"]) == ("failed", "HTTP 503")
+
+
+def test_reset(tmp_path):
+    manifest = RunManifest(tmp_path / "run_manifest.sqlite")
+    for scene in ["scene_1", "scene_2"]:
+        for stage in [DOWNLOADED, MERGED]:
+            manifest.mark(scene, stage)
+
+    manifest.reset("scene_1", MERGED)
+    assert {scene: set(stages) for scene, stages in manifest.status().items()} == {
+        "scene_1": {DOWNLOADED},
+        "scene_2": {DOWNLOADED, MERGED},
+    }
+    manifest.reset(stage=DOWNLOADED)
+    assert list(manifest.status()) == ["scene_2"]
+    manifest.reset()
+    assert manifest.status() == {}
@@ -0,0 +1,177 @@
+import threading
+from collections import namedtuple
+from functools import partial
+from http.server import SimpleHTTPRequestHandler
+
+import pytest
+import requests
+
+from util import pipeline
+from util.pipeline import download_files, http_download, run_scene_pipeline
+
+SCENES = [f"scene_{i}" for i in range(5)]
+
+
+@pytest.fixture
+def daac(tmp_path, serve):
+    """
+    Local stand-in for the DAAC, serving a 1 kB burst per scene and recording the
+    requests
+    """
+    root = tmp_path / "daac"
+    root.mkdir()
+    for i, scene in enumerate(SCENES):
+        (root / f"{scene}_VV.tif").write_bytes(bytes([i]) * 1000)
+    requested = []
+
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path.lstrip("/"))
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    return serve(partial(Handler, directory=str(root))), requested
+
+
+def fetch(url: str, scene: str, dest_dir):
+    """
+    The download stage of a scene with a single burst
+    """
+    url_dirs = [(f"{url}/{scene}_VV.tif", dest_dir)]
+    (pth,) = download_files(url_dirs, download=http_download)
+    return pth
+
+
+def run_in_thread(func, timeout: float = 20):
+    """
+    Runs func in a thread, failing the test if it does not return within timeout
+
+    Returns: the exception raised by func, if any
+    """
+    errors = []
+
+    def _run():
+        try:
+            func()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=_run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline stalled"
+    return errors[0] if errors else None
+
+
+def test_download_overlaps_processing_within_prefetch(tmp_path, daac):
+    url, _ = daac
+    downloaded = []
+    processed = []
+    ahead = threading.Condition()
+
+    def download(scene):
+        pth = fetch(url, scene, tmp_path)
+        with ahead:
+            downloaded.append(scene)
+            ahead.notify_all()
+        return pth
+
+    def process(scene, pth):
+        if scene == SCENES[0]:
+            # the next scene is queued and the one after it waits to be: no more
+            with ahead:
+                assert ahead.wait_for(lambda: len(downloaded) == 3, timeout=10)
+            threading.Event().wait(0.3)
+            assert downloaded == SCENES[:3]
+        assert pth.read_bytes() == bytes([SCENES.index(scene)]) * 1000
+        processed.append(scene)
+
+    assert run_in_thread(lambda: run_scene_pipeline(SCENES, download, process)) is None
+    assert processed == SCENES
+
+
+def test_existing_files_are_skipped(tmp_path, daac):
+    url, requested = daac
+    url_dirs = [(f"{url}/{scene}_VV.tif", tmp_path) for scene in SCENES[:2]]
+    (tmp_path / f"{SCENES[0]}_VV.tif").write_bytes(b"kept")
+
+    paths = download_files(url_dirs, download=http_download)
+
+    assert paths == [tmp_path / f"{scene}_VV.tif" for scene in SCENES[:2]]
+    assert requested == [f"{SCENES[1]}_VV.tif"]
+    assert paths[0].read_bytes() == b"kept"
+
+    requested.clear()
+    download_files(url_dirs, download=http_download, skip_existing=False)
+    assert sorted(requested) == [f"{scene}_VV.tif" for scene in SCENES[:2]]
+    assert paths[0].read_bytes() == bytes([0]) * 1000
+
+
+def test_failed_download_stops_the_pipeline(tmp_path, daac):
+    url, _ = daac
+    processed = []
+
+    def download(scene):
+        # the DAAC has no burst for the third scene
+        name = "missing.tif" if scene == SCENES[2] else f"{scene}_VV.tif"
+        return download_files([(f"{url}/{name}", tmp_path)], download=http_download)
+
+    error = run_in_thread(
+        lambda: run_scene_pipeline(
+            SCENES, download, lambda scene, _: processed.append(scene)
+        )
+    )
+
+    assert isinstance(error, requests.HTTPError)
+    assert processed == SCENES[:2]
+
+
+def test_failed_processing_stops_downloads(tmp_path, daac):
+    url, requested = daac
+
+    def download(scene):
+        return fetch(url, scene, tmp_path)
+
+    def process(scene, _):
+        raise ValueError(scene)
+
+    error = run_in_thread(lambda: run_scene_pipeline(SCENES, download, process))
+
+    assert isinstance(error, ValueError) and str(error) == SCENES[0]
+    # the producer was stopped rather than left blocked on the full queue
+    assert len(requested) <= 3
+
+
+def test_downloads_pause_while_disk_is_full(tmp_path, daac, monkeypatch):
+    url, _ = daac
+    monkeypatch.setattr(pipeline, "DISK_POLL_INTERVAL", 0.05)
+    usage = namedtuple("usage", ["total", "used", "free"])
+    monkeypatch.setattr(pipeline.shutil, "disk_usage", lambda pth: usage(0, 0, 0))
+    downloaded = []
+
+    def download(scene):
+        downloaded.append(scene)
+        return fetch(url, scene, tmp_path)
+
+    def process(scene, _):
+        if scene == SCENES[0]:
+            threading.Event().wait(0.3)
+            # the next download waits for this scene to be processed
+            assert downloaded == SCENES[:1]
+
+    assert (
+        run_in_thread(
+            lambda: run_scene_pipeline(
+                SCENES[:3],
+                download,
+                process,
+                prefetch=2,
+                disk_path=tmp_path,
+                min_free_gb=1,
+            )
+        )
+        is None
+    )
+    assert downloaded == SCENES[:3]
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("osgeo.gdal")
+from osgeo import osr  # noqa: E402
+
+from util import geo  # noqa: E402
+from util.raster_index import RasterIndex  # noqa: E402
+
+
+def write_tiff(pth, epsg: int):
+    f = gdal.GetDriverByName("GTiff").Create(str(pth), 10, 10, 1, gdal.GDT_Float32)
+    f.SetGeoTransform((399990.0, 30, 0, 3849990.0, 0, -30))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    f.SetProjection(srs.ExportToWkt())
+    f.GetRasterBand(1).WriteArray(np.zeros((10, 10), dtype=np.float32))
+    f = None
+    return pth
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = RasterIndex(tmp_path / "raster_metadata.sqlite")
+    monkeypatch.setattr(geo, "get_raster_index", lambda: index)
+    return index
+
+
+def test_dataset_strings_are_read_without_indexing(tmp_path, index):
+    tiff = write_tiff(tmp_path / "burst.tif", 32611)
+    # a subdataset string, as HDF5:"file.h5"://path or NETCDF:"file.nc":var
+    subdataset = f"GTIFF_DIR:1:{tiff}"
+
+    assert index.get(subdataset)["epsg"] == "32611"
+    assert geo.get_projection(subdataset) == "32611"
+    scanned = index.scan([tiff, subdataset])
+    assert list(scanned) == [str(tiff.resolve()), subdataset]
+    with index._connection() as con:
+        paths = [row[0] for row in con.execute("SELECT path FROM raster_metadata")]
+    assert paths == [str(tiff.resolve())]
+
+
+def test_repeated_paths_are_counted(tmp_path, index):
+    utm_11 = write_tiff(tmp_path / "utm_11.tif", 32611)
+    utm_12 = write_tiff(tmp_path / "utm_12.tif", 32612)
+
+    assert geo.get_projection_counts([utm_11, utm_11, utm_12]) == {"32611": 2, "32612": 1}
+    assert len(index.records([utm_11, utm_11, utm_12])) == 3
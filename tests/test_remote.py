@@ -0,0 +1,153 @@
+import re
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("osgeo.gdal")
+from osgeo import osr  # noqa: E402
+
+from util.remote import (  # noqa: E402
+    configure_remote_reads,
+    vsicurl_options,
+    write_point_windows,
+)
+
+EPSG = 32611
+RES = 30
+WIDTH, HEIGHT = 2000, 1000
+# two adjacent bursts near Rosamond, California, on the 30 m grid
+ORIGINS = [(399990.0, 3849990.0), (399990.0 + WIDTH * RES, 3849990.0)]
+HALF_SIZE = 40
+
+
+def range_handler(root: Path, served: dict):
+    """
+    Request handler serving the files in `root` with single-range GET requests, like
+    the DAAC, and counting the bytes served for each file
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def _file(self) -> Path:
+            pth = root / self.path.lstrip("/")
+            if not pth.is_file():
+                self.send_error(404)
+                return None
+            return pth
+
+        def do_HEAD(self):
+            pth = self._file()
+            if pth:
+                self.send_response(200)
+                self.send_header("Content-Length", str(pth.stat().st_size))
+                self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+
+        def do_GET(self):
+            pth = self._file()
+            if not pth:
+                return
+            size = pth.stat().st_size
+            match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+            start, end = 0, size - 1
+            if match:
+                start = int(match[1])
+                end = min(int(match[2]) if match[2] else size - 1, size - 1)
+            with open(pth, "rb") as f:
+                f.seek(start)
+                data = f.read(end - start + 1)
+            self.send_response(206 if match else 200)
+            if match:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            self.wfile.write(data)
+            served[pth.name] = served.get(pth.name, 0) + len(data)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def write_burst(pth: Path, origin, offset: float):
+    """
+    Writes a stand-in OPERA RTC burst whose pixel values encode their position
+    """
+    data = (np.arange(WIDTH * HEIGHT, dtype=np.float32) + offset).reshape(HEIGHT, WIDTH)
+    f = gdal.GetDriverByName("GTiff").Create(
+        str(pth),
+        WIDTH,
+        HEIGHT,
+        1,
+        gdal.GDT_Float32,
+        options=["TILED=YES", "BLOCKXSIZE=64", "BLOCKYSIZE=64"],
+    )
+    f.SetGeoTransform((origin[0], RES, 0, origin[1], 0, -RES))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+    f.SetProjection(srs.ExportToWkt())
+    f.GetRasterBand(1).SetNoDataValue(np.nan)
+    f.GetRasterBand(1).WriteArray(data)
+    f = None
+    return data
+
+
+def pixel_lon_lat(origin, row: int, col: int):
+    src = osr.SpatialReference()
+    src.ImportFromEPSG(EPSG)
+    dst = osr.SpatialReference()
+    dst.ImportFromEPSG(4326)
+    for srs in [src, dst]:
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    x = origin[0] + (col + 0.5) * RES
+    y = origin[1] - (row + 0.5) * RES
+    return osr.CoordinateTransformation(src, dst).TransformPoint(x, y)[:2]
+
+
+@pytest.fixture
+def remote_reads(tmp_path):
+    configure_remote_reads(cookie_file=str(tmp_path / "cookies.txt"))
+    gdal.VSICurlClearCache()
+    yield
+    for key in vsicurl_options():
+        gdal.SetConfigOption(key, None)
+    gdal.VSICurlClearCache()
+
+
+def test_write_point_windows_reads_only_windows(tmp_path, serve, remote_reads):
+    root = tmp_path / "daac"
+    root.mkdir()
+    names = [f"OPERA_L2_RTC-S1_T064-13534{i}-IW1_VV.tif" for i in range(2)]
+    bursts = [
+        write_burst(root / name, origin, offset=i * WIDTH * HEIGHT)
+        for i, (name, origin) in enumerate(zip(names, ORIGINS))
+    ]
+    served = {}
+    url = serve(range_handler(root, served))
+    # two corner reflectors in the first burst
+    pixels = [(300, 500), (700, 1200)]
+    points = [pixel_lon_lat(ORIGINS[0], row, col) for row, col in pixels]
+
+    covering = write_point_windows(
+        [f"{url}/{name}" for name in names], points, tmp_path / "windows.tif", HALF_SIZE
+    )
+
+    assert covering == {f"{url}/{names[0]}": [0, 1]}
+    f = gdal.Open(str(tmp_path / "windows.tif"))
+    assert (f.RasterXSize, f.RasterYSize) == (2 * WIDTH, HEIGHT)
+    mosaic = f.GetRasterBand(1).ReadAsArray()
+    f = None
+    in_windows = np.zeros(mosaic.shape, dtype=bool)
+    for row, col in pixels:
+        window = np.s_[row - HALF_SIZE : row + HALF_SIZE + 1, col - HALF_SIZE : col + HALF_SIZE + 1]
+        assert (mosaic[window] == bursts[0][window]).all()
+        in_windows[window] = True
+    assert np.isnan(mosaic[~in_windows]).all()
+
+    # the windows' blocks and the headers, not the 8 MB bursts
+    size = (root / names[0]).stat().st_size
+    assert served[names[0]] < size * 0.05
+    assert served[names[1]] < 64 * 1024
@@ -0,0 +1,118 @@
+import pytest
+
+moto = pytest.importorskip("moto")
+
+from util.sample_bursts import fetch_scene_bursts, get_s3_client  # noqa: E402
+
+BUCKET = "sample-bursts"
+PREFIX = "products/RTC_S1/"
+BURSTS = ["T064-135524-IW1", "T064-135525-IW1"]
+RUNS = ["20230801T000000Z", "20230901T000000Z"]
+STATIC_LAYERS = {
+    "inc_angle": "static_incidence_angle",
+    "local_inc_angle": "static_local_incidence_angle",
+    "ls_mask": "static_layover_shadow_mask",
+}
+
+
+def product(burst: str, acquisition: str, run: str) -> str:
+    return f"{PREFIX}OPERA_L2_RTC-S1_{burst}_{acquisition}T000000Z_{run}_S1A_30_v1.0"
+
+
+def backscatter_key(burst: str, acquisition: str, run: str, polarization: str) -> str:
+    name = product(burst, acquisition, run).split("/")[-1]
+    return f"{product(burst, acquisition, run)}/{name}_{polarization}.tif"
+
+
+def static_key(burst: str, run: str, layer: str) -> str:
+    name = product(burst, "20140403", run).split("/")[-1]
+    return f"{product(burst, '20140403', run)}_static_layers/{name}_{layer}.tif"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """
+    Local stand-in for the sample bucket, holding two processing runs of two bursts,
+    acquired on two dates, and a burst of another scene
+    """
+    for key in ["AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"]:
+        monkeypatch.setenv(key, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-west-2")
+    with moto.mock_aws():
+        client = get_s3_client(max_workers=4)
+        client.create_bucket(
+            Bucket=BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": "us-west-2"},
+        )
+        for burst in [*BURSTS, "T064-135526-IW1"]:
+            for run in RUNS:
+                keys = [
+                    backscatter_key(burst, acquisition, run, polarization)
+                    for acquisition in ["20230611", "20230623"]
+                    for polarization in ["VV", "VH"]
+                ]
+                keys += [static_key(burst, run, layer) for layer in STATIC_LAYERS.values()]
+                # a browse image, matching no layer
+                keys.append(f"{product(burst, '20230611', run)}/{burst}_BROWSE.png")
+                for key in keys:
+                    client.put_object(Bucket=BUCKET, Key=key, Body=key.encode())
+        yield client
+
+
+def test_fetch_scene_bursts_selects_latest_run_of_scene(tmp_path, s3):
+    layer_dirs = {layer: tmp_path / layer for layer in ["vv", "vh", *STATIC_LAYERS]}
+    for pth in layer_dirs.values():
+        pth.mkdir()
+
+    paths = fetch_scene_bursts(
+        [f"OPERA_L2_RTC-S1_{burst}" for burst in BURSTS],
+        "20230611",
+        layer_dirs,
+        bucket=BUCKET,
+        client=s3,
+        max_workers=4,
+    )
+
+    expected = {
+        "vv": [backscatter_key(burst, "20230611", RUNS[-1], "VV") for burst in BURSTS],
+        "vh": [backscatter_key(burst, "20230611", RUNS[-1], "VH") for burst in BURSTS],
+        **{
+            layer: [static_key(burst, RUNS[-1], suffix) for burst in BURSTS]
+            for layer, suffix in STATIC_LAYERS.items()
+        },
+    }
+    assert paths == {
+        layer: [layer_dirs[layer] / key.split("/")[-1] for key in keys]
+        for layer, keys in expected.items()
+    }
+    for layer, keys in expected.items():
+        for key, pth in zip(keys, paths[layer]):
+            assert pth.read_bytes() == key.encode()
+    # nothing else was downloaded
+    assert sorted(p for d in layer_dirs.values() for p in d.iterdir()) == sorted(
+        p for pths in paths.values() for p in pths
+    )
+
+
+def test_earlier_run_and_existing_files(tmp_path, s3):
+    layer_dirs = {layer: tmp_path for layer in ["vv", "vh", *STATIC_LAYERS]}
+    names = {
+        polarization: backscatter_key(BURSTS[0], "20230611", RUNS[0], polarization)
+        for polarization in ["VV", "VH"]
+    }
+    existing = tmp_path / names["VV"].split("/")[-1]
+    existing.write_bytes(b"kept")
+
+    paths = fetch_scene_bursts(
+        [f"OPERA_L2_RTC-S1_{BURSTS[0]}"],
+        "20230611",
+        layer_dirs,
+        keep_date_index=0,
+        bucket=BUCKET,
+        client=s3,
+    )
+
+    assert paths["vv"] == [existing]
+    assert existing.read_bytes() == b"kept"
+    assert paths["vh"] == [tmp_path / names["VH"].split("/")[-1]]
+    assert paths["vh"][0].read_bytes() == names["VH"].encode()
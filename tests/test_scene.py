@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+gdal = pytest.importorskip("osgeo.gdal")
+pytest.importorskip("rioxarray")
+pytest.importorskip("dask")
+from osgeo import osr  # noqa: E402
+
+from util import geo  # noqa: E402
+from util.raster_index import RasterIndex  # noqa: E402
+from util.scene import LAYERS, OperaScene  # noqa: E402
+
+SCENE_ID = "S1A_IW_SLC__1SDV_20230101T000000_20230101T000027_046568_059497_ABCD"
+EPSG = 32611
+RES = 30
+WIDTH, HEIGHT = 300, 200
+# two side-by-side bursts
+ORIGINS = [(399990.0, 3849990.0), (399990.0 + WIDTH * RES, 3849990.0)]
+# burst file suffix and data type of each layer
+SUFFIXES = {
+    "VV": ("VV", "Float32"),
+    "VH": ("VH", "Float32"),
+    "mask": ("mask", "Byte"),
+    "local_incidence_angle": ("local_incidence_angle", "Float32"),
+}
+
+
+def burst_data(layer: str, i: int) -> np.ndarray:
+    # values encoding the layer, burst, and pixel position
+    if layer == "mask":
+        data = np.full((HEIGHT, WIDTH), i + 1, dtype=np.uint8)
+        data[:10] = 255
+        return data
+    offset = list(SUFFIXES).index(layer) * 1e6 + i * WIDTH * HEIGHT
+    return (np.arange(WIDTH * HEIGHT, dtype=np.float32) + offset).reshape(HEIGHT, WIDTH)
+
+
+def write_burst(pth, data: np.ndarray, dtype: str, origin):
+    f = gdal.GetDriverByName("GTiff").Create(
+        str(pth), WIDTH, HEIGHT, 1, gdal.GetDataTypeByName(dtype), options=["TILED=YES"]
+    )
+    f.SetGeoTransform((origin[0], RES, 0, origin[1], 0, -RES))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+    f.SetProjection(srs.ExportToWkt())
+    f.GetRasterBand(1).SetNoDataValue(255 if dtype == "Byte" else np.nan)
+    f.GetRasterBand(1).WriteArray(data)
+    f = None
+
+
+@pytest.fixture
+def rtc_dir(tmp_path, monkeypatch):
+    """
+    A scene directory of the bulk validation scripts holding two bursts of the VV, VH,
+    layover/shadow mask, and local incidence angle layers
+    """
+    index = RasterIndex(tmp_path / "raster_metadata.sqlite")
+    monkeypatch.setattr(geo, "get_raster_index", lambda: index)
+    rtc_dir = tmp_path / f"OPERA_L2-RTC_{SCENE_ID}_30_v1.0"
+    for layer, (suffix, dtype) in SUFFIXES.items():
+        burst_dir = rtc_dir / LAYERS[layer][0]
+        burst_dir.mkdir(parents=True)
+        for i, origin in enumerate(ORIGINS):
+            name = f"OPERA_L2_RTC-S1_T064-13552{i}-IW1_20230101T000000Z_{suffix}.tif"
+            write_burst(burst_dir / name, burst_data(layer, i), dtype, origin)
+    return rtc_dir
+
+
+def mosaic(layer: str) -> np.ndarray:
+    data = np.hstack([burst_data(layer, i) for i in range(len(ORIGINS))])
+    return np.where(data == 255, np.nan, data) if layer == "mask" else data
+
+
+def test_pixels_are_read_only_when_computed(rtc_dir):
+    scene = OperaScene(rtc_dir, chunks=64)
+    vv = scene["VV"]
+    assert scene.layers == list(SUFFIXES)
+    assert vv.shape == (HEIGHT, 2 * WIDTH)
+
+    # rewrite the pixels of the bursts: the values computed are the new ones
+    for i, pth in enumerate(scene.burst_paths("VV")):
+        f = gdal.Open(str(pth), gdal.GA_Update)
+        f.GetRasterBand(1).WriteArray(-burst_data("VV", i))
+        f = None
+    np.testing.assert_array_equal(vv[:5, :5].values, -mosaic("VV")[:5, :5])
+
+
+def test_windows_match_the_bursts(rtc_dir):
+    scene = OperaScene(rtc_dir, chunks=64)
+    ulx, uly = ORIGINS[0]
+    # a window across both bursts
+    bounds = (ulx + 250 * RES, uly - 150 * RES, ulx + 350 * RES, uly - 50 * RES)
+
+    for layer in SUFFIXES:
+        window = scene[layer].rio.clip_box(*bounds)
+        cols = np.round((window.x.values - ulx) / RES - 0.5).astype(int)
+        rows = np.round((uly - window.y.values) / RES - 0.5).astype(int)
+        assert cols.min() < WIDTH <= cols.max()
+        np.testing.assert_array_equal(
+            scene.read_window(layer, bounds), mosaic(layer)[np.ix_(rows, cols)]
+        )
+
+
+def test_layers_share_the_grid(rtc_dir):
+    scene = OperaScene(rtc_dir, chunks=64)
+
+    ds = scene.to_dataset()
+
+    assert list(ds.data_vars) == list(SUFFIXES)
+    assert dict(ds.sizes) == {"y": HEIGHT, "x": 2 * WIDTH}
+    for layer in SUFFIXES:
+        np.testing.assert_array_equal(scene[layer].x, ds.x)
+        np.testing.assert_array_equal(scene[layer].y, ds.y)
+        assert scene[layer].rio.crs.to_epsg() == EPSG
+    # no-data of the mask is NaN, on the same pixels of every burst
+    assert np.isnan(ds["mask"][:10].values).all()
+    assert not np.isnan(ds["VV"][:10].values).any()
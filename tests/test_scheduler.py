@@ -0,0 +1,163 @@
+import sys
+import threading
+import time
+from functools import partial
+
+import pytest
+
+from util.scheduler import DONE, FAILED, SKIPPED, StageScheduler
+
+
+# the SystemExit still ends the stage's thread
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_stage_exiting_fails_and_releases_its_resources():
+    scheduler = StageScheduler({"cpu": 1})
+    scheduler.add("exit", lambda: sys.exit(1), resources={"cpu": 1})
+    scheduler.add("after_exit", lambda: None, deps=["exit"])
+    scheduler.add("error", lambda: 1 / 0, resources={"cpu": 1})
+    # waits for the cpu held by "exit" and "error"
+    scheduler.add("other", lambda: None, resources={"cpu": 1})
+
+    status = scheduler.run()
+
+    assert status == {
+        "exit": FAILED,
+        "after_exit": SKIPPED,
+        "error": FAILED,
+        "other": DONE,
+    }
+    assert scheduler.errors["exit"] == "SystemExit: 1"
+    assert scheduler.errors["error"].startswith("ZeroDivisionError")
+    # the thread may still be raising, within this test
+    for thread in threading.enumerate():
+        if thread.name == "exit":
+            thread.join()
+
+
+class Tracker:
+    """
+    Records the stages running as each stage starts
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = set()
+        self.started = []
+        # the stages running at once peak as a stage starts
+        self.snapshots = []
+
+    def stage(self, key: str, seconds: float = 0.05):
+        def func():
+            with self.lock:
+                self.running.add(key)
+                self.started.append(key)
+                self.snapshots.append(set(self.running))
+            time.sleep(seconds)
+            with self.lock:
+                self.running.discard(key)
+
+        return func
+
+    def max_running(self, prefix: str = "") -> int:
+        return max(
+            len([k for k in snapshot if k.startswith(prefix)])
+            for snapshot in self.snapshots
+        )
+
+
+def test_limits_bound_the_running_stages():
+    tracker = Tracker()
+    scheduler = StageScheduler({"cpu": 2, "memory_gb": 10})
+    for i in range(6):
+        scheduler.add(f"cpu_{i}", tracker.stage(f"cpu_{i}"), resources={"cpu": 1})
+    for i in range(3):
+        scheduler.add(
+            f"memory_{i}", tracker.stage(f"memory_{i}"), resources={"memory_gb": 8}
+        )
+    # not limited
+    scheduler.add("network", tracker.stage("network"), resources={"network": 1})
+
+    status = scheduler.run()
+
+    assert set(status.values()) == {DONE}
+    assert tracker.max_running("cpu") == 2
+    assert tracker.max_running("memory") == 1
+    assert tracker.max_running() == 4
+    # the first added start first
+    assert [k for k in tracker.started if k.startswith("cpu")] == [
+        f"cpu_{i}" for i in range(6)
+    ]
+
+
+def test_oversized_stage_runs_alone():
+    tracker = Tracker()
+    scheduler = StageScheduler({"memory_gb": 16})
+    scheduler.add("small_0", tracker.stage("small_0"), resources={"memory_gb": 8})
+    scheduler.add("large", tracker.stage("large"), resources={"memory_gb": 32})
+    scheduler.add("small_1", tracker.stage("small_1"), resources={"memory_gb": 8})
+    # holds none of the resource
+    scheduler.add("other", tracker.stage("other", 0.2))
+
+    status = scheduler.run()
+
+    assert status == {"small_0": DONE, "large": DONE, "small_1": DONE, "other": DONE}
+    for snapshot in tracker.snapshots:
+        if "large" in snapshot:
+            assert snapshot <= {"large", "other"}
+
+
+def test_running_stages_add_stages():
+    scheduler = StageScheduler({"cpu": 2})
+    done = []
+
+    def process(i: int):
+        done.append(f"process_{i}")
+        if i == 0:
+            # stages added by stages added by a stage
+            scheduler.add("report", lambda: done.append("report"), ["process_0"])
+
+    def list_inputs():
+        for i in range(3):
+            scheduler.add(
+                f"process_{i}", partial(process, i), ["list"], resources={"cpu": 1}
+            )
+
+    scheduler.add("list", list_inputs)
+
+    status = scheduler.run()
+
+    assert status == {
+        "list": DONE,
+        "process_0": DONE,
+        "process_1": DONE,
+        "process_2": DONE,
+        "report": DONE,
+    }
+    assert done.index("report") > done.index("process_0")
+    assert "process_0" in scheduler
+
+
+def test_skips_propagate_down_the_dag():
+    scheduler = StageScheduler()
+    scheduler.add("download", lambda: 1 / 0)
+    scheduler.add("other_download", lambda: None)
+    scheduler.add("mosaic", lambda: None, ["download"])
+    scheduler.add("notebook", lambda: None, ["mosaic"])
+    scheduler.add("report", lambda: None, ["notebook", "other_download"])
+    scheduler.add("other_mosaic", lambda: None, ["other_download"])
+
+    status = scheduler.run()
+
+    assert status == {
+        "download": FAILED,
+        "other_download": DONE,
+        "mosaic": SKIPPED,
+        "notebook": SKIPPED,
+        "report": SKIPPED,
+        "other_mosaic": DONE,
+    }
+    assert list(scheduler.errors) == ["download"]
+    with pytest.raises(ValueError, match="already added"):
+        scheduler.add("download", lambda: None)
+    with pytest.raises(ValueError, match="not added yet"):
+        scheduler.add("late", lambda: None, ["missing"])
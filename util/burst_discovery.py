@@ -0,0 +1,139 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from typing import List, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BURST_EXTRACTOR_URL = "https://sentinel1-burst.asf.alaska.edu"
+BEAM_MODES = ["IW1", "IW2", "IW3"]
+POLARIZATIONS = ["VV", "VH"]
+# the most bursts per swath in an IW SLC
+MAX_BURSTS = 15
+# statuses of requests worth repeating: 202 while the extractor prepares a burst
+RETRY_STATUSES = {202, 429, 500, 502, 503, 504}
+
+
+def get_burst_session(pool_size: int = 90) -> requests.Session:
+    """
+    Takes: number of connections to keep open to the burst extractor
+
+    Returns: a requests Session able to send pool_size requests concurrently
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def burst_urls(
+    scene: str,
+    base_url: str = BURST_EXTRACTOR_URL,
+    beam_modes: List[str] = BEAM_MODES,
+    polarizations: List[str] = POLARIZATIONS,
+    n_bursts: int = MAX_BURSTS,
+) -> List[str]:
+    """
+    Takes:
+        scene: Sentinel-1 IW SLC scene ID
+        base_url: URL of the ASF burst extractor (or of a stand-in)
+        beam_modes: swaths to probe
+        polarizations: polarizations to probe
+        n_bursts: number of bursts to probe per swath and polarization
+
+    Returns: burst extractor metadata URLs of every possible burst of the scene
+    """
+    return [
+        f"{base_url}/{scene}/{beam_mode}/{polarization}/{burst}.xml"
+        for beam_mode, polarization, burst in product(
+            beam_modes, polarizations, range(n_bursts)
+        )
+    ]
+
+
+def probe_burst(
+    url: str,
+    session: requests.Session,
+    max_retries: int = 8,
+    backoff: float = 1.0,
+    max_backoff: float = 30.0,
+) -> Union[str, None]:
+    """
+    Takes:
+        url: burst extractor metadata URL (see burst_urls)
+        session: requests Session (see get_burst_session)
+        max_retries: number of times to repeat the request while the extractor
+                     answers 202 (burst being prepared) or a transient error
+        backoff: delay before the first retry, in seconds, doubled for each retry
+        max_backoff: longest delay between retries, in seconds
+
+    Returns: burst file name from the Content-Disposition header, or None if the
+             burst does not exist (404)
+    """
+    for attempt in range(max_retries + 1):
+        response = session.get(url)
+        if response.status_code == 404:
+            return None
+        if response.status_code == 200:
+            return response.headers["content-disposition"].split("filename=")[-1]
+        if response.status_code not in RETRY_STATUSES:
+            response.raise_for_status()
+            raise RuntimeError(f"Unexpected status {response.status_code}: {url}")
+        if attempt < max_retries:
+            delay = response.headers.get("Retry-After")
+            if delay is None or not delay.isdigit():
+                delay = min(backoff * 2**attempt, max_backoff) * random.uniform(0.5, 1)
+            time.sleep(float(delay))
+    raise RuntimeError(
+        f"Burst not ready after {max_retries} retries (status {response.status_code}): {url}"
+    )
+
+
+def discover_bursts(
+    scene: str,
+    orbital_path: str,
+    session: Union[requests.Session, None] = None,
+    base_url: str = BURST_EXTRACTOR_URL,
+    max_workers: Union[int, None] = None,
+    **probe_kwargs,
+) -> List[str]:
+    """
+    Takes:
+        scene: Sentinel-1 IW SLC scene ID
+        orbital_path: OPERA track of the scene, e.g. "T064"
+        session: requests Session (default: get_burst_session())
+        base_url: URL of the ASF burst extractor (or of a stand-in)
+        max_workers: number of concurrent requests (default: one per possible burst)
+        probe_kwargs: retry options passed to probe_burst
+
+    Probes every possible burst of the scene concurrently. Each request that
+    answers 202 is retried on its own with exponential backoff, so resolved bursts
+    are never requested again.
+
+    Returns: OPERA burst IDs of the scene, e.g. "OPERA_L2_RTC-S1_T064-135524-IW1",
+             in swath and burst order, without duplicates across polarizations
+    """
+    urls = burst_urls(scene, base_url)
+    if session is None:
+        session = get_burst_session(len(urls))
+
+    def _probe(url):
+        return probe_burst(url, session, **probe_kwargs)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers or len(urls)) as executor:
+        filenames = list(executor.map(_probe, urls))
+
+    opera_bursts = []
+    for filename in filenames:
+        if filename is None:
+            continue
+        burst_swath = "-".join(filename.split("_")[1:3])
+        opera_burst = f"OPERA_L2_RTC-S1_{orbital_path}-{burst_swath}"
+        if opera_burst not in opera_bursts:
+            opera_bursts.append(opera_burst)
+    print(f"Found {len(opera_bursts)} bursts of {scene} in {time.time() - start:.1f}s")
+    return opera_bursts
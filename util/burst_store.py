@@ -0,0 +1,203 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, List, Union
+
+from util.pipeline import earthaccess_download
+
+DEFAULT_STORE_DIR = Path(
+    os.environ.get("CALVAL_RTC_BURST_STORE", Path.home() / ".cache/calval-RTC/bursts")
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    started REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    name TEXT NOT NULL,
+    run TEXT NOT NULL,
+    PRIMARY KEY (name, run)
+);
+"""
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class BurstStore:
+    """
+    Local store of OPERA products shared by every CalVal module and site/orbit run.
+
+    Each product is downloaded once into `store_dir/files`, keyed by its file name
+    (OPERA product file names are unique), and linked into each run's burst
+    directories: as a hardlink when possible, as a symlink across file systems. When
+    the store exceeds its quota, the least recently used products not referenced by
+    an active run are evicted. Disk space of an evicted product is reclaimed once
+    the run directories holding hardlinks to it are deleted as well.
+    """
+
+    def __init__(
+        self,
+        store_dir: Union[str, os.PathLike] = DEFAULT_STORE_DIR,
+        quota_gb: Union[float, None] = None,
+        download: Callable[[str, Union[str, os.PathLike]], Path] = earthaccess_download,
+    ):
+        """
+        store_dir: directory holding the products and the store index
+        quota_gb: maximum size of the store in GB, None for no limit
+                  (defaults to the CALVAL_RTC_BURST_STORE_QUOTA_GB environment variable)
+        download: function downloading a URL into a directory and returning the path
+                  (see util.pipeline)
+        """
+        self.store_dir = Path(store_dir)
+        self.file_dir = self.store_dir / "files"
+        self.incoming_dir = self.store_dir / "incoming"
+        for d in [self.file_dir, self.incoming_dir]:
+            d.mkdir(parents=True, exist_ok=True)
+        if quota_gb is None and os.environ.get("CALVAL_RTC_BURST_STORE_QUOTA_GB"):
+            quota_gb = float(os.environ["CALVAL_RTC_BURST_STORE_QUOTA_GB"])
+        self.quota_bytes = None if quota_gb is None else int(quota_gb * 1024**3)
+        self._download = download
+        self._run = None
+        self._evict_lock = threading.Lock()
+        self.index_path = self.store_dir / "burst_store.sqlite"
+        with self._connection() as con:
+            con.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.index_path, timeout=60)
+
+    def path(self, name: str) -> Path:
+        """
+        name: product file name
+
+        return: path of the product in the store
+        """
+        return self.file_dir / name
+
+    @contextmanager
+    def active_run(self, run: str) -> Iterator["BurstStore"]:
+        """
+        run: name of the run, e.g. its data directory
+
+        Registers the run for the duration of the context. Products linked into the
+        run while it is active are not evicted until it ends (or its process dies).
+        """
+        with self._connection() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?)", (run, os.getpid(), time.time())
+            )
+        self._run = run
+        try:
+            yield self
+        finally:
+            self._run = None
+            with self._connection() as con:
+                con.execute("DELETE FROM runs WHERE run = ?", (run,))
+                con.execute("DELETE FROM refs WHERE run = ?", (run,))
+
+    def _fetch(self, url: str) -> Path:
+        name = url.split("/")[-1]
+        pth = self.path(name)
+        if not pth.exists():
+            # download into a private directory so concurrent fetches never see partial files
+            incoming = self.incoming_dir / f"{os.getpid()}_{threading.get_ident()}"
+            incoming.mkdir(exist_ok=True)
+            print(f"Downloading {name} to the burst store")
+            downloaded = Path(self._download(url, incoming))
+            os.replace(downloaded, pth)
+        with self._connection() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                (name, pth.stat().st_size, time.time()),
+            )
+            if self._run:
+                con.execute("INSERT OR IGNORE INTO refs VALUES (?, ?)", (name, self._run))
+        return pth
+
+    def download(self, url: str, dest_dir: Union[str, os.PathLike]) -> Path:
+        """
+        url: URL of an OPERA product
+        dest_dir: directory in which to place the product
+
+        Fetches the product into the store unless it is already there, then links it
+        into dest_dir. Has the signature of the download functions in util.pipeline.
+
+        return: path to the product in dest_dir
+        """
+        src = self._fetch(url)
+        dst = Path(dest_dir) / src.name
+        if dst.exists() or dst.is_symlink():
+            dst.unlink()
+        try:
+            os.link(src, dst)
+        except OSError:
+            os.symlink(src, dst)
+        if self.quota_bytes is not None:
+            self.evict(self.quota_bytes)
+        return dst
+
+    def size(self) -> int:
+        """
+        return: total size of the products in the store, in bytes
+        """
+        with self._connection() as con:
+            return con.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+
+    def _active_runs(self, con: sqlite3.Connection) -> List[str]:
+        active = []
+        for run, pid in con.execute("SELECT run, pid FROM runs").fetchall():
+            if _pid_alive(pid):
+                active.append(run)
+            else:
+                # the run crashed without releasing its products
+                con.execute("DELETE FROM runs WHERE run = ?", (run,))
+                con.execute("DELETE FROM refs WHERE run = ?", (run,))
+        return active
+
+    def evict(self, quota_bytes: int) -> List[str]:
+        """
+        quota_bytes: size in bytes to shrink the store to
+
+        Deletes the least recently used products that no active run references until
+        the store fits in quota_bytes (or only referenced products remain)
+
+        return: names of the evicted products
+        """
+        evicted = []
+        with self._evict_lock, self._connection() as con:
+            self._active_runs(con)
+            total = con.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+            if total <= quota_bytes:
+                return evicted
+            candidates = con.execute(
+                "SELECT name, size FROM files "
+                "WHERE name NOT IN (SELECT name FROM refs) ORDER BY last_used"
+            ).fetchall()
+            for name, size in candidates:
+                if total <= quota_bytes:
+                    break
+                self.path(name).unlink(missing_ok=True)
+                con.execute("DELETE FROM files WHERE name = ?", (name,))
+                total -= size
+                evicted.append(name)
+        if evicted:
+            print(f"Evicted {len(evicted)} products from the burst store")
+        return evicted
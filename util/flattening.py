@@ -0,0 +1,437 @@
+import csv
+import os
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+from osgeo import gdal
+from scipy import stats
+
+import util.geo as util
+from util.instrument import traced
+from util.landcover import LandcoverStore
+
+gdal.UseExceptions()
+
+GROUND_COVER = "Tree_Cover"
+# PROBA-V LC100 classes counted as tree cover (closed forest, except unknown type)
+VALID_COVERS = [111, 112, 114, 115, 116]
+# |local - ellipsoidal incidence angle| up to which a pixel is flat, in degrees
+FLAT_THRESHOLD = 2
+POLARIZATIONS = ["VH", "VV"]
+SLOPES = ["foreslope", "backslope", "flat"]
+
+# globs of the layers of a mosaicked scene, and of its clips (see clip_scene)
+SCENE_LAYERS = {
+    "local_inc_angle": "OPERA_L2_RTC-S1_local_incidence_angle_S1*.tif",
+    "inc_angle": "OPERA_L2_RTC-S1_incidence_angle_S1*.tif",
+    "ls_mask": "OPERA_L2_RTC-S1_mask_S1*.tif",
+    "vh": "OPERA_L2_RTC-S1_VH_S1*.tif",
+    "vv": "OPERA_L2_RTC-S1_VV_S1*.tif",
+}
+LANDCOVER_GLOB = "*LC100_global*.tif"
+
+RESULTS_FIELDS = [
+    "Granule", "Polarization",
+    "Foreslope Mean", "Backslope Mean",
+    "Foreslope Median", "Backslope Median",
+    "Foreslope Mode", "Backslope Mode",
+    "Foreslope STD", "Backslope STD",
+    "Foreslope Median - Backslope Median",
+    "Pass/Fail",
+]
+
+
+def find_scene_layers(data_dir: Union[str, os.PathLike]) -> Dict[str, Path]:
+    """
+    Takes: directory holding a mosaicked OPERA RTC scene, or its clips
+
+    Returns: Dictionary of the paths to the "local_inc_angle", "inc_angle", "ls_mask",
+             "vh", and "vv" layers, and to the "land_cover" clip when present
+    """
+    data_dir = Path(data_dir)
+    layers = {}
+    for layer, pattern in SCENE_LAYERS.items():
+        matches = sorted(data_dir.glob(pattern))
+        if not matches:
+            raise Exception(f"No {layer} layer found in {data_dir}")
+        layers[layer] = matches[0]
+    land_cover = sorted(data_dir.glob(LANDCOVER_GLOB))
+    if land_cover:
+        layers["land_cover"] = land_cover[0]
+    return layers
+
+
+def get_bounds(img_path: Union[str, os.PathLike]) -> Tuple[float, float, float, float]:
+    """
+    Takes: a string or posix path to geographic dataset
+
+    Returns: Tuple of the dataset's bounds in its projection (minx, miny, maxx, maxy)
+    """
+    upper_left, lower_right = util.get_corner_coords(img_path)
+    return upper_left[0], lower_right[1], lower_right[0], upper_left[1]
+
+
+@traced("clip")
+def clip_layers(
+    layers: Dict[str, Union[str, os.PathLike]],
+    bounds: Tuple[float, float, float, float],
+    output_dir: Union[str, os.PathLike],
+    resolution: float = 30,
+) -> Dict[str, Path]:
+    """
+    Takes:
+        layers: Dictionary of paths to the layers to clip
+        bounds: Tuple of clip bounds in the layers' projection (minx, miny, maxx, maxy)
+        output_dir: directory in which to write the clips (<stem>_clip.tif)
+        resolution: resolution of the clips
+
+    Clips each layer to bounds, on a grid aligned to resolution, in a single warp.
+    Pixels outside a layer are set to NaN.
+
+    Returns: Dictionary of the paths to the clips
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    # expand outward to the grid, as gdalwarp -tap does
+    aligned = (
+        np.floor(bounds[0] / resolution) * resolution,
+        np.floor(bounds[1] / resolution) * resolution,
+        np.ceil(bounds[2] / resolution) * resolution,
+        np.ceil(bounds[3] / resolution) * resolution,
+    )
+    clips = {}
+    for layer, pth in layers.items():
+        clip = output_dir / f"{Path(pth).stem}_clip.tif"
+        if clip.is_file():
+            clip.unlink()
+        f = gdal.Warp(
+            str(clip),
+            str(pth),
+            outputBounds=aligned,
+            xRes=resolution,
+            yRes=resolution,
+            dstNodata=np.nan,
+            copyMetadata=True,
+        )
+        f = None
+        clips[layer] = clip
+    return clips
+
+
+def landcover_clip(
+    data_dir: Union[str, os.PathLike],
+    resolution: float = 30,
+    lc_store: Union[LandcoverStore, None] = None,
+) -> Path:
+    """
+    Takes:
+        data_dir: directory holding a mosaicked OPERA RTC scene
+        resolution: resolution of the clip
+        lc_store: landcover store providing the clip (default: LandcoverStore())
+
+    Returns: path to the PROBA-V LC100 landcover clipped to the VH footprint
+    """
+    vh = find_scene_layers(data_dir)["vh"]
+    lc_store = lc_store or LandcoverStore()
+    # reprojected clips are cached by (EPSG, bounds, resolution) and reused by later scenes
+    return lc_store.get_clip(util.get_projection(vh), get_bounds(vh), resolution)
+
+
+def clip_scene(
+    data_dir: Union[str, os.PathLike],
+    output_dir: Union[str, os.PathLike, None] = None,
+    resolution: float = 30,
+    lc_store: Union[LandcoverStore, None] = None,
+) -> Dict[str, Path]:
+    """
+    Takes:
+        data_dir: directory holding a mosaicked OPERA RTC scene
+        output_dir: directory in which to write the clips (default:
+                    <data_dir.parents[1]>/intermediary_flattening_data/
+                    <data_dir.name>_prepped_for_slope_comparison)
+        resolution: resolution of the clips
+        lc_store: landcover store providing the landcover clip (default: LandcoverStore())
+
+    Clips the scene's layers and the PROBA-V LC100 landcover to the VH footprint
+
+    Returns: Dictionary of the paths to the clips, by layer (see find_scene_layers)
+    """
+    data_dir = Path(data_dir)
+    if output_dir is None:
+        output_dir = (
+            data_dir.parents[1]
+            / f"intermediary_flattening_data/{data_dir.name}_prepped_for_slope_comparison"
+        )
+    layers = find_scene_layers(data_dir)
+    layers["land_cover"] = landcover_clip(data_dir, resolution, lc_store)
+    return clip_layers(layers, get_bounds(layers["vh"]), output_dir, resolution)
+
+
+def read_array(img_path: Union[str, os.PathLike]) -> np.ndarray:
+    """
+    Takes: path to a single band GeoTiff
+
+    Returns: the band as a float array, with no-data pixels set to NaN
+    """
+    f = gdal.Open(str(img_path))
+    band = f.GetRasterBand(1)
+    arr = band.ReadAsArray().astype(np.float32)
+    nodata = band.GetNoDataValue()
+    f = None
+    if nodata is not None and not np.isnan(nodata):
+        arr[arr == nodata] = np.nan
+    return arr
+
+
+def valid_cover_mask(
+    land_cover: np.ndarray, ls_mask: np.ndarray, valid_covers: List[int] = VALID_COVERS
+) -> np.ndarray:
+    """
+    Takes:
+        land_cover: PROBA-V LC100 classes
+        ls_mask: OPERA layover/shadow mask on the same grid (0: neither)
+        valid_covers: landcover classes to keep
+
+    Returns: array of 1 for pixels of a valid landcover unaffected by layover and
+             shadow, 0 elsewhere
+    """
+    return (np.isin(land_cover, valid_covers) & (ls_mask == 0)).astype(np.uint8)
+
+
+def slope_masks(
+    local_inc_angle: np.ndarray,
+    inc_angle: np.ndarray,
+    flat_threshold: float = FLAT_THRESHOLD,
+) -> Dict[str, np.ndarray]:
+    """
+    Takes:
+        local_inc_angle: local incidence angles, in degrees
+        inc_angle: ellipsoidal incidence angles on the same grid, in degrees
+        flat_threshold: largest angle difference of a flat pixel, in degrees
+
+    Returns: Dictionary of boolean masks of the "foreslope", "backslope", and "flat"
+             pixels
+    """
+    diff = local_inc_angle - inc_angle
+    return {
+        "foreslope": diff < -flat_threshold,
+        "backslope": diff > flat_threshold,
+        "flat": (diff >= -flat_threshold) & (diff <= flat_threshold),
+    }
+
+
+def _write_like(
+    src: Union[str, os.PathLike], dst: Union[str, os.PathLike], arr: np.ndarray
+) -> Path:
+    f = gdal.GetDriverByName("GTiff").CreateCopy(str(dst), gdal.Open(str(src)))
+    f.GetRasterBand(1).WriteArray(arr)
+    f.FlushCache()
+    f = None
+    return Path(dst)
+
+
+@traced("classify_slopes")
+def classify_slopes(
+    data_dir: Union[str, os.PathLike],
+    output_dir: Union[str, os.PathLike, None] = None,
+    valid_covers: List[int] = VALID_COVERS,
+    flat_threshold: float = FLAT_THRESHOLD,
+    ground_cover: str = GROUND_COVER,
+) -> Dict[str, Dict[str, Path]]:
+    """
+    Takes:
+        data_dir: directory holding the clips of a scene (see clip_scene)
+        output_dir: directory in which to write the classified backscatter
+                    (default: <data_dir>_<ground_cover>)
+        valid_covers: landcover classes to keep
+        flat_threshold: largest angle difference of a flat pixel, in degrees
+        ground_cover: name of the valid landcover classes
+
+    Writes the valid landcover mask and, for each polarization, the backscatter of the
+    foreslope, backslope, and flat pixels of valid landcover (NaN elsewhere) to
+    <stem>_<slope>.tif
+
+    Returns: Dictionary key: polarization, value: Dictionary of paths by slope
+    """
+    data_dir = Path(data_dir)
+    output_dir = Path(output_dir or data_dir.parent / f"{data_dir.name}_{ground_cover}")
+    output_dir.mkdir(parents=True, exist_ok=True)
+    layers = find_scene_layers(data_dir)
+
+    valid = valid_cover_mask(
+        read_array(layers["land_cover"]), read_array(layers["ls_mask"]), valid_covers
+    )
+    _write_like(
+        layers["land_cover"],
+        output_dir / f"{layers['land_cover'].stem}_valid_{ground_cover}.tif",
+        valid,
+    )
+    masks = slope_masks(
+        read_array(layers["local_inc_angle"]),
+        read_array(layers["inc_angle"]),
+        flat_threshold,
+    )
+
+    classified = {}
+    for pol in POLARIZATIONS:
+        pol_pth = layers[pol.lower()]
+        pol_arr = read_array(pol_pth)
+        classified[pol] = {
+            slope: _write_like(
+                pol_pth,
+                output_dir / f"{pol_pth.stem}_{slope}.tif",
+                np.where(mask & (valid == 1), pol_arr, np.nan),
+            )
+            for slope, mask in masks.items()
+        }
+    return classified
+
+
+@traced("load_backscatter")
+def load_slope_backscatter(
+    data_dir: Union[str, os.PathLike], polarization: str, log: bool = True
+) -> List[np.ndarray]:
+    """
+    Takes:
+        data_dir: directory holding the classified backscatter (see classify_slopes)
+        polarization: "VH" or "VV"
+        log: True for dB, False for power
+
+    Returns: List of the foreslope, backslope, and flat backscatter values, flattened,
+             with NaN outside each slope
+    """
+    values = []
+    for slope in SLOPES:
+        pth = list(Path(data_dir).glob(f"*{polarization}*_clip_{slope}.tif"))[0]
+        arr = read_array(pth).flatten()
+        if log:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                arr = 10 * np.log10(arr)
+        values.append(arr)
+    return values
+
+
+@traced("moments")
+def central_moments(*samples: np.ndarray) -> List[List[float]]:
+    """
+    Takes: backscatter samples, e.g. foreslope, backslope, and flat values
+
+    Returns: List of the means, medians, modes, and standard deviations of the
+             samples, ignoring NaNs
+    """
+    samples = [s[~np.isnan(s)] for s in samples]
+    means = [np.mean(s) for s in samples]
+    medians = [np.median(s) for s in samples]
+    modes = [stats.mode(s, keepdims=False)[0] for s in samples]
+    stds = [np.std(s) for s in samples]
+    return [means, medians, modes, stds]
+
+
+def compute_moments(
+    data_dir: Union[str, os.PathLike], log: bool = True
+) -> Dict[str, List[List[float]]]:
+    """
+    Takes:
+        data_dir: directory holding the classified backscatter (see classify_slopes)
+        log: True for dB, False for power
+
+    Returns: Dictionary key: polarization, value: central moments of the foreslope,
+             backslope, and flat backscatter (see central_moments)
+    """
+    return {
+        pol: central_moments(*load_slope_backscatter(data_dir, pol, log))
+        for pol in POLARIZATIONS
+    }
+
+
+def results_rows(opera_id: str, moments: Dict[str, List[List[float]]]) -> List[List[str]]:
+    """
+    Takes:
+        opera_id: name of the scene's OPERA RTC directory
+        moments: central moments by polarization (see compute_moments)
+
+    Returns: rows of the results CSV (see RESULTS_FIELDS). A polarization passes when
+             its foreslope and backslope medians are within 1 dB.
+    """
+    rows = []
+    for pol, (means, medians, modes, stds) in moments.items():
+        diff = np.abs(medians[0] - medians[1])
+        row = [
+            opera_id, pol,
+            means[0], means[1],
+            medians[0], medians[1],
+            modes[0], modes[1],
+            stds[0], stds[1],
+            diff,
+            diff < 1.0,
+        ]
+        rows.append([str(v) for v in row])
+    return rows
+
+
+def write_results(
+    output_csv: Union[str, os.PathLike],
+    opera_id: str,
+    moments: Dict[str, List[List[float]]],
+) -> Path:
+    """
+    Takes:
+        output_csv: path to the results CSV
+        opera_id: name of the scene's OPERA RTC directory
+        moments: central moments by polarization (see compute_moments)
+
+    Appends the scene's rows to the CSV, creating it with RESULTS_FIELDS if needed.
+    Rows already in the CSV are not repeated.
+
+    Returns: path to the CSV
+    """
+    output_csv = Path(output_csv)
+    existing = []
+    if output_csv.exists():
+        with open(output_csv, "r") as csvfile:
+            existing = list(csv.reader(csvfile))
+    with open(output_csv, "a") as csvfile:
+        csvwriter = csv.writer(csvfile)
+        if not existing:
+            csvwriter.writerow(RESULTS_FIELDS)
+        for row in results_rows(opera_id, moments):
+            if row not in existing:
+                csvwriter.writerow(row)
+    return output_csv
+
+
+def flatten_scene(
+    data_dir: Union[str, os.PathLike],
+    intermediary_dir: Union[str, os.PathLike],
+    output_dir: Union[str, os.PathLike],
+    log: bool = True,
+    lc_store: Union[LandcoverStore, None] = None,
+) -> Path:
+    """
+    Takes:
+        data_dir: directory holding a mosaicked OPERA RTC scene
+        intermediary_dir: directory in which to write the clips and classified backscatter
+        output_dir: directory in which to write the results CSV
+        log: True for dB, False for power
+        lc_store: landcover store providing the landcover clip (default: LandcoverStore())
+
+    Runs the computations of the flattening notebooks (clip, classify slopes, compute
+    moments, write results) without plots or reports
+
+    Returns: path to the results CSV,
+             <output_dir>/Results_Backscatter_Distributions_by_Slope_<opera_id>.csv
+    """
+    data_dir = Path(data_dir)
+    intermediary_dir = Path(intermediary_dir)
+    opera_id = data_dir.name
+    prepped_dir = intermediary_dir / f"{opera_id}_prepped_for_slope_comparison"
+    clip_scene(data_dir, prepped_dir, lc_store=lc_store)
+    classified_dir = prepped_dir.parent / f"{prepped_dir.name}_{GROUND_COVER}"
+    classify_slopes(prepped_dir, classified_dir)
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    return write_results(
+        Path(output_dir) / f"Results_Backscatter_Distributions_by_Slope_{opera_id}.csv",
+        opera_id,
+        compute_moments(classified_dir, log),
+    )
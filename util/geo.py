@@ -1,17 +1,67 @@
+import multiprocessing
 import os
 import re
-import subprocess
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import repeat
 from pathlib import Path
 from typing import Dict, List, Union
 
 import numpy as np
 import shapely.wkt
-from osgeo import gdal
+from osgeo import gdal, gdal_array
+
+from util.instrument import traced
+from util.raster_index import get_raster_index
 
 gdal.UseExceptions()
 
+# Cloud-Optimized GeoTIFF output profile used by all mosaic and intermediate writers
+COG_PROFILE = {
+    "compress": "DEFLATE",
+    "predictor": "YES",
+    "level": None,
+    "blocksize": 512,
+    "overviews": "AUTO",
+}
+
+
+def cog_creation_options(
+    profile: Dict = COG_PROFILE, overview_resampling: str = "AVERAGE"
+) -> List[str]:
+    """
+    Takes:
+        profile: COG output profile with keys "compress", "predictor", "level",
+                 "blocksize" and "overviews" (see COG_PROFILE)
+        overview_resampling: resampling method used to build the overviews
+
+    Returns: List of creation options for GDAL's COG driver
+    """
+    options = [
+        f"COMPRESS={profile['compress']}",
+        f"BLOCKSIZE={profile['blocksize']}",
+        f"OVERVIEWS={profile['overviews']}",
+        f"OVERVIEW_RESAMPLING={overview_resampling}",
+        "BIGTIFF=IF_SAFER",
+        "NUM_THREADS=ALL_CPUS",
+    ]
+    if profile.get("predictor"):
+        options.append(f"PREDICTOR={profile['predictor']}")
+    if profile.get("level"):
+        options.append(f"LEVEL={profile['level']}")
+    return options
+
+
+def overview_resampling(dtype: str) -> str:
+    """
+    Takes: a GDAL data type name, e.g. "Float32" or "Byte"
+
+    Returns: overview resampling method for the data type: "NEAREST" for integer
+             (categorical) data such as layover/shadow masks, "AVERAGE" otherwise
+    """
+    return "NEAREST" if dtype.startswith(("Byte", "Int", "UInt")) else "AVERAGE"
+
 
 def landcover_100_tile_intersections(bounds):
     """
@@ -29,6 +79,17 @@ def landcover_100_tile_intersections(bounds):
     )
 
 
+def get_raster_metadata(img_path: Union[Path, str]) -> Dict:
+    """
+    Takes: a string or posix path to geographic dataset
+
+    Returns: Dictionary of the dataset's header metadata from the persistent raster
+             index (see util.raster_index), reading the header only on first use or
+             after the file has changed
+    """
+    return get_raster_index().get(img_path)
+
+
 def get_corner_coords(img_path: Union[Path, str]) -> Union[List[str], None]:
     """
     Takes: a string or posix path to geographic dataset
@@ -37,18 +98,10 @@ def get_corner_coords(img_path: Union[Path, str]) -> Union[List[str], None]:
              whose 2nd element are the lowerRight coords or None
              if none found
     """
-    img_path = str(img_path)
-    try:
-        info = gdal.Info(img_path, options=["-json"])
-    except TypeError:
-        raise FileNotFoundError
-    try:
-        return [
-            info["cornerCoordinates"]["upperLeft"],
-            info["cornerCoordinates"]["lowerRight"],
-        ]
-    except KeyError:
+    metadata = get_raster_metadata(img_path)
+    if metadata["upper_left"] is None:
         return None
+    return [metadata["upper_left"], metadata["lower_right"]]
 
 
 def get_acquisition_time(scene_id: str) -> datetime:
@@ -68,26 +121,19 @@ def get_projection(img_path: Union[Path, str]) -> Union[str, None]:
 
     Returns: the projection (as a string) or None if none found
     """
-    img_path = str(img_path)
-    try:
-        info = gdal.Info(img_path, format="json")["coordinateSystem"]["wkt"]
-    except KeyError:
-        return None
-    except TypeError:
-        raise FileNotFoundError
-
-    regex = r'ID\["EPSG",[0-9]{4,5}\]\]$'
-    results = re.search(regex, info)
-    if results:
-        return results.group(0).split(",")[1][:-2]
-    else:
-        return None
+    return get_raster_metadata(img_path)["epsg"]
 
 
-def reproject_data(pth: Union[str, os.PathLike], predominant_epsg: str):
+@traced("reproject")
+def reproject_data(
+    pth: Union[str, os.PathLike],
+    predominant_epsg: str,
+    profile: Union[Dict, None] = COG_PROFILE,
+):
     """
     pth: a path to a GeoTiff
     predominant_epsg: a string epsg
+    profile: COG output profile (see COG_PROFILE), or None to write a plain GeoTiff
 
     Checks EPSG of input pth and projects to predominant_epsg if necessary
     """
@@ -106,6 +152,11 @@ def reproject_data(pth: Union[str, os.PathLike], predominant_epsg: str):
             "yRes": res,
             "dstNodata": no_data_val,
         }
+        if profile:
+            warp_options["format"] = "COG"
+            warp_options["creationOptions"] = cog_creation_options(
+                profile, overview_resampling(get_raster_metadata(temp)["dtype"])
+            )
         gdal.Warp(str(pth), str(temp), **warp_options)
         temp.unlink()
 
@@ -116,11 +167,8 @@ def get_projection_counts(tiff_paths: List[Union[os.PathLike, str]]) -> Dict:
 
     Returns: Dictionary key: epsg, value: number of tiffs in that epsg
     """
-    epsgs = []
-    for p in tiff_paths:
-        epsgs.append(get_projection(p))
-
-    epsgs = dict(Counter(epsgs))
+    metadata = get_raster_index().records(tiff_paths)
+    epsgs = dict(Counter(m["epsg"] for m in metadata))
     return epsgs
 
 
@@ -149,8 +197,7 @@ def get_res(tif_pth: Union[os.PathLike, str]) -> float:
 
     Returns: Geotiff resolution
     """
-    f = gdal.Open(str(tif_pth))
-    return f.GetGeoTransform()[1]
+    return get_raster_metadata(tif_pth)["res"]
 
 
 def get_no_data_val(tif_pth: Union[os.PathLike, str]) -> Union[np.nan, float, int]:
@@ -159,20 +206,310 @@ def get_no_data_val(tif_pth: Union[os.PathLike, str]) -> Union[np.nan, float, in
 
     Returns: GeoTiff's no-data value or numpy.nan if not defined
     """
+    no_data_val = get_raster_metadata(tif_pth)["nodata"]
+    return np.nan if not no_data_val else no_data_val
 
+
+def read_overview(
+    tif_pth: Union[os.PathLike, str], max_size: int = 1024, band: int = 1
+) -> np.ndarray:
+    """
+    Takes:
+        tif_pth: path to a GeoTiff
+        max_size: maximum length, in pixels, of the longer side of the returned array
+        band: band number to read
+
+    Returns: a decimated copy of the band for quick-look plotting. GDAL serves the
+             read from the closest internal overview when the GeoTiff has overviews.
+    """
     f = gdal.Open(str(tif_pth))
-    return (
-        np.nan
-        if not f.GetRasterBand(1).GetNoDataValue()
-        else f.GetRasterBand(1).GetNoDataValue()
+    scale = max(f.RasterXSize, f.RasterYSize) / max_size
+    if scale <= 1:
+        return f.GetRasterBand(band).ReadAsArray()
+    return f.GetRasterBand(band).ReadAsArray(
+        buf_xsize=int(f.RasterXSize / scale), buf_ysize=int(f.RasterYSize / scale)
+    )
+
+
+def get_mosaic_grid(burst_paths: List[Union[str, os.PathLike]]) -> Dict:
+    """
+    Takes: List of paths to bursts sharing a projection and resolution
+
+    Returns: Dictionary describing the grid covering the union of all burst footprints
+             keys: "geotransform", "width", "height", "projection"
+    """
+    projection = gdal.Open(str(burst_paths[0])).GetProjection()
+    metadata = get_raster_index().records(burst_paths)
+    _, x_res, _, _, _, y_res = metadata[0]["geotransform"]
+
+    ulx, uly, lrx, lry = np.inf, -np.inf, -np.inf, np.inf
+    for m in metadata:
+        ulx = min(ulx, m["upper_left"][0])
+        uly = max(uly, m["upper_left"][1])
+        lrx = max(lrx, m["lower_right"][0])
+        lry = min(lry, m["lower_right"][1])
+
+    return {
+        "geotransform": (ulx, x_res, 0.0, uly, 0.0, y_res),
+        "width": int((lrx - ulx) / x_res + 0.5),
+        "height": int((lry - uly) / y_res + 0.5),
+        "projection": projection,
+    }
+
+
+@traced("mosaic")
+def mosaic_bursts(
+    burst_paths: List[Union[str, os.PathLike]],
+    output: Union[str, os.PathLike],
+    block_size: int = 512,
+    grid: Union[Dict, None] = None,
+    profile: Union[Dict, None] = COG_PROFILE,
+) -> Path:
+    """
+    Takes:
+        burst_paths: List of paths to bursts to be mosaicked, all in the same projection
+        output: output path of the mosaicked GeoTiff
+        block_size: edge length, in pixels, of the output windows streamed through memory
+        grid: output grid (see get_mosaic_grid), computed from `burst_paths` if None
+        profile: COG output profile (see COG_PROFILE), or None to write a tiled GeoTiff
+
+    Mosaics the bursts block by block with windowed reads, so peak memory is bounded
+    by block_size rather than by scene size. As with gdal_merge.py, later bursts overwrite
+    earlier ones wherever they hold valid data. The no-data value of the first burst
+    (see get_no_data_val) is used to mask inputs and to initialize the output.
+    With a COG profile, blocks are streamed to an uncompressed tiled GeoTiff that is
+    then compressed, with overviews, into the COG in a single sequential pass.
+
+    Returns: path to the mosaic
+    """
+    output = Path(output)
+    if grid is None:
+        grid = get_mosaic_grid(burst_paths)
+    out_gt = grid["geotransform"]
+    no_data_val = get_no_data_val(burst_paths[0])
+
+    # locate each burst on the output grid
+    sources = []
+    for pth in burst_paths:
+        f = gdal.Open(str(pth))
+        gt = f.GetGeoTransform()
+        sources.append(
+            {
+                "dataset": f,
+                "xoff": int((gt[0] - out_gt[0]) / out_gt[1] + 0.1),
+                "yoff": int((gt[3] - out_gt[3]) / out_gt[5] + 0.1),
+                "xsize": f.RasterXSize,
+                "ysize": f.RasterYSize,
+            }
+        )
+
+    first = sources[0]["dataset"]
+    band_count = first.RasterCount
+    gdal_dtype = first.GetRasterBand(1).DataType
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(gdal_dtype)
+    # NaN cannot be stored in integer rasters, so every integer pixel counts as valid
+    nan_no_data = np.isnan(no_data_val)
+    fill_val = 0 if nan_no_data and np.issubdtype(dtype, np.integer) else no_data_val
+
+    # the COG driver cannot be written to block by block
+    tiled_output = output.parent / f"tmp_{output.name}" if profile else output
+    dst = None
+    try:
+        driver = gdal.GetDriverByName("GTiff")
+        dst = driver.Create(
+            str(tiled_output),
+            grid["width"],
+            grid["height"],
+            band_count,
+            gdal_dtype,
+            options=[
+                "TILED=YES",
+                f"BLOCKXSIZE={block_size}",
+                f"BLOCKYSIZE={block_size}",
+                "BIGTIFF=IF_SAFER",
+            ],
+        )
+        dst.SetGeoTransform(out_gt)
+        dst.SetProjection(grid["projection"])
+
+        for b in range(1, band_count + 1):
+            dst_band = dst.GetRasterBand(b)
+            dst_band.SetNoDataValue(float(no_data_val))
+            for yoff in range(0, grid["height"], block_size):
+                ysize = min(block_size, grid["height"] - yoff)
+                for xoff in range(0, grid["width"], block_size):
+                    xsize = min(block_size, grid["width"] - xoff)
+                    block = np.full((ysize, xsize), fill_val, dtype=dtype)
+                    for src in sources:
+                        # intersection of burst and output window, in output pixels
+                        x0 = max(xoff, src["xoff"])
+                        x1 = min(xoff + xsize, src["xoff"] + src["xsize"])
+                        y0 = max(yoff, src["yoff"])
+                        y1 = min(yoff + ysize, src["yoff"] + src["ysize"])
+                        if x0 >= x1 or y0 >= y1:
+                            continue
+                        data = src["dataset"].GetRasterBand(b).ReadAsArray(
+                            x0 - src["xoff"], y0 - src["yoff"], x1 - x0, y1 - y0
+                        )
+                        valid = ~np.isnan(data) if nan_no_data else data != no_data_val
+                        window = block[y0 - yoff : y1 - yoff, x0 - xoff : x1 - xoff]
+                        window[valid] = data[valid]
+                    dst_band.WriteArray(block, xoff, yoff)
+        dst.FlushCache()
+        dst = None
+
+        if profile:
+            f = gdal.Translate(
+                str(output),
+                str(tiled_output),
+                format="COG",
+                creationOptions=cog_creation_options(
+                    profile, overview_resampling(gdal.GetDataTypeName(gdal_dtype))
+                ),
+            )
+            f = None
+    finally:
+        # no uncompressed temporary mosaic is left behind when writing fails
+        dst = None
+        if profile:
+            tiled_output.unlink(missing_ok=True)
+        for src in sources:
+            src["dataset"] = None
+    return output
+
+
+def get_mosaic_warp_options(
+    burst_paths: List[Union[str, os.PathLike]], predominant_epsg: Union[str, None] = None
+) -> Dict:
+    """
+    Takes:
+        burst_paths: List of paths to bursts, in any mix of projections
+        predominant_epsg: a string epsg (see get_projection_counts) or None to use the
+                          projection of the first burst
+
+    Returns: gdal.Warp options projecting bursts onto a pixel-aligned grid in
+             predominant_epsg, at the resolution and no-data value of the first burst
+    """
+    if not predominant_epsg:
+        predominant_epsg = get_projection(burst_paths[0])
+    res = get_res(burst_paths[0])
+    no_data_val = get_no_data_val(burst_paths[0])
+    return {
+        "dstSRS": f"EPSG:{predominant_epsg}",
+        "targetAlignedPixels": True,
+        "xRes": res,
+        "yRes": res,
+        "srcNodata": no_data_val,
+        "dstNodata": no_data_val,
+    }
+
+
+def build_mosaic_vrt(
+    burst_paths: List[Union[str, os.PathLike]],
+    vrt_path: Union[str, os.PathLike],
+    predominant_epsg: Union[str, None] = None,
+) -> List[str]:
+    """
+    Takes:
+        burst_paths: List of paths to bursts to be mosaicked, in any mix of projections
+        vrt_path: path of the mosaic VRT, on disk or under /vsimem/
+        predominant_epsg: a string epsg (see get_projection_counts) or None to use the
+                          projection of the first burst
+
+    Writes a VRT mosaicking the bursts in predominant_epsg. Bursts in other projections
+    are wrapped in warped VRTs written next to `vrt_path`. No pixels are read or written.
+
+    Returns: List of the VRTs written, with the mosaic VRT last
+    """
+    vrt_path = str(vrt_path)
+    warp_options = get_mosaic_warp_options(burst_paths, predominant_epsg)
+    dst_epsg = warp_options["dstSRS"].split(":")[1]
+
+    vrt_sources = []
+    warped_vrts = []
+    for i, pth in enumerate(burst_paths):
+        src_SRS = get_projection(pth)
+        if src_SRS == dst_epsg:
+            vrt_sources.append(str(pth))
+        else:
+            warped_vrt = f"{vrt_path[:-len('.vrt')]}_{i}_warped.vrt"
+            f = gdal.Warp(
+                warped_vrt, str(pth), format="VRT", srcSRS=f"EPSG:{src_SRS}", **warp_options
+            )
+            f = None
+            vrt_sources.append(warped_vrt)
+            warped_vrts.append(warped_vrt)
+
+    f = gdal.BuildVRT(
+        vrt_path,
+        vrt_sources,
+        srcNodata=warp_options["srcNodata"],
+        VRTNodata=warp_options["dstNodata"],
+    )
+    f = None
+    return warped_vrts + [vrt_path]
+
+
+@traced("warp_mosaic")
+def warp_mosaic_bursts(
+    burst_paths: List[Union[str, os.PathLike]],
+    output: Union[str, os.PathLike],
+    predominant_epsg: Union[str, None] = None,
+    profile: Union[Dict, None] = COG_PROFILE,
+) -> Path:
+    """
+    Takes:
+        burst_paths: List of paths to bursts to be mosaicked, in any mix of projections
+        output: output path of the mosaicked GeoTiff
+        predominant_epsg: a string epsg (see get_projection_counts) or None to use the
+                          projection of the first burst
+        profile: COG output profile (see COG_PROFILE), or None to write a tiled GeoTiff
+
+    Reprojects and mosaics the bursts in a single multithreaded warp pass over an
+    in-memory VRT of the bursts (see build_mosaic_vrt), so no intermediate per-burst
+    files are written and the input bursts are left untouched.
+
+    Returns: path to the mosaic
+    """
+    output = Path(output)
+    warp_options = get_mosaic_warp_options(burst_paths, predominant_epsg)
+    vrts = build_mosaic_vrt(
+        burst_paths, f"/vsimem/{output.stem}_mosaic.vrt", predominant_epsg
+    )
+
+    print(f"Warping and merging bursts -> {output}")
+    # gdal.Warp would otherwise mosaic on top of an existing output
+    if output.exists():
+        output.unlink()
+    if profile:
+        output_options = {
+            "format": "COG",
+            "creationOptions": cog_creation_options(
+                profile, overview_resampling(get_raster_metadata(burst_paths[0])["dtype"])
+            ),
+        }
+    else:
+        output_options = {"creationOptions": ["TILED=YES", "BIGTIFF=IF_SAFER"]}
+    f = gdal.Warp(
+        str(output),
+        vrts[-1],
+        multithread=True,
+        warpOptions=["NUM_THREADS=ALL_CPUS"],
+        **output_options,
+        **warp_options,
     )
+    f = None
+
+    for vrt in vrts:
+        gdal.Unlink(vrt)
+    return output
 
 
 def merge_bursts(
     scene_id: str,
     burst_paths: List[Union[str, os.PathLike]],
     output: Union[str, os.PathLike],
-):
+) -> Path:
     """
     Takes:
         scene_id: Sentinel-1 scene ID
@@ -180,15 +517,148 @@ def merge_bursts(
         output: output path of merged GeoTiff
 
     Merges all bursts in `burst_paths`, saving to path `output`
+
+    Returns: path to the merged GeoTiff
     """
+    print(f"Merging bursts -> {output}")
+    return mosaic_bursts(burst_paths, output)
 
-    # build a string of bursts to merge
-    merge_str = ""
-    for pth in burst_paths:
-        merge_str += f" {str(pth)}"
 
-    # merge bursts
-    no_data_val = get_no_data_val(burst_paths[0])
-    merge_command = f"gdal_merge.py -n {no_data_val} -a_nodata {no_data_val} -o {output} {merge_str}"
-    print(f"Merging bursts -> {output}")
-    subprocess.run([merge_command], shell=True)
+@traced("stack")
+def stack_layers(
+    layer_paths: List[Union[str, os.PathLike]],
+    output: Union[str, os.PathLike],
+    descriptions: Union[List[str], None] = None,
+    profile: Union[Dict, None] = COG_PROFILE,
+) -> Path:
+    """
+    Takes:
+        layer_paths: List of paths to single-band GeoTiffs sharing the same grid
+        output: output path of the multi-band GeoTiff
+        descriptions: optional band descriptions, one per layer
+        profile: COG output profile (see COG_PROFILE), or None to write a tiled GeoTiff
+
+    Writes all layers to a single internally tiled, band-interleaved Float32 GeoTiff,
+    one band per layer, with NaN as the no-data value. The no-data pixels of each
+    layer (e.g. 255 in layover/shadow masks) are converted to NaN, and the overviews
+    are resampled with NEAREST when any layer holds integer (categorical) data.
+
+    Returns: path to the stack
+    """
+    output = Path(output)
+    metadata = [get_raster_metadata(p) for p in layer_paths]
+    # a Float32 view of each layer in which its no-data pixels are NaN
+    layer_vrts = []
+    for i, (pth, meta) in enumerate(zip(layer_paths, metadata)):
+        layer_vrt = f"/vsimem/{output.stem}_layer_{i}.vrt"
+        f = gdal.Warp(
+            layer_vrt,
+            str(pth),
+            format="VRT",
+            outputType=gdal.GDT_Float32,
+            srcNodata=meta["nodata"],
+            dstNodata=np.nan,
+        )
+        f = None
+        layer_vrts.append(layer_vrt)
+    stack_vrt = f"/vsimem/{output.stem}_stack.vrt"
+    f = gdal.BuildVRT(stack_vrt, layer_vrts, separate=True)
+    f = None
+
+    print(f"Stacking layers -> {output}")
+    if profile:
+        # one resampling method for all bands: averaging would mix mask classes
+        resampling = (
+            "NEAREST"
+            if any(overview_resampling(meta["dtype"]) == "NEAREST" for meta in metadata)
+            else "AVERAGE"
+        )
+        output_options = {
+            "format": "COG",
+            "creationOptions": cog_creation_options(profile, resampling),
+        }
+    else:
+        output_options = {
+            "creationOptions": ["TILED=YES", "BIGTIFF=IF_SAFER", "INTERLEAVE=BAND"]
+        }
+    f = gdal.Translate(
+        str(output),
+        stack_vrt,
+        outputType=gdal.GDT_Float32,
+        noData=np.nan,
+        **output_options,
+    )
+    for i, description in enumerate(descriptions or []):
+        f.GetRasterBand(i + 1).SetDescription(description)
+    f = None
+    for vrt in [stack_vrt, *layer_vrts]:
+        gdal.Unlink(vrt)
+    return output
+
+
+@traced("assemble")
+def assemble_scene(
+    layer_bursts: Dict[str, List[Union[str, os.PathLike]]],
+    outputs: Dict[str, Union[str, os.PathLike]],
+    predominant_epsg: Union[str, None] = None,
+    warp_mosaic: bool = False,
+    stack_output: Union[str, os.PathLike, None] = None,
+    max_workers: Union[int, None] = None,
+    profile: Union[Dict, None] = COG_PROFILE,
+) -> Dict[str, Path]:
+    """
+    Takes:
+        layer_bursts: Dictionary key: layer name, value: list of paths to the layer's bursts
+        outputs: Dictionary key: layer name, value: output path of the layer's mosaic
+        predominant_epsg: a string epsg to project bursts to, or None if all bursts
+                          share a projection
+        warp_mosaic: reproject and mosaic each layer in a single warp pass
+                     (see warp_mosaic_bursts) instead of reprojecting bursts in place
+        stack_output: optional output path of a multi-band GeoTiff holding every layer,
+                      in the order of `layer_bursts` (see stack_layers)
+        max_workers: size of the process pool, defaults to the number of CPUs
+        profile: COG output profile (see COG_PROFILE) for all outputs, or None to
+                 write tiled GeoTiffs
+
+    Mosaics every layer of a scene concurrently in a process pool. All layers share
+    the same burst footprints, so the output grid is computed once, from the first
+    layer, and every layer is mosaicked onto it. The workers are spawned rather than
+    forked, as this is called from pipeline and scheduler threads that may hold locks.
+
+    Returns: Dictionary key: layer name, value: path to the layer's mosaic
+    """
+    with ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        if warp_mosaic:
+            futures = {
+                layer: executor.submit(
+                    warp_mosaic_bursts, bursts, outputs[layer], predominant_epsg, profile
+                )
+                for layer, bursts in layer_bursts.items()
+            }
+        else:
+            # project to predominant UTM (when necessary)
+            if predominant_epsg:
+                all_bursts = [pth for bursts in layer_bursts.values() for pth in bursts]
+                list(
+                    executor.map(
+                        reproject_data,
+                        all_bursts,
+                        repeat(predominant_epsg),
+                        repeat(profile),
+                    )
+                )
+
+            grid = get_mosaic_grid(next(iter(layer_bursts.values())))
+            futures = {}
+            for layer, bursts in layer_bursts.items():
+                print(f"Merging bursts -> {outputs[layer]}")
+                futures[layer] = executor.submit(
+                    mosaic_bursts, bursts, outputs[layer], grid=grid, profile=profile
+                )
+        mosaics = {layer: future.result() for layer, future in futures.items()}
+
+    if stack_output:
+        stack_layers(list(mosaics.values()), stack_output, list(mosaics), profile)
+    return mosaics
@@ -0,0 +1,393 @@
+import contextvars
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+# JSONL file receiving the spans; set by configure() and inherited by child processes
+# (job processes, notebook kernels, process pools). Spans are not recorded when unset.
+SPANS_ENV = "CALVAL_RTC_SPANS"
+# scene label and depth of the outermost spans of a subprocess (see spans_inherited)
+SCENE_ENV = "CALVAL_RTC_SPAN_SCENE"
+DEPTH_ENV = "CALVAL_RTC_SPAN_DEPTH"
+
+_current = contextvars.ContextVar("calval_rtc_span", default=None)
+_write_lock = threading.Lock()
+# recorded spans open in this process, in any thread (see Span.process_wide)
+_open_spans = set()
+_open_lock = threading.Lock()
+
+
+def configure(spans_path: Union[str, os.PathLike]) -> Path:
+    """
+    Takes: path of the JSONL file in which to record spans
+
+    Records the spans of this process and of the processes it starts to spans_path
+
+    Returns: path to the JSONL file
+    """
+    spans_path = Path(spans_path).resolve()
+    spans_path.parent.mkdir(parents=True, exist_ok=True)
+    os.environ[SPANS_ENV] = str(spans_path)
+    return spans_path
+
+
+def _proc_fields(name: str) -> Dict[str, int]:
+    fields = {}
+    try:
+        with open(f"/proc/self/{name}") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                value = value.split()
+                if value and value[0].isdigit():
+                    fields[key] = int(value[0])
+    except OSError:
+        pass
+    return fields
+
+
+def _io_bytes() -> Tuple[int, int]:
+    io = _proc_fields("io")
+    return io.get("read_bytes", 0), io.get("write_bytes", 0)
+
+
+def _peak_rss_mb() -> float:
+    hwm = _proc_fields("status").get("VmHWM")
+    if hwm is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return hwm / 1024
+
+
+def _reset_peak_rss():
+    # Linux >= 4.0 resets VmHWM to the current RSS
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _cpu_s() -> Tuple[float, float]:
+    t = os.times()
+    return t.user + t.system, t.children_user + t.children_system
+
+
+class Span:
+    """
+    A timed stage of a scene's processing, recorded to the spans JSONL file on exit.
+
+    Records wall time, CPU time of this process and of the subprocesses it waited
+    for, peak RSS of this process, bytes read from and written to storage, and any
+    counters (e.g. downloaded_bytes) added while the span was open.
+
+    Peak RSS and bytes read and written are counters of the whole process. They are
+    attributed to the span only while no other span, but its own parents, is open in
+    the process; otherwise (e.g. spans of concurrent threads) the span is marked
+    process_wide, and they include the work of the other spans.
+    """
+
+    def __init__(
+        self,
+        stage: str,
+        scene: Union[str, None] = None,
+        labels: Union[Dict, None] = None,
+        parent: Union["Span", None] = None,
+    ):
+        self.stage = stage
+        self.scene = scene
+        self.labels = labels or {}
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent else int(os.environ.get(DEPTH_ENV, 0))
+        self.counters = {"downloaded_bytes": 0}
+        self.peak_rss_mb = 0.0
+        self.process_wide = False
+        self.wall_s = None
+        self.record = None
+        self._lock = threading.Lock()
+
+    def count(self, key: str, n: Union[int, float]):
+        """
+        key: name of the counter, e.g. "downloaded_bytes"
+        n: amount to add to the counter of this span and of its parents
+        """
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+        if self.parent:
+            self.parent.count(key, n)
+
+    def _peak(self, rss_mb: float):
+        self.peak_rss_mb = max(self.peak_rss_mb, rss_mb)
+        if self.parent:
+            self.parent._peak(rss_mb)
+
+
+def _open(s: Span) -> bool:
+    # marks s, and the open spans that are not its parents, as process-wide;
+    # returns True when s runs alone in the process but for its parents
+    parents = set()
+    parent = s.parent
+    while parent:
+        parents.add(parent)
+        parent = parent.parent
+    with _open_lock:
+        others = [o for o in _open_spans if o not in parents]
+        for o in others:
+            o.process_wide = True
+        s.process_wide = bool(others)
+        _open_spans.add(s)
+    return not others
+
+
+def _close(s: Span):
+    with _open_lock:
+        _open_spans.discard(s)
+
+
+def _write(spans_path: str, record: Dict):
+    # a single append per record, so concurrent processes never interleave lines
+    with _write_lock, open(spans_path, "a") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+
+@contextmanager
+def span(stage: str, scene: Union[str, None] = None, **labels) -> Iterator[Span]:
+    """
+    Takes:
+        stage: name of the stage, e.g. "download" or "notebook:ALE_OPERA-RTC"
+        scene: scene (or stack) label, inherited from the enclosing span (or from the
+               span enclosing this subprocess, see spans_inherited) when None
+        labels: any JSON-serializable labels of the span
+
+    Times the enclosed block and, once configured (see configure), appends its span
+    to the spans JSONL file, also when the block raises
+
+    Returns: the open Span, e.g. to add counters with Span.count
+    """
+    parent = _current.get()
+    if scene is None:
+        scene = parent.scene if parent else os.environ.get(SCENE_ENV)
+    s = Span(stage, scene, labels, parent)
+    spans_path = os.environ.get(SPANS_ENV)
+    token = _current.set(s)
+
+    if spans_path:
+        if _open(s):
+            if parent:
+                parent._peak(_peak_rss_mb())
+            _reset_peak_rss()
+        read_0, write_0 = _io_bytes()
+        cpu_0, child_cpu_0 = _cpu_s()
+    start = datetime.now()
+    wall_0 = time.perf_counter()
+    error = None
+    try:
+        yield s
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.wall_s = time.perf_counter() - wall_0
+        _current.reset(token)
+        if spans_path:
+            _close(s)
+            cpu_1, child_cpu_1 = _cpu_s()
+            read_1, write_1 = _io_bytes()
+            s._peak(_peak_rss_mb())
+            s.record = {
+                "stage": stage,
+                "scene": scene,
+                "labels": labels,
+                "start": start.isoformat(),
+                "wall_s": round(s.wall_s, 3),
+                "cpu_s": round(cpu_1 - cpu_0, 3),
+                "child_cpu_s": round(child_cpu_1 - child_cpu_0, 3),
+                "peak_rss_mb": round(s.peak_rss_mb, 1),
+                "read_bytes": read_1 - read_0,
+                "write_bytes": write_1 - write_0,
+                **s.counters,
+                "pid": os.getpid(),
+                "depth": s.depth,
+                "process_wide": s.process_wide,
+                "status": "failed" if error else "done",
+                "error": error,
+            }
+            _write(spans_path, s.record)
+
+
+@contextmanager
+def spans_inherited(s: Span) -> Iterator[Span]:
+    """
+    Takes: open span
+
+    Within the block, subprocesses started by this process (e.g. notebook kernels)
+    label their outermost spans with the scene of `s` and nest them under it
+
+    Returns: the span
+    """
+    previous = {key: os.environ.get(key) for key in (SCENE_ENV, DEPTH_ENV)}
+    if s.scene is not None:
+        os.environ[SCENE_ENV] = s.scene
+    os.environ[DEPTH_ENV] = str(s.depth + 1)
+    try:
+        yield s
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def traced(stage: str) -> Callable:
+    """
+    Takes: name of the stage
+
+    Returns: decorator recording each call of the decorated function as a span
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(key: str, n: Union[int, float]):
+    """
+    Takes:
+        key: name of the counter, e.g. "downloaded_bytes"
+        n: amount to add to the counter of the open span (if any) and of its parents
+    """
+    s = _current.get()
+    if s is not None:
+        s.count(key, n)
+
+
+def in_current_span(func: Callable) -> Callable:
+    """
+    Takes: function to run in another thread, e.g. by a ThreadPoolExecutor
+
+    Returns: function running func within the span open in the calling thread, so
+             the spans and counters of func are attributed to it
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+def load_spans(spans_paths: List[Union[str, os.PathLike]]):
+    """
+    Takes: paths to spans JSONL files
+
+    Returns: pandas DataFrame with one row per span
+    """
+    import pandas as pd
+
+    records = []
+    for pth in spans_paths:
+        with open(pth) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return pd.DataFrame.from_records(records)
+
+
+def summarize_stages(spans):
+    """
+    Takes: DataFrame of spans (see load_spans)
+
+    Returns: DataFrame of the number of spans, total, mean, and max wall time, CPU
+             time, peak RSS, bytes read, written, and downloaded, and failures of each
+             stage, by decreasing total wall time. Nested stages are included in the
+             totals of the stages enclosing them.
+    """
+    summary = spans.groupby("stage").agg(
+        count=("wall_s", "size"),
+        wall_s=("wall_s", "sum"),
+        mean_wall_s=("wall_s", "mean"),
+        max_wall_s=("wall_s", "max"),
+        cpu_s=("cpu_s", "sum"),
+        child_cpu_s=("child_cpu_s", "sum"),
+        peak_rss_mb=("peak_rss_mb", "max"),
+        read_mb=("read_bytes", "sum"),
+        write_mb=("write_bytes", "sum"),
+        downloaded_mb=("downloaded_bytes", "sum"),
+        failed=("status", lambda s: int((s == "failed").sum())),
+    )
+    for col in ["read_mb", "write_mb", "downloaded_mb"]:
+        summary[col] = summary[col] / 1024**2
+    return summary.sort_values("wall_s", ascending=False)
+
+
+def summarize_scenes(spans, top: int = 10):
+    """
+    Takes:
+        spans: DataFrame of spans (see load_spans)
+        top: number of scenes to return
+
+    Returns: DataFrame of the slowest scenes: total wall time of their outermost
+             spans, and the stage taking most of it
+    """
+    outer = spans[(spans["depth"] == 0) & spans["scene"].notna()]
+    by_stage = outer.groupby(["scene", "stage"])["wall_s"].sum().reset_index()
+    slowest = by_stage.loc[by_stage.groupby("scene")["wall_s"].idxmax()]
+    scenes = outer.groupby("scene").agg(
+        wall_s=("wall_s", "sum"),
+        peak_rss_mb=("peak_rss_mb", "max"),
+        failed=("status", lambda s: int((s == "failed").sum())),
+    )
+    scenes["slowest_stage"] = slowest.set_index("scene")["stage"]
+    scenes["slowest_stage_s"] = slowest.set_index("scene")["wall_s"]
+    return scenes.sort_values("wall_s", ascending=False).head(top)
+
+
+def print_summary(spans_paths: List[Union[str, os.PathLike]], top: int = 10):
+    """
+    Takes:
+        spans_paths: paths to spans JSONL files
+        top: number of slowest scenes to print
+
+    Prints the per-stage breakdown and the slowest scenes, noting the spans whose
+    peak RSS and bytes read and written are process-wide (see Span)
+    """
+    import pandas as pd
+
+    spans = load_spans(spans_paths)
+    if spans.empty:
+        print("No spans recorded")
+        return
+    with pd.option_context(
+        "display.max_rows",
+        None,
+        "display.max_columns",
+        None,
+        "display.width",
+        None,
+        "display.float_format",
+        "{:.1f}".format,
+    ):
+        print("Per-stage breakdown:")
+        print(summarize_stages(spans))
+        print(f"\nSlowest {top} scenes:")
+        print(summarize_scenes(spans, top))
+    # spans recorded before process_wide was added have no such column
+    process_wide = spans.get("process_wide", pd.Series(dtype=object))
+    n_process_wide = int(process_wide.fillna(False).astype(bool).sum())
+    if n_process_wide:
+        print(
+            f"\n{n_process_wide} of {len(spans)} spans ran alongside other spans of "
+            "their process: their peak RSS and bytes read and written are those of "
+            "the whole process"
+        )
@@ -0,0 +1,262 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Tuple, Union
+
+import numpy as np
+import requests
+from osgeo import gdal, osr
+
+import util.geo as util
+
+gdal.UseExceptions()
+
+DEFAULT_STORE_DIR = Path(
+    os.environ.get(
+        "CALVAL_RTC_LANDCOVER_STORE", Path.home() / ".cache/calval-RTC/landcover"
+    )
+)
+LANDCOVER_BASE_URL = "https://s3-eu-west-1.amazonaws.com/vito.landcover.global/v3.0.1/2019"
+LANDCOVER_PRODUCT = "PROBAV_LC100_global_v3.0.1_2019-nrt_Discrete-Classification-map"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    tile TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    downloaded TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clips (
+    epsg TEXT NOT NULL,
+    bounds TEXT NOT NULL,
+    res REAL NOT NULL,
+    path TEXT NOT NULL,
+    created TEXT NOT NULL,
+    PRIMARY KEY (epsg, bounds, res)
+);
+"""
+
+
+def landcover_100_tile_names(bounds: Tuple[float, float, float, float]) -> List[str]:
+    """
+    bounds: Tuple of lon lat bounds in the format (left, bottom, right, top)
+
+    return: List of the names of the 20 x 20 degree PROBA-V LC100 tiles intersecting
+            bounds, e.g. ["W160N60", "W160N80"]
+    """
+    left, bottom, right, top = util.landcover_100_tile_intersections(bounds)
+    lons = [
+        f"W{str(abs(c)).zfill(3)}" if c < 0 else f"E{str(c).zfill(3)}"
+        for c in [left, right]
+    ]
+    lats = [
+        f"S{str(abs(c)).zfill(2)}" if c < 0 else f"N{str(c).zfill(2)}"
+        for c in [bottom, top]
+    ]
+    # dict.fromkeys drops duplicates while keeping (left, right), (bottom, top) order
+    return [f"{lon}{lat}" for lon in dict.fromkeys(lons) for lat in dict.fromkeys(lats)]
+
+
+def partial_path(pth: Path) -> Path:
+    """
+    pth: path of a file to write
+
+    return: path of a temporary file, unique to this process and thread, to write
+            before renaming it to `pth`
+    """
+    return pth.with_name(f"{pth.name}.{os.getpid()}-{threading.get_ident()}.part")
+
+
+def bounds_to_4326(
+    bounds: Tuple[float, float, float, float], epsg: str
+) -> Tuple[float, float, float, float]:
+    """
+    bounds: Tuple of bounds in the format (minx, miny, maxx, maxy)
+    epsg: a string epsg of `bounds`
+
+    return: Tuple of lon lat bounds of the reprojected corners (left, bottom, right, top)
+    """
+    src = osr.SpatialReference()
+    src.ImportFromEPSG(int(epsg))
+    dst = osr.SpatialReference()
+    dst.ImportFromEPSG(4326)
+    for srs in [src, dst]:
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(src, dst)
+    minx, miny, maxx, maxy = bounds
+    corners = [
+        transform.TransformPoint(x, y)[:2]
+        for x, y in [(minx, miny), (minx, maxy), (maxx, miny), (maxx, maxy)]
+    ]
+    lons, lats = zip(*corners)
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+class LandcoverStore:
+    """
+    Shared local store of PROBA-V LC100 landcover tiles.
+
+    Tiles are downloaded once into `store_dir/tiles` and exposed through a single
+    mosaic-free VRT over every cached tile. Reprojected clips are cached in
+    `store_dir/clips`, keyed by (EPSG, bounds, resolution), so scenes of a site/orbit
+    stack sharing a footprint skip download, merge, and warp entirely.
+    """
+
+    def __init__(
+        self,
+        store_dir: Union[str, os.PathLike] = DEFAULT_STORE_DIR,
+        base_url: str = LANDCOVER_BASE_URL,
+    ):
+        """
+        store_dir: directory holding the tiles, clips, VRT, and index
+        base_url: URL of the directory holding the tile directories
+        """
+        self.store_dir = Path(store_dir)
+        self.tile_dir = self.store_dir / "tiles"
+        self.clip_dir = self.store_dir / "clips"
+        for d in [self.tile_dir, self.clip_dir]:
+            d.mkdir(parents=True, exist_ok=True)
+        self.base_url = base_url.rstrip("/")
+        self.index_path = self.store_dir / "landcover_index.sqlite"
+        self.vrt_path = self.store_dir / f"{LANDCOVER_PRODUCT}_EPSG-4326.vrt"
+        with self._connection() as con:
+            con.executescript(SCHEMA)
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        # commits on success, rolls back on error, and always closes the connection
+        con = sqlite3.connect(self.index_path, timeout=60)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def tile_url(self, tile: str) -> str:
+        """
+        tile: PROBA-V LC100 tile name, e.g. "W160N80"
+
+        return: the tile's download URL
+        """
+        return f"{self.base_url}/{tile}/{tile}_{LANDCOVER_PRODUCT}_EPSG-4326.tif"
+
+    def cached_tiles(self) -> List[Path]:
+        """
+        return: List of paths to all cached tiles
+        """
+        return sorted(self.tile_dir.glob(f"*_{LANDCOVER_PRODUCT}_EPSG-4326.tif"))
+
+    def get_tile(self, tile: str) -> Path:
+        """
+        tile: PROBA-V LC100 tile name, e.g. "W160N80"
+
+        return: path to the cached tile, downloading it first if necessary
+        """
+        url = self.tile_url(tile)
+        pth = self.tile_dir / url.split("/")[-1]
+        if pth.exists():
+            return pth
+
+        print(f"Downloading landcover tile -> {pth}")
+        partial = partial_path(pth)
+        with requests.get(url, stream=True) as r:
+            r.raise_for_status()
+            with open(partial, "wb") as f:
+                for chunk in r.iter_content(chunk_size=2**20):
+                    f.write(chunk)
+        os.replace(partial, pth)
+
+        with self._connection() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?)",
+                (tile, url, str(pth), pth.stat().st_size, datetime.now().isoformat()),
+            )
+        self.build_vrt()
+        return pth
+
+    def build_vrt(self) -> Path:
+        """
+        return: path to a VRT over every cached tile, rebuilt from the index
+        """
+        partial = partial_path(self.vrt_path)
+        f = gdal.BuildVRT(str(partial), [str(p) for p in self.cached_tiles()])
+        f = None
+        os.replace(partial, self.vrt_path)
+        return self.vrt_path
+
+    def global_vrt(self, tiles: Union[List[str], None] = None) -> Path:
+        """
+        tiles: optional list of tile names that must be cached
+
+        return: path to the VRT over every cached tile
+        """
+        for tile in tiles or []:
+            self.get_tile(tile)
+        if not self.vrt_path.exists():
+            self.build_vrt()
+        return self.vrt_path
+
+    def get_clip(
+        self,
+        epsg: str,
+        bounds: Tuple[float, float, float, float],
+        res: float = 30,
+    ) -> Path:
+        """
+        epsg: a string epsg of the clip
+        bounds: Tuple of clip bounds in `epsg` in the format (minx, miny, maxx, maxy)
+        res: clip resolution in units of `epsg`
+
+        return: path to a clip of the landcover reprojected to `epsg`, covering `bounds`
+                (expanded outward to the `res` grid), warped only on first request
+        """
+        bounds = (
+            np.floor(bounds[0] / res) * res,
+            np.floor(bounds[1] / res) * res,
+            np.ceil(bounds[2] / res) * res,
+            np.ceil(bounds[3] / res) * res,
+        )
+        bounds_key = ",".join(f"{b:.0f}" for b in bounds)
+        with self._connection() as con:
+            row = con.execute(
+                "SELECT path FROM clips WHERE epsg = ? AND bounds = ? AND res = ?",
+                (str(epsg), bounds_key, res),
+            ).fetchone()
+        if row and Path(row[0]).exists():
+            return Path(row[0])
+
+        vrt = self.global_vrt(landcover_100_tile_names(bounds_to_4326(bounds, epsg)))
+        clip = (
+            self.clip_dir
+            / f"{LANDCOVER_PRODUCT}_EPSG-{epsg}_{bounds_key.replace(',', '_')}_{res:g}m.tif"
+        )
+        print(f"Warping landcover -> {clip}")
+        partial = partial_path(clip)
+        f = gdal.Warp(
+            str(partial),
+            str(vrt),
+            srcSRS="EPSG:4326",
+            dstSRS=f"EPSG:{epsg}",
+            outputBounds=bounds,
+            xRes=res,
+            yRes=res,
+            dstNodata=None,
+            copyMetadata=True,
+            format="COG",
+            creationOptions=util.cog_creation_options(
+                util.COG_PROFILE, util.overview_resampling("Byte")
+            ),
+        )
+        f = None
+        os.replace(partial, clip)
+
+        with self._connection() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO clips VALUES (?, ?, ?, ?, ?)",
+                (str(epsg), bounds_key, res, str(clip), datetime.now().isoformat()),
+            )
+        return clip
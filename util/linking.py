@@ -0,0 +1,439 @@
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Union
+from urllib.parse import urlparse
+
+import pandas as pd
+
+LINKING_DATA_DIR = Path(__file__).resolve().parents[1] / "linking-data"
+RTC_TABLE = LINKING_DATA_DIR / "opera_rtc_table.csv"
+STATIC_TABLE = LINKING_DATA_DIR / "opera_rtc_static_table.csv"
+# one row per burst, with list-typed URL columns (see write_burst_table)
+BURST_TABLE = LINKING_DATA_DIR / "opera_rtc_bursts.parquet"
+
+BURST_ID_REGEX = r"(?<=OPERA_L2_RTC-S1_)T\d{3}-\d{6}-IW[123]"
+
+# RTC layer name: suffix of its URLs
+RTC_LAYERS = {
+    "h5": ".h5",
+    "browse": "_BROWSE.png",
+    "vh": "_VH.tif",
+    "vv": "_VV.tif",
+    "mask": "_mask.tif",
+}
+# static layer name: suffix of its URLs
+STATIC_LAYERS = {
+    "mask": "v1.0_mask.tif",
+    "incidence_angle": "v1.0_incidence_angle.tif",
+    "local_incidence_angle": "v1.0_local_incidence_angle.tif",
+}
+
+
+def is_valid_url(url: str) -> bool:
+    """
+    Takes: a string
+
+    Returns: True if the string is a URL with a scheme and network location
+    """
+    try:
+        result = urlparse(url)
+        return all([result.scheme, result.netloc])
+    except AttributeError:
+        return False
+
+
+def split_urls(urls: Union[str, float]) -> List[str]:
+    """
+    Takes: space-separated URLs from a linking table cell (NaN if empty)
+
+    Returns: list of the valid URLs
+    """
+    if not isinstance(urls, str):
+        return []
+    return [url for url in urls.split(" ") if is_valid_url(url)]
+
+
+@dataclass(frozen=True)
+class SceneRecord:
+    """
+    OPERA RTC products of one Sentinel-1 scene linked to a CalVal site/orbit/module
+    """
+
+    site: str
+    orbit_direction: str
+    orbital_path: int
+    calval_module: str
+    scene_id: str
+    opera_rtc_ids: List[str]
+    burst_ids: List[str]
+    h5_urls: List[str]
+    browse_urls: List[str]
+    vh_urls: List[str]
+    vv_urls: List[str]
+    mask_urls: List[str]
+
+
+@dataclass(frozen=True)
+class StaticRecord:
+    """
+    OPERA RTC static layer products of one burst
+    """
+
+    burst_id: str
+    sas_version: str
+    product_urls: List[str]
+
+    def layer_urls(self, layer: str) -> List[str]:
+        """
+        Takes: a static layer name (see STATIC_LAYERS)
+
+        Returns: URLs of the layer
+        """
+        return [url for url in self.product_urls if url.endswith(STATIC_LAYERS[layer])]
+
+
+class LinkingTables:
+    """
+    The OPERA RTC and static layer linking tables, parsed once into typed records and
+    hash indexes so that looking up a scene, a site/orbit/module, or a burst is O(1).
+    """
+
+    def __init__(self, scenes: List[SceneRecord], statics: List[StaticRecord]):
+        """
+        scenes: scene records, in table order
+        statics: static layer records, most recent SAS version of each burst first
+
+        See from_csv and from_parquet to load the records from disk
+        """
+        self._scenes = {}
+        self._groups = {}
+        self._static = {}
+        for record in scenes:
+            key = (record.site, record.orbital_path, record.calval_module)
+            self._scenes[(record.scene_id, record.calval_module)] = record
+            self._scenes.setdefault((record.scene_id, None), record)
+            self._groups.setdefault(key, []).append(record)
+        for record in statics:
+            if record.product_urls:
+                self._static.setdefault(record.burst_id, record)
+
+    @classmethod
+    def from_csv(
+        cls,
+        rtc_table: Union[str, os.PathLike] = RTC_TABLE,
+        static_table: Union[str, os.PathLike] = STATIC_TABLE,
+    ) -> "LinkingTables":
+        """
+        Takes:
+            rtc_table: path to opera_rtc_table.csv (its .csv.zip is read if it is missing)
+            static_table: path to opera_rtc_static_table.csv
+
+        Returns: the linking tables
+        """
+        df_rtc = read_csv_table(rtc_table)
+        df_static = read_csv_table(static_table)
+        scenes = [
+            SceneRecord(
+                site=row.Site,
+                orbit_direction=row.Orbit_Direction,
+                orbital_path=int(row.Orbital_Path),
+                calval_module=row.CalVal_Module,
+                scene_id=row.S1_Scene_IDs,
+                opera_rtc_ids=str(row.opera_rtc_ids).split(),
+                burst_ids=re.findall(BURST_ID_REGEX, str(row.opera_rtc_ids)),
+                h5_urls=split_urls(row.h5_url),
+                browse_urls=split_urls(row.browse_url),
+                vh_urls=split_urls(row.vh_url),
+                vv_urls=split_urls(row.vv_url),
+                mask_urls=split_urls(row.mask_url),
+            )
+            for row in df_rtc.itertuples()
+        ]
+        statics = [
+            StaticRecord(
+                burst_id=row.burst_id,
+                sas_version="" if pd.isna(row.sas_version) else str(row.sas_version),
+                product_urls=split_urls(row.product_urls),
+            )
+            for row in df_static.itertuples()
+        ]
+        return cls(scenes, statics)
+
+    @classmethod
+    def from_parquet(
+        cls,
+        burst_table: Union[str, os.PathLike] = BURST_TABLE,
+        site: Union[str, None] = None,
+        orbital_path: Union[int, None] = None,
+        calval_module: Union[str, None] = None,
+    ) -> "LinkingTables":
+        """
+        Takes:
+            burst_table: path to the Parquet burst table (see write_burst_table)
+            site, orbital_path, calval_module: optional filters, pushed down to the
+                                               Parquet reader so that only the
+                                               matching row groups are decompressed
+
+        Returns: the linking tables of the matching scenes and their bursts
+        """
+        filters = [
+            (column, "==", value)
+            for column, value in [
+                ("site", site),
+                ("orbital_path", orbital_path),
+                ("calval_module", calval_module),
+            ]
+            if value is not None
+        ]
+        df = pd.read_parquet(burst_table, filters=filters or None)
+
+        scenes, statics = [], []
+        scene_columns = ["site", "orbit_direction", "orbital_path", "calval_module", "scene_id"]
+        for key, bursts in df.groupby(scene_columns, sort=False, observed=True):
+            rtc_urls = [url for urls in bursts.rtc_urls for url in urls]
+            scenes.append(
+                SceneRecord(
+                    *key[:2],
+                    int(key[2]),
+                    *key[3:],
+                    opera_rtc_ids=bursts.opera_rtc_id.tolist(),
+                    burst_ids=bursts.burst_id.tolist(),
+                    **{
+                        f"{layer}_urls": [url for url in rtc_urls if url.endswith(suffix)]
+                        for layer, suffix in RTC_LAYERS.items()
+                    },
+                )
+            )
+        for row in df.drop_duplicates("burst_id").itertuples():
+            statics.append(
+                StaticRecord(
+                    burst_id=row.burst_id,
+                    # missing values may be read as None or NaN, depending on the reader
+                    sas_version=(
+                        "" if pd.isna(row.static_sas_version) else row.static_sas_version
+                    ),
+                    product_urls=[] if row.static_urls is None else list(row.static_urls),
+                )
+            )
+        return cls(scenes, statics)
+
+    def scenes(
+        self,
+        site: Union[str, None] = None,
+        orbital_path: Union[int, None] = None,
+        calval_module: Union[str, None] = None,
+        require_urls: bool = True,
+    ) -> List[SceneRecord]:
+        """
+        Takes:
+            site, orbital_path, calval_module: optional filters
+            require_urls: True to skip scenes without VV or VH URLs, e.g. scenes
+                          whose RTC bursts were not published yet when linked
+
+        Returns: the matching scene records, in table order
+        """
+        if None not in (site, orbital_path, calval_module):
+            records = self._groups.get((site, orbital_path, calval_module), [])
+        else:
+            records = [
+                record
+                for (s, o, m), group in self._groups.items()
+                if site in (None, s)
+                and orbital_path in (None, o)
+                and calval_module in (None, m)
+                for record in group
+            ]
+        return [
+            record
+            for record in records
+            if not require_urls or (record.vv_urls and record.vh_urls)
+        ]
+
+    def scene(self, scene_id: str, calval_module: Union[str, None] = None) -> SceneRecord:
+        """
+        Takes:
+            scene_id: Sentinel-1 scene ID
+            calval_module: optional CalVal module, for scenes linked to several modules
+
+        Returns: the scene record; raises a KeyError if the scene is not linked
+        """
+        return self._scenes[(scene_id, calval_module)]
+
+    def static(self, burst_id: str) -> Union[StaticRecord, None]:
+        """
+        Takes: burst ID, e.g. "T160-342211-IW1"
+
+        Returns: the burst's static layer record, or None if it has none
+        """
+        return self._static.get(burst_id)
+
+    def static_urls(self, scene: SceneRecord) -> Dict[str, List[str]]:
+        """
+        Takes: a scene record
+
+        Returns: Dictionary key: static layer name (see STATIC_LAYERS),
+                 value: URLs of the layer for every burst of the scene with static layers
+        """
+        urls = {layer: [] for layer in STATIC_LAYERS}
+        for burst_id in scene.burst_ids:
+            record = self.static(burst_id)
+            if record is None:
+                continue
+            for layer in STATIC_LAYERS:
+                urls[layer] += record.layer_urls(layer)
+        return urls
+
+
+def read_csv_table(pth: Union[str, os.PathLike]) -> pd.DataFrame:
+    """
+    Takes: path to a linking table CSV (its .zip is read if the CSV is missing)
+
+    Returns: the table
+    """
+    pth = Path(pth)
+    if not pth.exists() and pth.with_name(f"{pth.name}.zip").exists():
+        pth = pth.with_name(f"{pth.name}.zip")
+    return pd.read_csv(pth, index_col=0)
+
+
+def burst_table_from_csv(
+    rtc_table: Union[str, os.PathLike] = RTC_TABLE,
+    static_table: Union[str, os.PathLike] = STATIC_TABLE,
+) -> pd.DataFrame:
+    """
+    Takes: paths to the RTC and static layer linking table CSVs
+
+    Returns: one row per (site, orbit, CalVal module, scene, burst) with typed
+             acquisition time, burst ID, and SAS version columns and the burst's
+             RTC and static layer URLs as lists
+    """
+    df_rtc = read_csv_table(rtc_table)
+    df_static = read_csv_table(static_table)
+    df_static = df_static[df_static.product_urls.notna()].drop_duplicates("burst_id")
+    static = df_static.set_index("burst_id")
+
+    url_columns = [f"{layer}_url" for layer in RTC_LAYERS]
+    rows = []
+    for scene_order, row in enumerate(df_rtc.itertuples()):
+        opera_rtc_ids = str(row.opera_rtc_ids).split()
+        # the URL columns list one URL per burst, in the order of opera_rtc_ids
+        layer_urls = [
+            getattr(row, column).split(" ") if isinstance(getattr(row, column), str) else []
+            for column in url_columns
+        ]
+        for i, opera_rtc_id in enumerate(opera_rtc_ids):
+            burst_id = re.search(BURST_ID_REGEX, opera_rtc_id)
+            burst_id = burst_id.group(0) if burst_id else None
+            has_static = burst_id in static.index
+            rows.append(
+                {
+                    "site": row.Site,
+                    "orbit_direction": row.Orbit_Direction,
+                    "orbital_path": row.Orbital_Path,
+                    "calval_module": row.CalVal_Module,
+                    "scene_id": row.S1_Scene_IDs,
+                    "scene_order": scene_order,
+                    "acquisition_time": re.search(r"(?<=_)\d{8}T\d{6}", row.S1_Scene_IDs),
+                    "opera_rtc_id": opera_rtc_id,
+                    "burst_id": burst_id,
+                    "rtc_sas_version": getattr(row, "rtc_sas_version", None),
+                    "rtc_urls": [
+                        urls[i] for urls in layer_urls if i < len(urls) and is_valid_url(urls[i])
+                    ],
+                    "static_sas_version": (
+                        str(static.sas_version[burst_id])
+                        if has_static and pd.notna(static.sas_version[burst_id])
+                        else None
+                    ),
+                    "static_urls": (
+                        split_urls(static.product_urls[burst_id]) if has_static else []
+                    ),
+                }
+            )
+    df = pd.DataFrame(rows)
+    df["acquisition_time"] = pd.to_datetime(
+        df.acquisition_time.map(lambda m: m.group(0) if m else None),
+        format="%Y%m%dT%H%M%S",
+    )
+    return df
+
+
+def write_burst_table(
+    df: pd.DataFrame,
+    burst_table: Union[str, os.PathLike] = BURST_TABLE,
+    row_group_size: int = 2048,
+) -> Path:
+    """
+    Takes:
+        df: burst table (see burst_table_from_csv)
+        burst_table: path of the Parquet file to write
+        row_group_size: number of bursts per row group
+
+    Writes the table sorted by CalVal module, site, and orbit, so that the row group
+    statistics let readers filtering on them skip every other row group
+
+    Returns: path to the Parquet file
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ("site", pa.string()),
+            ("orbit_direction", pa.string()),
+            ("orbital_path", pa.int16()),
+            ("calval_module", pa.string()),
+            ("scene_id", pa.string()),
+            ("scene_order", pa.int32()),
+            ("acquisition_time", pa.timestamp("s")),
+            ("opera_rtc_id", pa.string()),
+            ("burst_id", pa.string()),
+            ("rtc_sas_version", pa.string()),
+            ("rtc_urls", pa.list_(pa.string())),
+            ("static_sas_version", pa.string()),
+            ("static_urls", pa.list_(pa.string())),
+        ]
+    )
+    df = df.sort_values(["calval_module", "site", "orbital_path", "scene_order"], kind="stable")
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    pq.write_table(
+        table, burst_table, row_group_size=row_group_size, compression="zstd"
+    )
+    return Path(burst_table)
+
+
+@lru_cache
+def get_linking_tables(
+    rtc_table: Union[str, os.PathLike] = RTC_TABLE,
+    static_table: Union[str, os.PathLike] = STATIC_TABLE,
+    burst_table: Union[str, os.PathLike] = BURST_TABLE,
+    site: Union[str, None] = None,
+    orbital_path: Union[int, None] = None,
+    calval_module: Union[str, None] = None,
+) -> LinkingTables:
+    """
+    Takes:
+        rtc_table, static_table: paths to the RTC and static layer linking table CSVs
+        burst_table: path to the Parquet burst table
+        site, orbital_path, calval_module: optional filters, pushed down to the
+                                           Parquet reader (see from_parquet)
+
+    Returns: the linking tables, parsed only once per process and filters, from the
+             Parquet burst table if it exists and is newer than the CSVs (holding only
+             the matching scenes), from the CSVs otherwise (holding every scene)
+    """
+    csv_tables = [
+        pth
+        for table in [Path(rtc_table), Path(static_table)]
+        for pth in [table, table.with_name(f"{table.name}.zip")]
+        if pth.exists()
+    ]
+    burst_table = Path(burst_table)
+    if burst_table.exists() and all(
+        burst_table.stat().st_mtime >= pth.stat().st_mtime for pth in csv_tables
+    ):
+        return LinkingTables.from_parquet(burst_table, site, orbital_path, calval_module)
+    return LinkingTables.from_csv(rtc_table, static_table)
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Union
+
+# per-scene stages, in pipeline order; notebook and report stages are named
+# f"{NOTEBOOK}:<notebook name>" and f"{REPORT}:<notebook name>"
+LISTED = "listed"
+DOWNLOADED = "downloaded"
+REPROJECTED = "reprojected"
+MERGED = "merged"
+NOTEBOOK = "notebook"
+REPORT = "report"
+# notebook-free computations, named f"{COMPUTED}:<module>"
+COMPUTED = "computed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+    scene_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    fingerprint TEXT,
+    updated TEXT NOT NULL,
+    detail TEXT,
+    PRIMARY KEY (scene_id, stage)
+)
+"""
+
+
+def fingerprint(
+    paths: Union[List[Union[str, os.PathLike]], None] = None, values=None
+) -> str:
+    """
+    Takes:
+        paths: List of paths to files or directories whose contents are stage inputs.
+               Files are identified by path, size, and mtime; directories by their files.
+        values: any JSON-serializable stage inputs, e.g. URLs or notebook parameters
+
+    Returns: a hex digest that changes whenever any input changes
+    """
+    h = hashlib.sha256()
+    for pth in sorted(str(p) for p in paths or []):
+        pth = Path(pth)
+        files = sorted(p for p in pth.rglob("*") if p.is_file()) if pth.is_dir() else [pth]
+        for f in files:
+            st = f.stat() if f.exists() else None
+            h.update(
+                f"{f}:{st.st_size if st else -1}:{st.st_mtime_ns if st else -1}\n".encode()
+            )
+    h.update(json.dumps(values, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class RunManifest:
+    """
+    SQLite manifest of the stages completed for each scene of a site/orbit run.
+
+    Each (scene, stage) records its status and a fingerprint of the stage's inputs.
+    A stage is skipped on rerun when it completed with the same input fingerprint and
+    its outputs still exist, so a crashed or interrupted run resumes where it stopped.
+    """
+
+    def __init__(self, manifest_path: Union[str, os.PathLike]):
+        self.manifest_path = Path(manifest_path)
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as con:
+            con.execute(SCHEMA)
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        # commits on success, rolls back on error, and always closes the connection
+        con = sqlite3.connect(self.manifest_path, timeout=60)
+        con.row_factory = sqlite3.Row
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def is_done(
+        self,
+        scene_id: str,
+        stage: str,
+        fingerprint: Union[str, None] = None,
+        outputs: Union[List[Union[str, os.PathLike]], None] = None,
+    ) -> bool:
+        """
+        Takes:
+            scene_id: Sentinel-1 scene ID (or another run-level key, e.g. a stack name)
+            stage: stage name
+            fingerprint: fingerprint of the stage's current inputs (see fingerprint)
+            outputs: paths that must exist for the stage to count as done
+
+        Returns: True if the stage completed with the same input fingerprint and all
+                 of its outputs exist
+        """
+        with self._connection() as con:
+            row = con.execute(
+                "SELECT status, fingerprint FROM stages WHERE scene_id = ? AND stage = ?",
+                (scene_id, stage),
+            ).fetchone()
+        if row is None or row["status"] != "done":
+            return False
+        if fingerprint is not None and row["fingerprint"] != fingerprint:
+            return False
+        return all(Path(p).exists() for p in outputs or [])
+
+    def mark(
+        self,
+        scene_id: str,
+        stage: str,
+        fingerprint: Union[str, None] = None,
+        status: str = "done",
+        detail: Union[str, None] = None,
+    ):
+        """
+        Takes:
+            scene_id: Sentinel-1 scene ID (or another run-level key)
+            stage: stage name
+            fingerprint: fingerprint of the stage's inputs
+            status: "done" or "failed"
+            detail: optional note, e.g. an error message
+
+        Records the stage's status
+        """
+        with self._connection() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?)",
+                (scene_id, stage, status, fingerprint, datetime.now().isoformat(), detail),
+            )
+
+    def status(self, scene_id: Union[str, None] = None) -> Dict[str, Dict[str, Dict]]:
+        """
+        Takes: optional Sentinel-1 scene ID to limit the results to
+
+        Returns: Dictionary key: scene ID, value: Dictionary key: stage, value: record
+        """
+        query = "SELECT * FROM stages"
+        params = ()
+        if scene_id:
+            query += " WHERE scene_id = ?"
+            params = (scene_id,)
+        with self._connection() as con:
+            rows = con.execute(query + " ORDER BY scene_id, updated", params).fetchall()
+        status = {}
+        for row in rows:
+            status.setdefault(row["scene_id"], {})[row["stage"]] = dict(row)
+        return status
+
+    def reset(self, scene_id: Union[str, None] = None, stage: Union[str, None] = None):
+        """
+        Takes:
+            scene_id: optional Sentinel-1 scene ID whose stages to forget
+            stage: optional stage name to forget
+
+        Forgets the matching stages (all stages if neither is given), forcing them to rerun
+        """
+        clauses, params = [], []
+        if scene_id:
+            clauses.append("scene_id = ?")
+            params.append(scene_id)
+        if stage:
+            clauses.append("stage = ?")
+            params.append(stage)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._connection() as con:
+            con.execute(f"DELETE FROM stages{where}", params)
@@ -0,0 +1,281 @@
+import csv
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, List, Union
+
+import papermill as pm
+
+from util.instrument import span, spans_inherited
+from util.manifest import NOTEBOOK, RunManifest, fingerprint
+from util.reports import ReportQueue, render_report, report_is_current, report_stage
+
+
+def run_notebook(
+    notebook: Union[str, os.PathLike],
+    output: Union[str, os.PathLike],
+    parameters: Dict,
+    manifest: Union[RunManifest, None] = None,
+    scene_id: Union[str, None] = None,
+    inputs: Union[List[Union[str, os.PathLike]], None] = None,
+    log_output: bool = False,
+    report: bool = True,
+) -> Path:
+    """
+    Takes:
+        notebook: path to the notebook to execute
+        output: path of the executed notebook
+        parameters: papermill parameters
+        manifest: optional run manifest in which to track the notebook and report stages
+        scene_id: manifest key of the scene (or stack) the notebook runs on
+        inputs: paths to the data the notebook reads, used to fingerprint the stage
+        log_output: True to log cell outputs as the notebook runs
+        report: True to render the report once the notebook has run, False to leave
+                it to a ReportQueue or a later run
+
+    Executes the notebook with papermill and renders its HTML and PDF report, each
+    recorded as a span (see instrument.span). With a manifest, execution is skipped
+    when it already completed for the same notebook, parameters, and inputs.
+    Rendering is skipped when the executed notebook has not changed since its report
+    was rendered (see reports.report_is_current).
+
+    Returns: path to the executed notebook
+    """
+    name = Path(notebook).stem
+    output = Path(output)
+
+    notebook_stage = f"{NOTEBOOK}:{name}"
+    notebook_fp = fingerprint([notebook, *(inputs or [])], parameters)
+    if manifest is None or not manifest.is_done(
+        scene_id, notebook_stage, notebook_fp, outputs=[output]
+    ):
+        try:
+            # the kernel's spans nest under the notebook's
+            with span(notebook_stage, scene_id) as s, spans_inherited(s):
+                pm.execute_notebook(
+                    notebook,
+                    output,
+                    kernel_name="python3",
+                    parameters=parameters,
+                    log_output=log_output,
+                )
+        except Exception as e:
+            if manifest:
+                manifest.mark(scene_id, notebook_stage, notebook_fp, "failed", str(e))
+            raise
+        if manifest:
+            manifest.mark(scene_id, notebook_stage, notebook_fp)
+
+    stage = report_stage(notebook)
+    if report and not report_is_current(output, manifest, scene_id, stage):
+        report_fp = fingerprint([output])
+        with span(stage, scene_id):
+            render_report(output)
+        if manifest:
+            manifest.mark(scene_id, stage, report_fp)
+    return output
+
+
+def init_results_csv(csv_path: Union[str, os.PathLike], fields: List[str]) -> Path:
+    """
+    Takes:
+        csv_path: path to a results CSV that several notebooks append rows to
+        fields: header of the CSV
+
+    Writes the header if the CSV does not exist yet. Notebooks only append to an
+    existing CSV, so concurrent jobs cannot overwrite each other's rows.
+
+    Returns: path to the CSV
+    """
+    csv_path = Path(csv_path)
+    if not csv_path.exists():
+        csv_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(csv_path, "w") as csvfile:
+            csv.writer(csvfile).writerow(fields)
+    return csv_path
+
+
+def available_memory_gb() -> float:
+    """
+    Returns: memory available to new processes, in GB
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024**2
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1024**3
+
+
+def _run_job(
+    steps: List[Dict],
+    cwd: str,
+    manifest_path: Union[str, None],
+    scene_id: str,
+    log_path: Union[str, None],
+    report: bool = True,
+):
+    """
+    Runs the notebooks of a job in order (see run_notebook_jobs)
+    """
+    if log_path:
+        # capture the output of this process and its subprocesses (nbconvert, pandoc)
+        log = open(log_path, "a", buffering=1)
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        sys.stdout = sys.stderr = log
+        # papermill logs the cell outputs
+        logging.basicConfig(level=logging.INFO, stream=log)
+    os.chdir(cwd)
+    manifest = RunManifest(manifest_path) if manifest_path else None
+    for step in steps:
+        print(f"Running {step['notebook']} for {scene_id}", flush=True)
+        run_notebook(
+            **step,
+            manifest=manifest,
+            scene_id=scene_id,
+            log_output=bool(log_path),
+            report=report,
+        )
+
+
+def start_job(
+    steps: List[Dict],
+    cwd: Union[str, os.PathLike],
+    manifest: Union[RunManifest, None],
+    scene_id: str,
+    log_path: Union[str, os.PathLike],
+    report: bool = True,
+) -> multiprocessing.Process:
+    """
+    Takes:
+        steps: notebook steps of the job (see run_notebook_jobs)
+        cwd: working directory of the notebooks
+        manifest: optional run manifest in which to track the notebook and report stages
+        scene_id: manifest key of the scene (or stack) the job runs on
+        log_path: path of the job's log
+        report: True to render each report right after its notebook
+
+    Starts the job in its own process, with its own kernels and working directory,
+    its output captured in its log
+
+    Returns: the started process; its exit code is 0 once the job succeeded
+    """
+    # spawn, so no job inherits another job's state (or locks held by its threads)
+    process = multiprocessing.get_context("spawn").Process(
+        target=_run_job,
+        args=(
+            steps,
+            str(Path(cwd).resolve()),
+            str(manifest.manifest_path) if manifest else None,
+            scene_id,
+            str(log_path),
+            report,
+        ),
+        name=scene_id,
+    )
+    process.start()
+    return process
+
+
+def _queue_reports(queue: Union[ReportQueue, None], steps: List[Dict], scene_id: str):
+    if queue is None:
+        return
+    for step in steps:
+        queue.submit(step["output"], scene_id, step["notebook"])
+
+
+def run_notebook_jobs(
+    jobs: Dict[str, List[Dict]],
+    cwd: Union[str, os.PathLike],
+    manifest: Union[RunManifest, None] = None,
+    n_jobs: int = 1,
+    log_dir: Union[str, os.PathLike, None] = None,
+    job_memory_gb: float = 0,
+    reports: str = "sync",
+    report_workers: int = 2,
+) -> Dict[str, int]:
+    """
+    Takes:
+        jobs: Dictionary of independent jobs by manifest key (scene ID or stack name).
+              Each job is a list of steps run in order, each a dictionary of the
+              "notebook", "output", "parameters", and "inputs" of run_notebook.
+        cwd: working directory of the notebooks
+        manifest: optional run manifest in which to track the notebook and report stages
+        n_jobs: number of jobs to run concurrently
+        log_dir: directory of the per-job logs (<manifest key>.log) when n_jobs > 1
+        job_memory_gb: memory used by one job, in GB. Caps n_jobs to the jobs fitting
+                       in the available memory, and a job is only started while this
+                       much memory is available (or no other job runs).
+        reports: "sync" to render each report in its job right after its notebook,
+                 "deferred" to render the reports of each finished job in a
+                 background ReportQueue while other jobs run, "none" to skip
+                 rendering (see reports.REPORT_MODES)
+        report_workers: number of reports rendered concurrently when deferred
+
+    With n_jobs == 1, runs the jobs one after the other in this process, stopping at
+    the first failure. Otherwise runs up to n_jobs jobs concurrently, each in its own
+    process with its own kernels and working directory, its output captured in its
+    log. A failed or killed job does not stop the other jobs.
+
+    Returns: Dictionary of the exit code of each job by manifest key (0: success)
+    """
+    cwd = str(Path(cwd).resolve())
+    manifest_path = str(manifest.manifest_path) if manifest else None
+    report = reports == "sync"
+    queue = ReportQueue(manifest, report_workers) if reports == "deferred" else None
+    with queue or nullcontext():
+        if n_jobs <= 1:
+            for scene_id, steps in jobs.items():
+                start = os.getcwd()
+                try:
+                    _run_job(steps, cwd, manifest_path, scene_id, None, report)
+                finally:
+                    os.chdir(start)
+                _queue_reports(queue, steps, scene_id)
+            return {scene_id: 0 for scene_id in jobs}
+
+        if job_memory_gb:
+            fit = max(int(available_memory_gb() // job_memory_gb), 1)
+            if fit < n_jobs:
+                print(f"Running {fit} jobs at a time to fit in the available memory")
+                n_jobs = fit
+
+        log_dir = Path(log_dir or Path(cwd) / "logs")
+        log_dir.mkdir(parents=True, exist_ok=True)
+        pending = list(jobs.items())
+        running = {}
+        exit_codes = {}
+        while pending or running:
+            for scene_id, process in list(running.items()):
+                if process.exitcode is not None:
+                    code = exit_codes[scene_id] = process.exitcode
+                    status = "done" if code == 0 else f"failed ({code})"
+                    print(f"{scene_id}: {status}, log: {log_dir / f'{scene_id}.log'}")
+                    del running[scene_id]
+                    if code == 0:
+                        _queue_reports(queue, jobs[scene_id], scene_id)
+            # start at most one job per poll, so its memory use shows before the next
+            # check
+            if (
+                pending
+                and len(running) < n_jobs
+                and (not running or available_memory_gb() >= job_memory_gb)
+            ):
+                scene_id, steps = pending.pop(0)
+                running[scene_id] = start_job(
+                    steps, cwd, manifest, scene_id, log_dir / f"{scene_id}.log", report
+                )
+            time.sleep(1)
+
+    failed = [scene_id for scene_id, code in exit_codes.items() if code != 0]
+    print(f"{len(jobs) - len(failed)} of {len(jobs)} jobs succeeded")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+    return exit_codes
@@ -0,0 +1,188 @@
+import os
+import queue
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, List, Tuple, Union
+
+import requests
+
+from util.instrument import count, in_current_span
+
+# seconds between free space checks while downloads are paused (see _wait_for_disk)
+DISK_POLL_INTERVAL = 5
+
+
+def http_download(url: str, dest_dir: Union[str, os.PathLike]) -> Path:
+    """
+    Takes:
+        url: URL of a file served over plain HTTP(S), e.g. by a local
+             `python -m http.server` stand-in for the ASF DAAC
+        dest_dir: directory in which to save the file
+
+    Downloads the file to a partial path and renames it once complete
+
+    Returns: path to the downloaded file
+    """
+    pth = Path(dest_dir) / url.split("/")[-1]
+    partial = pth.with_name(f"{pth.name}.{os.getpid()}.{threading.get_ident()}.part")
+    with requests.get(url, stream=True) as r:
+        r.raise_for_status()
+        with open(partial, "wb") as f:
+            for chunk in r.iter_content(chunk_size=2**20):
+                f.write(chunk)
+                count("downloaded_bytes", len(chunk))
+    partial.rename(pth)
+    return pth
+
+
+def earthaccess_download(url: str, dest_dir: Union[str, os.PathLike]) -> Path:
+    """
+    Takes:
+        url: URL of a file hosted by an Earthdata DAAC
+        dest_dir: directory in which to save the file
+
+    Returns: path to the downloaded file
+    """
+    import earthaccess
+
+    earthaccess.download(url, dest_dir)
+    pth = Path(dest_dir) / url.split("/")[-1]
+    count("downloaded_bytes", pth.stat().st_size)
+    return pth
+
+
+def destination_paths(
+    url_dirs: Iterable[Tuple[str, Union[str, os.PathLike]]]
+) -> List[Path]:
+    """
+    Takes: (URL, destination directory) pairs
+
+    Returns: path each URL is downloaded to (see download_files), e.g. to check that
+             the files of a completed download stage still exist
+    """
+    return [Path(dest_dir) / url.split("/")[-1] for url, dest_dir in url_dirs]
+
+
+def download_files(
+    url_dirs: Iterable[Tuple[str, Union[str, os.PathLike]]],
+    download: Callable[[str, Union[str, os.PathLike]], Path] = earthaccess_download,
+    max_workers: int = 4,
+    skip_existing: bool = True,
+) -> List[Path]:
+    """
+    Takes:
+        url_dirs: (URL, destination directory) pairs
+        download: function downloading a URL into a directory and returning the path
+                  (earthaccess_download, http_download, ...)
+        max_workers: number of files to download concurrently
+        skip_existing: True to skip files that already exist in their destination
+
+    Downloads within the span open in the calling thread (see instrument.span)
+
+    Returns: paths to the downloaded files, in the order of url_dirs
+    """
+    url_dirs = list(url_dirs)
+
+    @in_current_span
+    def _download(url_dir):
+        url, dest_dir = url_dir
+        (pth,) = destination_paths([url_dir])
+        # a link to an evicted burst store product does not exist (see burst_store)
+        if skip_existing and pth.exists():
+            return pth
+        return download(url, dest_dir)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_download, url_dirs))
+
+
+def _wait_for_disk(
+    pth: Union[str, os.PathLike],
+    min_free_bytes: int,
+    pending: queue.Queue,
+    stop: threading.Event,
+):
+    """
+    Blocks while the file system holding `pth` has less than `min_free_bytes` free and
+    downloaded scenes are still waiting to be processed (processing them may free space)
+    """
+    pth = Path(pth)
+    while not pth.exists():
+        pth = pth.parent
+    while (
+        not stop.is_set()
+        and shutil.disk_usage(pth).free < min_free_bytes
+        and pending.unfinished_tasks
+    ):
+        stop.wait(DISK_POLL_INTERVAL)
+
+
+def run_scene_pipeline(
+    scenes: Iterable,
+    download: Callable,
+    process: Callable,
+    prefetch: int = 1,
+    disk_path: Union[str, os.PathLike, None] = None,
+    min_free_gb: float = 0,
+):
+    """
+    Takes:
+        scenes: scenes (e.g. Sentinel-1 scene IDs) to download and process, in order
+        download: function of a scene that downloads its data and returns whatever
+                  `process` needs, or None to skip the scene
+        process: function of a scene and its download result (e.g. reproject + mosaic)
+        prefetch: maximum number of downloaded scenes waiting to be processed
+        disk_path: path on the file system receiving the downloads
+        min_free_gb: pause downloading while less than this many GB are free on
+                     `disk_path` and downloaded scenes are waiting to be processed
+
+    Downloads scene N+1 in a background thread while scene N is processed in the
+    calling thread. Downloads stay at most `prefetch` scenes ahead of processing,
+    bounding the disk used by unprocessed bursts. An exception in either stage
+    stops the pipeline and is re-raised in the calling thread.
+    """
+    pending = queue.Queue(maxsize=max(prefetch, 1))
+    stop = threading.Event()
+    done = object()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _producer():
+        try:
+            for scene in scenes:
+                if stop.is_set():
+                    return
+                if disk_path and min_free_gb:
+                    _wait_for_disk(disk_path, min_free_gb * 1024**3, pending, stop)
+                result = download(scene)
+                if result is not None:
+                    _put((scene, result, None))
+        except Exception as e:
+            _put((None, None, e))
+        finally:
+            _put((done, None, None))
+
+    producer = threading.Thread(target=_producer, daemon=True)
+    producer.start()
+    try:
+        while True:
+            scene, result, error = pending.get()
+            try:
+                if error is not None:
+                    raise error
+                if scene is done:
+                    break
+                process(scene, result)
+            finally:
+                pending.task_done()
+    finally:
+        stop.set()
+        producer.join()
@@ -0,0 +1,255 @@
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Union
+
+from osgeo import gdal
+
+gdal.UseExceptions()
+
+DEFAULT_INDEX_PATH = Path(
+    os.environ.get(
+        "CALVAL_RTC_RASTER_INDEX",
+        Path.home() / ".cache/calval-RTC/raster_metadata.sqlite",
+    )
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS raster_metadata (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    epsg TEXT,
+    geotransform TEXT,
+    res REAL,
+    nodata REAL,
+    width INTEGER,
+    height INTEGER,
+    band_count INTEGER,
+    dtype TEXT,
+    upper_left TEXT,
+    lower_right TEXT
+)
+"""
+
+JSON_COLUMNS = ["geotransform", "upper_left", "lower_right"]
+
+
+def read_raster_header(img_path: Union[os.PathLike, str]) -> Dict:
+    """
+    Takes: a string or os.PathLike path to a raster
+
+    Returns: Dictionary of header metadata collected from a single open of the raster:
+             epsg, geotransform, res, nodata, width, height, band_count, dtype,
+             upper_left, and lower_right (corners are None when there is no geotransform)
+    """
+    f = gdal.Open(str(img_path))
+    band = f.GetRasterBand(1)
+
+    epsg = None
+    srs = f.GetSpatialRef()
+    if srs is not None and srs.GetAuthorityName(None) == "EPSG":
+        epsg = srs.GetAuthorityCode(None)
+
+    gt = f.GetGeoTransform(can_return_null=True)
+    if gt:
+        width, height = f.RasterXSize, f.RasterYSize
+        upper_left = [gt[0], gt[3]]
+        lower_right = [
+            gt[0] + gt[1] * width + gt[2] * height,
+            gt[3] + gt[4] * width + gt[5] * height,
+        ]
+    else:
+        upper_left = lower_right = None
+
+    return {
+        "epsg": epsg,
+        "geotransform": list(gt) if gt else None,
+        "res": gt[1] if gt else None,
+        "nodata": band.GetNoDataValue(),
+        "width": f.RasterXSize,
+        "height": f.RasterYSize,
+        "band_count": f.RasterCount,
+        "dtype": gdal.GetDataTypeName(band.DataType),
+        "upper_left": upper_left,
+        "lower_right": lower_right,
+    }
+
+
+class RasterIndex:
+    """
+    Persistent SQLite index of raster header metadata, keyed by path, size, and mtime.
+
+    A raster's header is read at most once per on-disk version of the file. Entries
+    whose size or mtime no longer match the file (e.g. after reproject_data rewrites
+    a burst) are re-read transparently. NaN no-data values are stored as NULL.
+    """
+
+    def __init__(self, index_path: Union[os.PathLike, str] = DEFAULT_INDEX_PATH):
+        self.index_path = Path(index_path)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as con:
+            con.execute(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections may not be shared between threads or forked processes
+        con = getattr(self._local, "con", None)
+        if con is None or self._local.pid != os.getpid():
+            con = sqlite3.connect(self.index_path, timeout=60)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.row_factory = sqlite3.Row
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return con
+
+    @staticmethod
+    def _indexed(img_path: Union[os.PathLike, str]) -> bool:
+        # GDAL virtual file systems and subdataset strings (e.g. HDF5:"file.h5"://path)
+        # are not plain files and have no stable size/mtime to key on
+        return not str(img_path).startswith("/vsi") and os.path.isfile(img_path)
+
+    @classmethod
+    def _key(cls, img_path: Union[os.PathLike, str]) -> str:
+        return str(Path(img_path).resolve()) if cls._indexed(img_path) else str(img_path)
+
+    @staticmethod
+    def _row_to_record(row: sqlite3.Row) -> Dict:
+        record = dict(row)
+        for col in JSON_COLUMNS:
+            record[col] = json.loads(record[col]) if record[col] else None
+        return record
+
+    def _write(self, records: List[Dict]):
+        rows = []
+        for r in records:
+            r = dict(r)
+            for col in JSON_COLUMNS:
+                r[col] = json.dumps(r[col]) if r[col] is not None else None
+            rows.append(r)
+        with self._connection() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO raster_metadata VALUES ("
+                ":path, :size, :mtime_ns, :epsg, :geotransform, :res, :nodata, "
+                ":width, :height, :band_count, :dtype, :upper_left, :lower_right)",
+                rows,
+            )
+
+    def get(self, img_path: Union[os.PathLike, str]) -> Dict:
+        """
+        Takes: a string or os.PathLike path to a raster
+
+        Returns: the raster's metadata record, reading its header only if it is not
+                 indexed or has changed since it was indexed
+        """
+        if not self._indexed(img_path):
+            return read_raster_header(img_path)
+        return self.scan([img_path])[self._key(img_path)]
+
+    def scan(
+        self, img_paths: List[Union[os.PathLike, str]], max_workers: int = 8
+    ) -> Dict[str, Dict]:
+        """
+        Takes:
+            img_paths: List of string or os.PathLike paths to rasters
+            max_workers: number of threads used to read stale or missing headers
+
+        Returns: Dictionary key: resolved path (or the dataset string of a path that is
+                 not a plain file), value: metadata record, in input order; repeated
+                 paths have a single entry (see records)
+
+        Looks all paths up in a single query and reads only the headers that are
+        missing or out of date, writing them back in a single transaction. The headers
+        of paths that are not plain files are read without being indexed.
+        """
+        stats = {}
+        unindexed = {}
+        order = []
+        for pth in img_paths:
+            key = self._key(pth)
+            order.append(key)
+            if not self._indexed(pth):
+                unindexed[key] = None
+                continue
+            st = os.stat(key)
+            stats[key] = (st.st_size, st.st_mtime_ns)
+
+        records = {}
+        con = self._connection()
+        keys = list(stats)
+        # stay under SQLite's host parameter limit
+        for i in range(0, len(keys), 500):
+            chunk = keys[i : i + 500]
+            rows = con.execute(
+                "SELECT * FROM raster_metadata "
+                f"WHERE path IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            for row in rows:
+                if (row["size"], row["mtime_ns"]) == stats[row["path"]]:
+                    records[row["path"]] = self._row_to_record(row)
+
+        stale = [k for k in keys if k not in records]
+        if stale:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                headers = list(executor.map(read_raster_header, stale))
+            new_records = [
+                {
+                    "path": k,
+                    "size": stats[k][0],
+                    "mtime_ns": stats[k][1],
+                    **header,
+                }
+                for k, header in zip(stale, headers)
+            ]
+            self._write(new_records)
+            records.update({r["path"]: r for r in new_records})
+        if unindexed:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                records.update(zip(unindexed, executor.map(read_raster_header, unindexed)))
+        return {k: records[k] for k in order}
+
+    def records(self, img_paths: List[Union[os.PathLike, str]]) -> List[Dict]:
+        """
+        Takes: List of string or os.PathLike paths to rasters
+
+        Returns: List of the metadata records of the rasters (see scan), one per path,
+                 in input order, including repeated paths
+        """
+        scanned = self.scan(img_paths)
+        return [scanned[self._key(pth)] for pth in img_paths]
+
+    def scan_directory(
+        self, directory: Union[os.PathLike, str], pattern: str = "**/*.tif"
+    ) -> Dict[str, Dict]:
+        """
+        Takes:
+            directory: a string or os.PathLike path to a directory of rasters
+            pattern: glob pattern, relative to `directory`, selecting the rasters to index
+
+        Returns: Dictionary key: resolved path, value: metadata record
+        """
+        return self.scan(list(Path(directory).glob(pattern)))
+
+    def invalidate(self, img_path: Union[os.PathLike, str]):
+        """
+        Takes: a string or os.PathLike path to a raster
+
+        Removes the raster's entry from the index
+        """
+        with self._connection() as con:
+            con.execute(
+                "DELETE FROM raster_metadata WHERE path = ?", (self._key(img_path),)
+            )
+
+
+@lru_cache
+def get_raster_index(index_path: Union[os.PathLike, str] = DEFAULT_INDEX_PATH) -> RasterIndex:
+    """
+    Returns: a shared RasterIndex for `index_path`
+    """
+    return RasterIndex(index_path)
@@ -0,0 +1,301 @@
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import StringIO
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import requests
+from osgeo import gdal, osr
+
+gdal.UseExceptions()
+
+CR_URL = "https://uavsar.jpl.nasa.gov/cgi-bin/corner-reflectors.pl"
+# UAVSAR corner reflector projects by CalVal site (see absolute_location_evaluation.ipynb)
+CR_PROJECTS = {
+    "California": "rosamond_plate_location",
+    "Oklahoma": "nisar_plate_location",
+}
+
+
+def vsicurl_options(
+    cache_mb: int = 64, chunk_kb: int = 16, cookie_file: Union[str, None] = None
+) -> Dict[str, str]:
+    """
+    Takes:
+        cache_mb: size of the block cache shared by all remote files, in MB
+        chunk_kb: size of each range request, in KB
+        cookie_file: file storing the Earthdata login cookies
+                     (default: ~/.calval_rtc_cookies.txt)
+
+    Returns: GDAL config options for reading OPERA products over /vsicurl/ with range
+             requests. Downloaded blocks are kept in an LRU cache, so windows sharing
+             a block (and GeoTIFF headers read again) are fetched once. Earthdata
+             credentials are read from ~/.netrc.
+    """
+    if cookie_file is None:
+        cookie_file = str(Path.home() / ".calval_rtc_cookies.txt")
+    return {
+        "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+        "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.tiff",
+        "CPL_VSIL_CURL_CHUNK_SIZE": str(chunk_kb * 1024),
+        "CPL_VSIL_CURL_CACHE_SIZE": str(cache_mb * 1024**2),
+        "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+        "GDAL_HTTP_MULTIPLEX": "YES",
+        "GDAL_HTTP_NETRC": "YES",
+        "GDAL_HTTP_COOKIEFILE": cookie_file,
+        "GDAL_HTTP_COOKIEJAR": cookie_file,
+        "GDAL_HTTP_MAX_RETRY": "5",
+        "GDAL_HTTP_RETRY_DELAY": "2",
+    }
+
+
+def configure_remote_reads(**kwargs):
+    """
+    Takes: keyword arguments of vsicurl_options
+
+    Sets the vsicurl_options process-wide, for all threads
+    """
+    for key, value in vsicurl_options(**kwargs).items():
+        gdal.SetConfigOption(key, value)
+
+
+def vsicurl_path(url: str) -> str:
+    """
+    Takes: URL of a GeoTIFF served with HTTP range requests
+
+    Returns: GDAL path reading the GeoTIFF remotely
+    """
+    return f"/vsicurl/{url}"
+
+
+def get_corner_reflectors(site: str, acquisition_time: datetime) -> pd.DataFrame:
+    """
+    Takes:
+        site: CalVal site with a UAVSAR corner reflector array ("California", "Oklahoma")
+        acquisition_time: Sentinel-1 acquisition time (see geo.get_acquisition_time)
+
+    Returns: corner reflector catalog at the acquisition time, with "ID", "lat", and
+             "lon" columns
+    """
+    if site not in CR_PROJECTS:
+        raise ValueError(f"No corner reflector catalog for site: {site}")
+    date_ = acquisition_time.strftime("%Y-%m-%d+%H!%M")
+    res = requests.get(f"{CR_URL}?date={date_}&project={CR_PROJECTS[site]}")
+    res.raise_for_status()
+    df = pd.read_csv(StringIO(res.text))
+    df.rename(
+        columns={
+            '   "Corner ID"': "ID",
+            "Latitude (deg)": "lat",
+            "Longitude (deg)": "lon",
+        },
+        inplace=True,
+    )
+    return df[["ID", "lat", "lon"]]
+
+
+def get_footprint(url: str) -> Dict:
+    """
+    Takes: URL of an OPERA RTC GeoTIFF
+
+    Reads only the GeoTIFF header
+
+    Returns: Dictionary with keys "epsg", "geotransform", "width", "height", "nodata"
+    """
+    f = gdal.Open(vsicurl_path(url))
+    srs = f.GetSpatialRef()
+    footprint = {
+        "epsg": srs.GetAuthorityCode(None),
+        "geotransform": f.GetGeoTransform(),
+        "width": f.RasterXSize,
+        "height": f.RasterYSize,
+        "nodata": f.GetRasterBand(1).GetNoDataValue(),
+    }
+    f = None
+    return footprint
+
+
+def get_footprints(urls: List[str], max_workers: int = 8) -> Dict[str, Dict]:
+    """
+    Takes:
+        urls: URLs of OPERA RTC GeoTIFFs
+        max_workers: number of headers to read concurrently
+
+    Returns: Dictionary of footprints (see get_footprint) by URL
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(urls, executor.map(get_footprint, urls)))
+
+
+def _transform_points(
+    points: List[Tuple[float, float]], src_epsg: str, dst_epsg: str
+) -> np.ndarray:
+    src = osr.SpatialReference()
+    src.ImportFromEPSG(int(src_epsg))
+    src.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    dst = osr.SpatialReference()
+    dst.ImportFromEPSG(int(dst_epsg))
+    dst.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(src, dst)
+    return np.array([transform.TransformPoint(x, y)[:2] for x, y in points])
+
+
+def _footprint_bounds(footprint: Dict) -> Tuple[float, float, float, float]:
+    ulx, x_res, _, uly, _, y_res = footprint["geotransform"]
+    lrx = ulx + footprint["width"] * x_res
+    lry = uly + footprint["height"] * y_res
+    return ulx, lry, lrx, uly
+
+
+def bursts_covering_points(
+    footprints: Dict[str, Dict], points: List[Tuple[float, float]], buffer: float = 0
+) -> Dict[str, List[int]]:
+    """
+    Takes:
+        footprints: Dictionary of burst footprints by URL (see get_footprints)
+        points: (lon, lat) points, e.g. corner reflector locations
+        buffer: distance, in the units of the burst projections, within which a point
+                counts as covered (e.g. the half width of the windows read around it)
+
+    Returns: Dictionary of the indices of the points each burst covers, by URL,
+             for the bursts covering at least one point
+    """
+    covering = {}
+    for url, footprint in footprints.items():
+        xy = _transform_points(points, "4326", footprint["epsg"])
+        minx, miny, maxx, maxy = _footprint_bounds(footprint)
+        inside = (
+            (xy[:, 0] >= minx - buffer)
+            & (xy[:, 0] <= maxx + buffer)
+            & (xy[:, 1] >= miny - buffer)
+            & (xy[:, 1] <= maxy + buffer)
+        )
+        if inside.any():
+            covering[url] = list(np.flatnonzero(inside))
+    return covering
+
+
+def get_remote_mosaic_grid(footprints: Dict[str, Dict]) -> Dict:
+    """
+    Takes: Dictionary of burst footprints by URL (see get_footprints)
+
+    Returns: Dictionary describing the grid, in the predominant projection of the
+             bursts and aligned to their resolution, that covers the union of all
+             burst footprints. Keys: "epsg", "geotransform", "width", "height",
+             "nodata"
+    """
+    epsgs = Counter(footprint["epsg"] for footprint in footprints.values())
+    epsg = max(epsgs, key=epsgs.get)
+    first = next(iter(footprints.values()))
+    res = first["geotransform"][1]
+
+    corners = []
+    for footprint in footprints.values():
+        minx, miny, maxx, maxy = _footprint_bounds(footprint)
+        xy = [(minx, miny), (minx, maxy), (maxx, miny), (maxx, maxy)]
+        if footprint["epsg"] != epsg:
+            xy = _transform_points(xy, footprint["epsg"], epsg)
+        corners.extend(xy)
+    corners = np.array(corners)
+    minx = np.floor(corners[:, 0].min() / res) * res
+    maxx = np.ceil(corners[:, 0].max() / res) * res
+    miny = np.floor(corners[:, 1].min() / res) * res
+    maxy = np.ceil(corners[:, 1].max() / res) * res
+
+    return {
+        "epsg": epsg,
+        "geotransform": (minx, res, 0.0, maxy, 0.0, -res),
+        "width": int(round((maxx - minx) / res)),
+        "height": int(round((maxy - miny) / res)),
+        "nodata": first["nodata"],
+    }
+
+
+def write_point_windows(
+    urls: List[str],
+    points: List[Tuple[float, float]],
+    output: Union[str, os.PathLike],
+    half_size: int = 40,
+    max_workers: int = 8,
+) -> Dict:
+    """
+    Takes:
+        urls: URLs of the bursts of a scene
+        points: (lon, lat) points, e.g. corner reflector locations
+        output: path of the GeoTiff to write
+        half_size: half width, in pixels, of the window read around each point
+        max_workers: number of burst headers to read concurrently
+
+    Reads the burst headers, finds the bursts covering the points, and reads only the
+    windows around the points from those bursts, reprojected to the mosaic grid (see
+    get_remote_mosaic_grid). Writes them to a sparse, tiled GeoTiff on the full
+    mosaic grid, so the output can be read like a mosaic of the scene: pixels outside
+    the windows are no-data and take no space on disk.
+
+    Returns: Dictionary of the indices of the points each burst's windows cover,
+             by URL (see bursts_covering_points)
+    """
+    footprints = get_footprints(urls, max_workers=max_workers)
+    grid = get_remote_mosaic_grid(footprints)
+    res = grid["geotransform"][1]
+    # bursts overlapping the windows, not only those containing the points
+    covering = bursts_covering_points(footprints, points, buffer=(half_size + 1) * res)
+    nodata = grid["nodata"] if grid["nodata"] is not None else np.nan
+
+    output = Path(output)
+    if output.exists():
+        output.unlink()
+    dst = gdal.GetDriverByName("GTiff").Create(
+        str(output),
+        grid["width"],
+        grid["height"],
+        1,
+        gdal.GDT_Float32,
+        options=["TILED=YES", "SPARSE_OK=TRUE", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"],
+    )
+    dst.SetGeoTransform(grid["geotransform"])
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(int(grid["epsg"]))
+    dst.SetProjection(srs.ExportToWkt())
+    band = dst.GetRasterBand(1)
+    band.SetNoDataValue(nodata)
+
+    ulx, _, _, uly, _, _ = grid["geotransform"]
+    xy = _transform_points(points, "4326", grid["epsg"])
+    for i, (x, y) in enumerate(xy):
+        sources = [url for url, idx in covering.items() if i in idx]
+        if not sources:
+            continue
+        col = int((x - ulx) / res)
+        row = int((uly - y) / res)
+        x0 = max(col - half_size, 0)
+        y0 = max(row - half_size, 0)
+        x1 = min(col + half_size + 1, grid["width"])
+        y1 = min(row + half_size + 1, grid["height"])
+        if x0 >= x1 or y0 >= y1:
+            continue
+        window = gdal.Warp(
+            "",
+            [vsicurl_path(url) for url in sources],
+            format="MEM",
+            dstSRS=f"EPSG:{grid['epsg']}",
+            outputBounds=(ulx + x0 * res, uly - y1 * res, ulx + x1 * res, uly - y0 * res),
+            xRes=res,
+            yRes=res,
+            srcNodata=nodata,
+            dstNodata=nodata,
+            outputType=gdal.GDT_Float32,
+        )
+        data = window.GetRasterBand(1).ReadAsArray()
+        window = None
+        # keep pixels already written by overlapping windows
+        existing = band.ReadAsArray(x0, y0, x1 - x0, y1 - y0)
+        empty = np.isnan(data) if np.isnan(nodata) else data == nodata
+        band.WriteArray(np.where(empty, existing, data), x0, y0)
+    band = None
+    dst = None
+    return covering
@@ -0,0 +1,282 @@
+import multiprocessing
+import os
+import subprocess
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+from nbconvert import HTMLExporter
+
+from util.instrument import span, traced
+from util.manifest import REPORT, RunManifest, fingerprint
+
+try:
+    import weasyprint
+except (ImportError, OSError):  # render PDFs with the pandoc CLI instead
+    weasyprint = None
+
+# sync: render each report right after its notebook; deferred: render in a background
+# queue while later notebooks run; none: skip rendering (a later run renders them)
+REPORT_MODES = ["sync", "deferred", "none"]
+
+# the exporter loads its templates once per process
+_exporter = None
+
+
+@traced("render_html")
+def render_html(output: Union[str, os.PathLike]) -> Path:
+    """
+    Takes: path to an executed notebook
+
+    Converts the notebook to HTML in this process, like `jupyter nbconvert --to html`
+
+    Returns: path to the HTML report
+    """
+    global _exporter
+    if _exporter is None:
+        _exporter = HTMLExporter()
+    body, _ = _exporter.from_filename(str(output))
+    output_html = Path(output).with_suffix(".html")
+    output_html.write_text(body, encoding="utf-8")
+    return output_html
+
+
+@traced("render_pdf")
+def render_pdf(output_html: Union[str, os.PathLike]) -> Path:
+    """
+    Takes: path to an HTML report
+
+    Renders the HTML with WeasyPrint in this process, or with
+    `pandoc --pdf-engine=weasyprint` when the weasyprint package is not installed
+
+    Returns: path to the PDF report
+    """
+    output_html = Path(output_html)
+    output_pdf = output_html.with_suffix(".pdf")
+    if weasyprint is not None:
+        weasyprint.HTML(filename=str(output_html)).write_pdf(str(output_pdf))
+    else:
+        subprocess.run(
+            ["pandoc", str(output_html), "-o", str(output_pdf), "--pdf-engine=weasyprint"],
+            check=True,
+        )
+    return output_pdf
+
+
+def render_report(output: Union[str, os.PathLike]) -> Path:
+    """
+    Takes: path to an executed notebook
+
+    Renders the notebook's HTML and PDF reports
+
+    Returns: path to the PDF report
+    """
+    return render_pdf(render_html(output))
+
+
+def render_batch(
+    outputs: List[str],
+    scene_ids: Union[List[Union[str, None]], None] = None,
+    stages: Union[List[str], None] = None,
+) -> List[Union[str, None]]:
+    """
+    Takes:
+        outputs: paths to executed notebooks
+        scene_ids: scene (or stack) of each notebook, to label its span
+        stages: manifest stage of each report (see report_stage), to name its span
+
+    Renders the reports of the notebooks one after the other, in one process, so the
+    templates and fonts are loaded once for the batch
+
+    Returns: None for each rendered report, the error otherwise
+    """
+    scene_ids = scene_ids or [None] * len(outputs)
+    stages = stages or [report_stage(output) for output in outputs]
+    errors = []
+    for output, scene_id, stage in zip(outputs, scene_ids, stages):
+        try:
+            with span(stage, scene_id):
+                render_report(output)
+            errors.append(None)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+    return errors
+
+
+def report_stage(notebook: Union[str, os.PathLike]) -> str:
+    """
+    Takes: path to a notebook
+
+    Returns: manifest stage of the reports of the notebook's runs
+    """
+    return f"{REPORT}:{Path(notebook).stem}"
+
+
+def report_is_current(
+    output: Union[str, os.PathLike],
+    manifest: Union[RunManifest, None] = None,
+    scene_id: Union[str, None] = None,
+    stage: Union[str, None] = None,
+) -> bool:
+    """
+    Takes:
+        output: path to an executed notebook
+        manifest: optional run manifest tracking the report stage
+        scene_id: manifest key of the scene (or stack) the notebook ran on
+        stage: manifest stage of the report
+
+    Returns: True if the PDF report was rendered from the notebook as it is now: per
+             the manifest's fingerprint of the notebook, or without a manifest, when
+             the PDF is newer than the notebook
+    """
+    output = Path(output)
+    output_pdf = output.with_suffix(".pdf")
+    if manifest is not None:
+        return manifest.is_done(
+            scene_id, stage, fingerprint([output]), outputs=[output_pdf]
+        )
+    return (
+        output_pdf.exists() and output_pdf.stat().st_mtime >= output.stat().st_mtime
+    )
+
+
+def render_reports(
+    steps: List[Dict],
+    manifest: Union[RunManifest, None] = None,
+    scene_id: Union[str, None] = None,
+    executor: Union[ProcessPoolExecutor, None] = None,
+) -> Dict[str, str]:
+    """
+    Takes:
+        steps: notebook steps of a job, each with the "notebook" and its "output"
+               (see notebooks.run_notebook_jobs)
+        manifest: optional run manifest in which to track the report stages
+        scene_id: manifest key of the scene (or stack) the notebooks ran on
+        executor: optional process pool rendering the reports (default: this process)
+
+    Renders the reports of the job's notebooks as one batch (see render_batch),
+    skipping the reports that are current (see report_is_current), and waits for them
+
+    Returns: Dictionary of the error of each failed report by notebook output
+    """
+    batch = []
+    for step in steps:
+        stage = report_stage(step["notebook"])
+        if not report_is_current(step["output"], manifest, scene_id, stage):
+            batch.append((stage, str(step["output"]), fingerprint([step["output"]])))
+    if not batch:
+        return {}
+    stages, outputs, fps = zip(*batch)
+    args = (list(outputs), [scene_id] * len(batch), list(stages))
+    if executor:
+        errors = executor.submit(render_batch, *args).result()
+    else:
+        errors = render_batch(*args)
+
+    failed = {}
+    for stage, output, fp, error in zip(stages, outputs, fps, errors):
+        if error:
+            failed[output] = error
+        if manifest:
+            manifest.mark(scene_id, stage, fp, "failed" if error else "done", error)
+    return failed
+
+
+class ReportQueue:
+    """
+    Background pool rendering the reports of executed notebooks.
+
+    Notebooks are queued as they finish and rendered in batches by worker processes,
+    so HTML and PDF rendering stays off the critical path of the notebook jobs.
+    Reports already rendered from the current notebook are skipped. Use as a context
+    manager, or call join() to wait for every queued report.
+    """
+
+    def __init__(
+        self,
+        manifest: Union[RunManifest, None] = None,
+        max_workers: int = 2,
+        batch_size: int = 4,
+    ):
+        """
+        manifest: optional run manifest in which to track the report stages
+        max_workers: number of reports rendered concurrently
+        batch_size: number of queued reports sent to a worker at once
+        """
+        self.manifest = manifest
+        self.batch_size = batch_size
+        self._executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self._lock = threading.Lock()
+        # (scene_id, stage, output, notebook fingerprint) awaiting a batch
+        self._pending: List[Tuple[str, str, str, str]] = []
+        self.rendered = 0
+        self.failed: Dict[str, str] = {}
+
+    def __enter__(self) -> "ReportQueue":
+        return self
+
+    def __exit__(self, *exc):
+        self.join()
+
+    def submit(
+        self,
+        output: Union[str, os.PathLike],
+        scene_id: Union[str, None] = None,
+        notebook: Union[str, os.PathLike, None] = None,
+    ):
+        """
+        output: path to an executed notebook
+        scene_id: manifest key of the scene (or stack) the notebook ran on
+        notebook: path to the notebook that was executed (default: output)
+
+        Queues the notebook's report unless it is current (see report_is_current)
+        """
+        stage = report_stage(notebook or output)
+        if report_is_current(output, self.manifest, scene_id, stage):
+            return
+        with self._lock:
+            self._pending.append((scene_id, stage, str(output), fingerprint([output])))
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Sends the queued reports to a worker, without waiting for a full batch
+        """
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        scene_ids, stages, outputs, _ = zip(*batch)
+        future = self._executor.submit(
+            render_batch, list(outputs), list(scene_ids), list(stages)
+        )
+        future.add_done_callback(lambda f: self._done(batch, f))
+
+    def _done(self, batch: List[Tuple[str, str, str, str]], future: Future):
+        try:
+            errors = future.result()
+        except Exception as e:
+            # the worker died
+            errors = [f"{type(e).__name__}: {e}"] * len(batch)
+        for (scene_id, stage, output, fp), error in zip(batch, errors):
+            if error:
+                self.failed[output] = error
+                print(f"Failed to render the report of {output}: {error}")
+            else:
+                self.rendered += 1
+            if self.manifest:
+                status = "failed" if error else "done"
+                self.manifest.mark(scene_id, stage, fp, status, error)
+
+    def join(self):
+        """
+        Renders the remaining queued reports and waits for every report
+        """
+        self.flush()
+        self._executor.shutdown(wait=True)
+        print(f"Rendered {self.rendered} reports, {len(self.failed)} failed")
@@ -0,0 +1,231 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Union
+
+import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config
+
+from util.instrument import count
+
+SAMPLE_BUCKET = "opera-pst-rs-pop1"
+SAMPLE_PREFIX = "products/RTC_S1/"
+
+# layer of an object key, from its suffix; static layers must sit under *_static_layers/
+LAYER_REGEX = re.compile(
+    r"(?P<static>_static_layers/.*)?"
+    r"_(?P<suffix>VV|VH|static_layover_shadow_mask|static_incidence_angle"
+    r"|static_local_incidence_angle)\.tif$"
+)
+LAYERS = {
+    "VV": "vv",
+    "VH": "vh",
+    "static_incidence_angle": "inc_angle",
+    "static_local_incidence_angle": "local_inc_angle",
+    "static_layover_shadow_mask": "ls_mask",
+}
+BURST_ID_REGEX = re.compile(r"(?<=S1_)T\d{3}-\d{6}-IW[123]")
+PROCESSING_TIMESTAMP_REGEX = re.compile(r"(?<=_\d{8}T\d{6}Z_)\d{8}T\d{6}Z(?=_S1)")
+
+
+def burst_id_from_path(pth: str) -> str:
+    """
+    Takes: path or S3 key of an OPERA RTC product
+
+    Returns: burst ID, e.g. "T064-135524-IW1"
+    """
+    results = BURST_ID_REGEX.search(pth)
+    if not results:
+        raise Exception(f"No burst ID found in path: {pth}")
+    return results.group(0)
+
+
+def processing_timestamp_from_path(pth: str) -> str:
+    """
+    Takes: path or S3 key of an OPERA RTC product
+
+    Returns: processing timestamp, e.g. "20230803T123456Z"
+    """
+    results = PROCESSING_TIMESTAMP_REGEX.search(pth)
+    if not results:
+        raise Exception(f"processing timestamp string not found in Sentinel-1 path: {pth}")
+    return results.group(0)
+
+
+def get_s3_client(max_workers: int = 16, **kwargs):
+    """
+    Takes:
+        max_workers: number of requests the client will send concurrently
+        kwargs: keyword arguments of boto3.client, e.g. endpoint_url of an S3 stand-in
+
+    Returns: boto3 S3 client with a connection per concurrent request
+    """
+    return boto3.client(
+        "s3", config=Config(max_pool_connections=max_workers), **kwargs
+    )
+
+
+def list_burst_keys(
+    opera_bursts: List[str],
+    bucket: str = SAMPLE_BUCKET,
+    prefix: str = SAMPLE_PREFIX,
+    client=None,
+    max_workers: int = 16,
+) -> List[str]:
+    """
+    Takes:
+        opera_bursts: OPERA burst IDs, e.g. "OPERA_L2_RTC-S1_T064-135524-IW1"
+                      (see burst_discovery.discover_bursts)
+        bucket: S3 bucket holding the sample bursts
+        prefix: key prefix of the bursts in the bucket
+        client: boto3 S3 client (default: get_s3_client(max_workers))
+        max_workers: number of burst prefixes to list concurrently
+
+    Lists every page of every burst prefix concurrently
+
+    Returns: keys of all objects under the burst prefixes, in the order of opera_bursts
+    """
+    client = client or get_s3_client(max_workers)
+    paginator = client.get_paginator("list_objects_v2")
+
+    def _list(burst):
+        pages = paginator.paginate(Bucket=bucket, Prefix=f"{prefix}{burst}")
+        return [obj["Key"] for page in pages for obj in page.get("Contents", [])]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return [key for keys in executor.map(_list, opera_bursts) for key in keys]
+
+
+def classify_keys(keys: List[str], s1_date_str: str) -> Dict[str, List[str]]:
+    """
+    Takes:
+        keys: S3 keys of OPERA RTC products (see list_burst_keys)
+        s1_date_str: acquisition date of the scene, e.g. "20230611"
+
+    Returns: Dictionary of keys by layer ("vv", "vh", "inc_angle", "local_inc_angle",
+             "ls_mask"), keeping backscatter acquired on s1_date_str and all static
+             layers
+    """
+    layer_keys = {layer: [] for layer in LAYERS.values()}
+    for key in keys:
+        results = LAYER_REGEX.search(key)
+        if not results:
+            continue
+        layer = LAYERS[results.group("suffix")]
+        if layer in ("vv", "vh"):
+            if s1_date_str not in key:
+                continue
+        elif not results.group("static"):
+            continue
+        layer_keys[layer].append(key)
+    return layer_keys
+
+
+def most_recently_processed_burst_filter(
+    layer_keys: Dict[str, List[str]], keep_date_index: int = -1
+) -> Dict[str, List[str]]:
+    """
+    Takes:
+        layer_keys: Dictionary of keys by layer (see classify_keys)
+        keep_date_index: processing run to keep for each burst, in chronological order
+                         (0: oldest, -1: most recent, -2: second most recent, ...)
+
+    The bucket holds bursts from several processing runs. Keeps one run of each burst
+    of each layer, in a single pass over the keys.
+
+    Returns: Dictionary of the kept keys by layer
+    """
+    runs = {}
+    for layer, keys in layer_keys.items():
+        for key in keys:
+            burst = (layer, burst_id_from_path(key))
+            runs.setdefault(burst, {})[processing_timestamp_from_path(key)] = key
+
+    kept = {layer: [] for layer in layer_keys}
+    for (layer, _), by_timestamp in runs.items():
+        timestamps = sorted(
+            by_timestamp, key=lambda ts: datetime.strptime(ts, "%Y%m%dT%H%M%SZ")
+        )
+        kept[layer].append(by_timestamp[timestamps[keep_date_index]])
+    return kept
+
+
+def download_keys(
+    layer_keys: Dict[str, List[str]],
+    layer_dirs: Dict[str, Union[str, Path]],
+    bucket: str = SAMPLE_BUCKET,
+    client=None,
+    max_workers: int = 16,
+    skip_existing: bool = True,
+) -> Dict[str, List[Path]]:
+    """
+    Takes:
+        layer_keys: Dictionary of keys by layer (see most_recently_processed_burst_filter)
+        layer_dirs: Dictionary of destination directories by layer
+        bucket: S3 bucket holding the keys
+        client: boto3 S3 client (default: get_s3_client(max_workers))
+        max_workers: number of concurrent transfers, shared by all files and parts
+        skip_existing: True to skip files that already exist in their destination
+
+    Downloads the keys of all layers through a single in-process transfer manager
+
+    Returns: Dictionary of the downloaded paths by layer
+    """
+    client = client or get_s3_client(max_workers)
+    config = TransferConfig(max_concurrency=max_workers)
+    paths = {layer: [] for layer in layer_keys}
+    futures = []
+    with create_transfer_manager(client, config) as manager:
+        for layer, keys in layer_keys.items():
+            for key in keys:
+                pth = Path(layer_dirs[layer]) / key.split("/")[-1]
+                paths[layer].append(pth)
+                if skip_existing and pth.exists():
+                    continue
+                futures.append((manager.download(bucket, key, str(pth)), pth))
+        # re-raise the first failed transfer
+        for future, pth in futures:
+            future.result()
+            count("downloaded_bytes", pth.stat().st_size)
+    print(f"Downloaded {len(futures)} files")
+    return paths
+
+
+def fetch_scene_bursts(
+    opera_bursts: List[str],
+    s1_date_str: str,
+    layer_dirs: Dict[str, Union[str, Path]],
+    keep_date_index: int = -1,
+    bucket: str = SAMPLE_BUCKET,
+    client=None,
+    max_workers: int = 16,
+) -> Dict[str, List[Path]]:
+    """
+    Takes:
+        opera_bursts: OPERA burst IDs of the scene (see burst_discovery.discover_bursts)
+        s1_date_str: acquisition date of the scene, e.g. "20230611"
+        layer_dirs: Dictionary of destination directories by layer ("vv", "vh",
+                    "inc_angle", "local_inc_angle", "ls_mask")
+        keep_date_index: processing run to keep for each burst
+                         (see most_recently_processed_burst_filter)
+        bucket: S3 bucket holding the sample bursts
+        client: boto3 S3 client (default: get_s3_client(max_workers))
+        max_workers: number of concurrent listings and transfers
+
+    Lists, selects, and downloads the backscatter and static layers of all bursts of
+    a scene
+
+    Returns: Dictionary of the downloaded paths by layer
+    """
+    client = client or get_s3_client(max_workers)
+    keys = list_burst_keys(opera_bursts, bucket, client=client, max_workers=max_workers)
+    layer_keys = most_recently_processed_burst_filter(
+        classify_keys(keys, s1_date_str), keep_date_index
+    )
+    for layer, layer_key_list in layer_keys.items():
+        print(f"{layer} length: {len(layer_key_list)}")
+    return download_keys(
+        layer_keys, layer_dirs, bucket, client=client, max_workers=max_workers
+    )
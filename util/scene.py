@@ -0,0 +1,133 @@
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import rioxarray
+import xarray as xr
+
+import util.geo as util
+
+# layer name: (burst directory created by the bulk validation scripts, burst glob pattern)
+LAYERS = {
+    "VV": ("vv_bursts", "*VV.tif"),
+    "VH": ("vh_bursts", "*VH.tif"),
+    "mask": ("layover_shadow_bursts", "*mask.tif"),
+    "local_incidence_angle": ("local_inc_angle_bursts", "*local_incidence_angle.tif"),
+    "incidence_angle": ("ellipsoidal_inc_angle_bursts", "*incidence_angle.tif"),
+}
+
+
+class OperaScene:
+    """
+    Lazy view of the OPERA RTC bursts of a single Sentinel-1 scene, stored in the
+    `OPERA_L2-RTC_<scene_id>_30_v1.0` directories created by the bulk validation scripts.
+
+    Each available layer (VV, VH, and the static layers) is exposed as a chunked,
+    dask-backed xarray.DataArray over a VRT of its bursts, in the scene's predominant
+    UTM projection. Bursts are never mosaicked to disk and pixels are only read when a
+    window of the array is computed.
+    """
+
+    def __init__(
+        self,
+        rtc_dir: Union[str, os.PathLike],
+        chunks: Union[int, Dict, str] = 2048,
+        predominant_epsg: Union[str, None] = None,
+    ):
+        """
+        rtc_dir: path to an `OPERA_L2-RTC_<scene_id>_30_v1.0` directory
+        chunks: dask chunk size passed to rioxarray.open_rasterio
+        predominant_epsg: a string epsg for all layers, or None to use the most common
+                          projection of the VV bursts (see util.geo.get_projection_counts)
+        """
+        self.rtc_dir = Path(rtc_dir)
+        self.chunks = chunks
+        self._predominant_epsg = predominant_epsg
+        self._arrays = {}
+
+        scene_id = re.search(r"(?<=OPERA_L2-RTC_).*(?=_30_v1.0)", self.rtc_dir.name)
+        self.scene_id = scene_id.group(0) if scene_id else self.rtc_dir.name
+
+    def __repr__(self) -> str:
+        return f"OperaScene({self.scene_id}, layers={self.layers})"
+
+    @property
+    def layers(self) -> List[str]:
+        """
+        Returns: names of the layers with at least one burst on disk
+        """
+        return [layer for layer in LAYERS if self.burst_paths(layer)]
+
+    @property
+    def predominant_epsg(self) -> str:
+        """
+        Returns: the string epsg into which all layers are projected
+        """
+        if not self._predominant_epsg:
+            epsgs = util.get_projection_counts(self.burst_paths(self.layers[0]))
+            self._predominant_epsg = max(epsgs, key=epsgs.get)
+        return self._predominant_epsg
+
+    def burst_paths(self, layer: str) -> List[Path]:
+        """
+        Takes: a layer name (see LAYERS)
+
+        Returns: sorted list of paths to the layer's bursts
+        """
+        burst_dir, pattern = LAYERS[layer]
+        return sorted((self.rtc_dir / burst_dir).glob(pattern))
+
+    def vrt(self, layer: str) -> Path:
+        """
+        Takes: a layer name (see LAYERS)
+
+        Returns: path to a VRT mosaicking the layer's bursts, (re)built only when
+                 it is missing or older than one of the bursts
+        """
+        bursts = self.burst_paths(layer)
+        if not bursts:
+            raise FileNotFoundError(f"No {layer} bursts found in {self.rtc_dir}")
+        vrt_dir = self.rtc_dir / "vrt"
+        vrt_dir.mkdir(exist_ok=True)
+        vrt_path = vrt_dir / f"OPERA_L2_RTC-S1_{layer}_{self.scene_id}_30_v1.0_mosaic.vrt"
+        if not vrt_path.exists() or vrt_path.stat().st_mtime < max(
+            p.stat().st_mtime for p in bursts
+        ):
+            util.build_mosaic_vrt(bursts, vrt_path, self.predominant_epsg)
+        return vrt_path
+
+    def __getitem__(self, layer: str) -> xr.DataArray:
+        """
+        Takes: a layer name (see LAYERS)
+
+        Returns: the layer as a lazily evaluated, chunked 2D DataArray, with
+                 no-data pixels masked to NaN
+        """
+        if layer not in self._arrays:
+            da = rioxarray.open_rasterio(
+                self.vrt(layer), chunks=self.chunks, masked=True, lock=False
+            )
+            self._arrays[layer] = da.squeeze("band", drop=True).rename(layer)
+        return self._arrays[layer]
+
+    def to_dataset(self, layers: Union[List[str], None] = None) -> xr.Dataset:
+        """
+        Takes: optional list of layer names, defaulting to all available layers
+
+        Returns: a lazy Dataset holding the layers as data variables
+        """
+        return xr.merge([self[layer] for layer in layers or self.layers])
+
+    def read_window(
+        self, layer: str, bounds: Tuple[float, float, float, float]
+    ) -> np.ndarray:
+        """
+        Takes:
+            layer: a layer name (see LAYERS)
+            bounds: window bounds (minx, miny, maxx, maxy) in the predominant projection
+
+        Returns: the window's pixels, reading only the chunks that intersect it
+        """
+        return self[layer].rio.clip_box(*bounds).values
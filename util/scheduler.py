@@ -0,0 +1,146 @@
+import threading
+from typing import Callable, Dict, Iterable, Union
+
+# stage statuses; stages depending on a failed or skipped stage are skipped
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class StageScheduler:
+    """
+    Runs a DAG of stages concurrently, within per-resource limits.
+
+    Each stage is a function, run in its own thread once every stage it depends on
+    is done and once the resources it holds while running (e.g. {"network": 1} or
+    {"cpu": 1, "memory_gb": 8}) fit in the limits next to the running stages. A stage
+    holding more of a resource than its limit runs once no other stage holds that
+    resource. Among the ready stages, the first added start first. Running stages may
+    add stages, e.g. once their outputs determine the work that follows.
+
+    Heavy stages should run their work in other processes (e.g. notebooks.start_job
+    or geo.assemble_scene), the threads only wait for them. A failed stage does not
+    stop the stages that do not depend on it.
+    """
+
+    def __init__(self, limits: Union[Dict[str, float], None] = None):
+        """
+        limits: Dictionary of the amount of each resource the running stages share,
+                e.g. {"network": 2, "cpu": 4, "memory_gb": 64}. Resources without a
+                limit are unlimited.
+        """
+        self.limits = dict(limits or {})
+        self._stages = {}
+        self._pending = []
+        self._cond = threading.Condition()
+        self.status: Dict[str, str] = {}
+        self.errors: Dict[str, str] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._stages
+
+    def add(
+        self,
+        key: str,
+        func: Callable[[], object],
+        deps: Iterable[str] = (),
+        resources: Union[Dict[str, float], None] = None,
+    ) -> str:
+        """
+        key: unique name of the stage, e.g. "download:<scene ID>"
+        func: function of no arguments running the stage; the stage fails if it raises
+        deps: keys of the stages to complete first, all added before this stage
+        resources: Dictionary of the amount of each resource the stage holds
+
+        Returns: key of the stage
+        """
+        deps = list(deps)
+        with self._cond:
+            if key in self._stages:
+                raise ValueError(f"Stage already added: {key}")
+            missing = [dep for dep in deps if dep not in self._stages]
+            if missing:
+                raise ValueError(f"{key} depends on stages not added yet: {missing}")
+            self._stages[key] = (func, deps, dict(resources or {}))
+            self._pending.append(key)
+            self._cond.notify()
+        return key
+
+    def _fits(self, resources: Dict[str, float], in_use: Dict[str, float]) -> bool:
+        return all(
+            not in_use.get(resource) or in_use[resource] + n <= self.limits[resource]
+            for resource, n in resources.items()
+            if resource in self.limits
+        )
+
+    def run(self) -> Dict[str, str]:
+        """
+        Runs every stage added, including the stages they add, and waits for them
+
+        Returns: Dictionary of the status of each stage (DONE, FAILED, or SKIPPED)
+        """
+        cond = self._cond
+        pending = self._pending
+        in_use = {}
+        running = set()
+
+        def _run(key: str, func: Callable, resources: Dict[str, float]):
+            error = None
+            try:
+                func()
+            except BaseException as e:
+                error = f"{type(e).__name__}: {e}"
+                # e.g. SystemExit: fail the stage, and let the exception end the thread
+                if not isinstance(e, Exception):
+                    raise
+            finally:
+                # always release the stage, so run() never waits for it
+                with cond:
+                    self.status[key] = FAILED if error else DONE
+                    if error:
+                        self.errors[key] = error
+                        print(f"{key}: failed ({error})")
+                    running.discard(key)
+                    for resource, n in resources.items():
+                        # no float residue may keep an oversized stage waiting
+                        in_use[resource] = (
+                            max(in_use[resource] - n, 0) if running else 0
+                        )
+                    cond.notify()
+
+        with cond:
+            while pending or running:
+                # stages are added after their dependencies, so one pass in order
+                # propagates skips down the DAG
+                for key in list(pending):
+                    func, deps, resources = self._stages[key]
+                    statuses = [self.status.get(dep) for dep in deps]
+                    if FAILED in statuses or SKIPPED in statuses:
+                        pending.remove(key)
+                        self.status[key] = SKIPPED
+                        print(f"{key}: skipped, a stage it depends on did not complete")
+                    elif all(status == DONE for status in statuses) and self._fits(
+                        resources, in_use
+                    ):
+                        pending.remove(key)
+                        running.add(key)
+                        for resource, n in resources.items():
+                            in_use[resource] = in_use.get(resource, 0) + n
+                        threading.Thread(
+                            target=_run,
+                            args=(key, func, resources),
+                            name=key,
+                            daemon=True,
+                        ).start()
+                if pending or running:
+                    cond.wait()
+
+        counts = {
+            status: list(self.status.values()).count(status)
+            for status in (DONE, FAILED, SKIPPED)
+        }
+        print(
+            f"{counts[DONE]} of {len(self._stages)} stages done, "
+            f"{counts[FAILED]} failed, {counts[SKIPPED]} skipped"
+        )
+        return dict(self.status)